@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+CRLChecker Notification Sinks Benchmark
+Пропускная способность каналов уведомлений на локальном приемнике webhook:
+- время постановки событий (сколько ждет монитор);
+- время доставки в JSONL-файл и в медленный webhook с несколькими потоками;
+- все события доставлены ровно в каждый канал, медленный webhook не задерживает файл.
+
+Локальный приемник webhook (WebhookStandIn) можно запустить и отдельно, для ручной проверки
+канала webhook работающего монитора: python bench_sinks.py --serve --port=8099 [--delay-ms=200] [--fail-ratio=0.1]
+и NOTIFY_SINKS=telegram,webhook NOTIFY_WEBHOOK_URL=http://127.0.0.1:8099/
+"""
+
+import sys
+import os
+import time
+import argparse
+import json
+import logging
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from notification_outbox import PRIORITY_NORMAL
+from notification_sinks import NotificationFanout, WebhookSink, FileSink
+
+
+class WebhookStandIn:
+    """Локальный приемник webhook: считает события и уникальные ключи, может отвечать с задержкой и 503."""
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0, fail_ratio=0.0):
+        self.delay = delay
+        self.fail_ratio = fail_ratio
+        self.requests = 0
+        self.failed = 0
+        self.keys = set()
+        self.received = 0
+        self._cond = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if standin.delay:
+                    time.sleep(standin.delay)
+                status = 200 if standin._accept(body) else 503
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _accept(self, body):
+        with self._cond:
+            self.requests += 1
+            # Детерминированная доля ошибок: каждый 1/fail_ratio-й запрос
+            if int(self.requests * self.fail_ratio) != int((self.requests - 1) * self.fail_ratio):
+                self.failed += 1
+                return False
+            try:
+                key = json.loads(body).get('key')
+            except ValueError:
+                key = None
+            self.received += 1
+            self.keys.add(key)
+            self._cond.notify_all()
+            return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="WebhookStandIn", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def serve(args):
+    standin = WebhookStandIn('127.0.0.1', args.port, args.delay_ms / 1000.0, args.fail_ratio)
+    print(f"📡 Приемник webhook: {standin.start()}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"Запросов {standin.requests}, принято {standin.received}, уникальных ключей {len(standin.keys)}, ошибок {standin.failed}")
+    except KeyboardInterrupt:
+        standin.stop()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк каналов уведомлений')
+    parser.add_argument('--events', type=int, default=2000, help='Количество событий')
+    parser.add_argument('--workers', type=int, default=4, help='Потоков отправки webhook')
+    parser.add_argument('--delay-ms', type=int, default=20, help='Задержка ответа приемника webhook, мс')
+    parser.add_argument('--fail-ratio', type=float, default=0.0, help='Доля ответов 503 (проверка повторов)')
+    parser.add_argument('--serve', action='store_true', help='Только запустить приемник webhook (без бенчмарка)')
+    parser.add_argument('--port', type=int, default=8099, help='Порт приемника для --serve')
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args)
+    # Предупреждения о повторах при --fail-ratio не нужны в выводе бенчмарка
+    logging.basicConfig(level=logging.ERROR)
+
+    standin = WebhookStandIn(delay=args.delay_ms / 1000.0, fail_ratio=args.fail_ratio)
+    url = standin.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'notifications.jsonl')
+        webhook = WebhookSink(url, timeout=10, workers=args.workers, max_attempts=5, queue_size=args.events)
+        # Повторы без пауз: бенчмарк меряет пропускную способность, а не бэкофф
+        webhook.retry_delay = lambda attempt: 0
+        file_sink = FileSink(path, queue_size=args.events)
+        fanout = NotificationFanout([webhook, file_sink])
+        fanout.start()
+
+        started = time.monotonic()
+        for i in range(args.events):
+            fanout.publish(f"<b>Событие {i}</b>", PRIORITY_NORMAL, key=f"bench:{i}", title="Бенчмарк", summary=f"событие {i}")
+        publish_time = time.monotonic() - started
+        file_sink.flush(600)
+        file_time = time.monotonic() - started
+        webhook.flush(600)
+        webhook_time = time.monotonic() - started
+        fanout.stop()
+
+        with open(path, encoding='utf-8') as f:
+            file_lines = sum(1 for _ in f)
+    standin.stop()
+
+    print(f"📨 Событий: {args.events}, webhook: {args.workers} потоков, задержка приемника {args.delay_ms} мс")
+    print(f"{'Этап':<22}{'Время, с':>12}{'Событий/с':>14}")
+    print(f"{'Постановка':<22}{publish_time:>12.3f}{args.events / max(publish_time, 1e-9):>14.0f}")
+    print(f"{'JSONL-файл':<22}{file_time:>12.3f}{args.events / max(file_time, 1e-9):>14.0f}")
+    print(f"{'Webhook':<22}{webhook_time:>12.3f}{args.events / max(webhook_time, 1e-9):>14.0f}")
+    if args.fail_ratio:
+        print(f"Ответов 503: {standin.failed} (повторены)")
+
+    if file_lines != args.events or len(standin.keys) != args.events:
+        print(f"❌ Доставлено не все: файл {file_lines}, webhook {len(standin.keys)} уникальных ключей")
+        return 1
+    print("✅ Все события доставлены в оба канала")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+CRLChecker TSL Benchmark
+Сравнение разбора TSL.xml на синтетическом TSL:
+- полный DOM (ET.fromstring) против потокового iterparse — время и пик памяти;
+- извлечение полей УЦ повторными find('.//...') против индекса за один обход.
+Проверяет идентичность результата.
+"""
+
+import sys
+import os
+import time
+import argparse
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from tsl_parser import stream_tsl, extract_ca, CA_TAG, _txt
+from utils import parse_tsl_datetime
+
+
+def generate_tsl(ca_count, cert_kb=8, keys=4):
+    """Синтетический TSL: ca_count УЦ (каждый десятый недействующий), keys ключей на УЦ с сертификатом ~cert_kb КБ base64."""
+    cert_data = 'QUFB' * (cert_kb * 256)
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<АккредитованныеУдостоверяющиеЦентры xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:noNamespaceSchemaLocation="schema.xsd"><Версия>100</Версия><Дата>2024-01-01T00:00:00Z</Дата>'
+    ]
+    for i in range(ca_count):
+        status = 'Действует' if i % 10 else 'Прекращена'
+        parts.append(
+            f'<УдостоверяющийЦентр><Название>УЦ {i}</Название><КраткоеНазвание>U{i}</КраткоеНазвание>'
+            f'<ОГРН>10{i:011d}</ОГРН><ИНН>77{i:08d}</ИНН><РеестровыйНомер>{i}</РеестровыйНомер>'
+            f'<СтатусАккредитации><Статус>{status}</Статус><ДействуетС>2020-01-01T00:00:00Z</ДействуетС></СтатусАккредитации>'
+            '<ИсторияСтатусовАккредитации>'
+            '<СтатусАккредитации><Статус>Действует</Статус><ДействуетС>2019-01-01T00:00:00Z</ДействуетС></СтатусАккредитации>'
+            '<СтатусАккредитации><Статус>Действует</Статус><ДействуетС>2020-01-01T00:00:00Z</ДействуетС></СтатусАккредитации>'
+            '</ИсторияСтатусовАккредитации>'
+            '<ПрограммноАппаратныеКомплексы><ПрограммноАппаратныйКомплекс><Псевдоним>pak</Псевдоним>'
+            '<КлассСредствЭП>КС1</КлассСредствЭП><СредстваУЦ>CryptoPro УЦ 2.0</СредстваУЦ>'
+            '<КлючиУполномоченныхЛиц>' + ''.join(
+                f'<Ключ><ИдентификаторКлюча>{i:036x}{k:04x}</ИдентификаторКлюча>'
+                f'<АдресаСписковОтзыва><Адрес>http://ca{i}.example.ru/cdp/{i:036x}{k:04x}.crl</Адрес>'
+                f'<Адрес>http://mirror.example.ru/cdp/{i:036x}{k:04x}.crl</Адрес></АдресаСписковОтзыва>'
+                f'<Сертификаты><ДанныеСертификата><Отпечаток>{i:036X}{k:04X}</Отпечаток><КемВыдан>CN=Root</КемВыдан>'
+                f'<КомуВыдан>CN=УЦ {i}</КомуВыдан><СерийныйНомер>{i:016x}{k:04x}</СерийныйНомер>'
+                '<ПериодДействияС>2020-01-01T00:00:00Z</ПериодДействияС><ПериодДействияДо>2030-01-01T00:00:00Z</ПериодДействияДо>'
+                f'<Данные>{cert_data}</Данные></ДанныеСертификата></Сертификаты></Ключ>'
+                for k in range(keys)
+            ) + '</КлючиУполномоченныхЛиц>'
+            '</ПрограммноАппаратныйКомплекс></ПрограммноАппаратныеКомплексы></УдостоверяющийЦентр>'
+        )
+    parts.append('</АккредитованныеУдостоверяющиеЦентры>')
+    return ''.join(parts).encode('utf-8')
+
+
+def extract_ca_find(ca_element):
+    """Прежнее извлечение полей: отдельный поиск по всему поддереву УЦ на каждое поле."""
+    status_element = ca_element.find('.//Статус')
+    if status_element is None or status_element.text != 'Действует':
+        return None
+    effective_date_iso = None
+    for status in reversed(ca_element.findall('.//ИсторияСтатусовАккредитации/СтатусАккредитации')):
+        status_type_elem = status.find('Статус')
+        if status_type_elem is not None and status_type_elem.text == 'Действует':
+            date_elem = status.find('ДействуетС')
+            if date_elem is not None and date_elem.text:
+                dt_obj = parse_tsl_datetime(date_elem.text)
+                if dt_obj:
+                    effective_date_iso = dt_obj.isoformat()
+                    break
+    if not effective_date_iso:
+        main_status = ca_element.find('.//СтатусАккредитации')
+        if main_status is not None:
+            status_type_elem = main_status.find('Статус')
+            date_elem = main_status.find('ДействуетС')
+            if status_type_elem is not None and status_type_elem.text == 'Действует' and date_elem is not None and date_elem.text:
+                dt_obj = parse_tsl_datetime(date_elem.text)
+                if dt_obj:
+                    effective_date_iso = dt_obj.isoformat()
+    crl_urls = []
+    for crl_addr in ca_element.findall('.//АдресаСписковОтзыва/Адрес'):
+        url = _txt(crl_addr)
+        if url and url not in crl_urls:
+            crl_urls.append(url)
+    valid_from = _txt(ca_element.find('.//ДействителенС')) or _txt(ca_element.find('.//ДействуетС'))
+    valid_to = _txt(ca_element.find('.//ДействителенПо')) or _txt(ca_element.find('.//ДействуетПо'))
+    cert_validity = None
+    if valid_from and valid_to:
+        cert_validity = f"{valid_from} — {valid_to}"
+    elif valid_from or valid_to:
+        cert_validity = valid_from or valid_to
+    name_element = ca_element.find('.//Название')
+    return {
+        'reg_number': _txt(ca_element.find('.//РеестровыйНомер')),
+        'name': name_element.text.strip() if name_element is not None and name_element.text else None,
+        'ogrn': _txt(ca_element.find('.//ОГРН')),
+        'effective_date': effective_date_iso,
+        'crl_urls': crl_urls,
+        'ca_tool': _txt(ca_element.find('.//СредстваУЦ')) or _txt(ca_element.find('.//СредствоУЦ')) or _txt(ca_element.find('.//Средство')),
+        'ca_tool_class': _txt(ca_element.find('.//КлассСредствЭП')) or _txt(ca_element.find('.//КлассСредстваУЦ')) or _txt(ca_element.find('.//КлассСредства')),
+        'cert_subject': _txt(ca_element.find('.//Субъект')) or _txt(ca_element.find('.//КомуВыдан')),
+        'cert_issuer': _txt(ca_element.find('.//Издатель')) or _txt(ca_element.find('.//КемВыдан')),
+        'cert_serial': _txt(ca_element.find('.//СерийныйНомер')),
+        'cert_validity': cert_validity,
+        'cert_fingerprint': _txt(ca_element.find('.//Отпечаток')) or _txt(ca_element.find('.//ОтпечатокСертификата')),
+        'crl_number': _txt(ca_element.find('.//СерийныйНомерCRL')) or _txt(ca_element.find('.//НомерCRL')),
+        'issuer_key_id': _txt(ca_element.find('.//ИдентификаторКлючаИздателя')) or _txt(ca_element.find('.//ИдентификаторКлюча')),
+    }
+
+
+def extract_all(extractor, ca_elements):
+    results = []
+    for ca_element in ca_elements:
+        ca = extractor(ca_element)
+        if ca is not None:
+            results.append(ca)
+    return results
+
+
+def time_best(func, repeat):
+    """Возвращает (результат, лучшее время)."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def parse_dom(xml_bytes):
+    """Прежний способ: декодирование в str и полный DOM."""
+    root = ET.fromstring(xml_bytes.decode('utf-8', errors='ignore'))
+    return extract_all(extract_ca_find, root.findall(f'.//{CA_TAG}'))
+
+
+def parse_stream(xml_bytes):
+    _, results = stream_tsl(xml_bytes)
+    return results
+
+
+def measure(func, xml_bytes, repeat):
+    """Возвращает (результат, лучшее время, пик памяти в байтах)."""
+    result, best = time_best(lambda: func(xml_bytes), repeat)
+    tracemalloc.start()
+    func(xml_bytes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк разбора TSL.xml')
+    parser.add_argument('--cas', type=int, default=3000, help='Количество УЦ в синтетическом TSL')
+    parser.add_argument('--cert-kb', type=int, default=8, help='Размер base64 сертификата УЦ, КБ')
+    parser.add_argument('--keys', type=int, default=4, help='Количество ключей (сертификатов) на УЦ')
+    parser.add_argument('--repeat', type=int, default=3, help='Количество повторов для замера времени')
+    parser.add_argument('--file', help='Использовать реальный TSL.xml вместо синтетического')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as f:
+            xml_bytes = f.read()
+    else:
+        xml_bytes = generate_tsl(args.cas, args.cert_kb, args.keys)
+    print(f"📄 TSL: {len(xml_bytes) / 1024 / 1024:.1f} МБ")
+
+    dom_result, dom_time, dom_peak = measure(parse_dom, xml_bytes, args.repeat)
+    stream_result, stream_time, stream_peak = measure(parse_stream, xml_bytes, args.repeat)
+
+    print(f"{'Способ':<12}{'Время, с':>12}{'Пик памяти, МБ':>18}")
+    print(f"{'DOM':<12}{dom_time:>12.3f}{dom_peak / 1024 / 1024:>18.1f}")
+    print(f"{'iterparse':<12}{stream_time:>12.3f}{stream_peak / 1024 / 1024:>18.1f}")
+
+    # Извлечение полей на одном и том же DOM: find('.//...') на каждое поле против индекса
+    ca_elements = ET.fromstring(xml_bytes).findall(f'.//{CA_TAG}')
+    find_result, find_time = time_best(lambda: extract_all(extract_ca_find, ca_elements), args.repeat)
+    index_result, index_time = time_best(lambda: extract_all(extract_ca, ca_elements), args.repeat)
+    print(f"\nИзвлечение полей ({len(ca_elements)} УЦ):")
+    print(f"{'find':<12}{find_time:>12.3f}")
+    print(f"{'индекс':<12}{index_time:>12.3f}   ускорение x{find_time / index_time:.1f}")
+
+    if not (dom_result == stream_result == find_result == index_result):
+        print("❌ Результаты разбора различаются")
+        return 1
+    print(f"✅ Результаты идентичны: {len(stream_result)} действующих УЦ")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# ./ca_registry.py
+"""
+In-memory реестр УЦ для CRL Monitor.
+
+Индексы по URL CRL, реестровому номеру, идентификатору ключа (SKI) и subject DN
+сертификатов УЦ строятся из таблиц ca_mapping и ca_keys и перестраиваются только при смене версии TSL
+(по данным tsl_versions). Обработка CRL не обращается к SQLite за поиском УЦ.
+"""
+import logging
+import re
+import threading
+
+from db import ca_mapping_get_all, ca_keys_get_all, tsl_versions_get_last
+from url_canon import normalize_url
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_key_id(key_id):
+    """Нормализация идентификатора ключа: только hex-символы в верхнем регистре."""
+    if not key_id:
+        return None
+    normalized = re.sub(r'[^0-9A-Fa-f]', '', str(key_id)).upper()
+    return normalized or None
+
+
+def normalize_dn(dn):
+    """Нормализация DN для сравнения: без регистра и пробелов вокруг разделителей."""
+    if not dn:
+        return None
+    normalized = re.sub(r'\s*([,=+])\s*', r'\1', str(dn).strip()).casefold()
+    return normalized or None
+
+
+class _RegistrySnapshot:
+    """Неизменяемый снимок индексов реестра (заменяется целиком при перезагрузке)."""
+
+    def __init__(self, token=None, by_url=None, by_reg_number=None, by_key_id=None, by_subject=None):
+        self.token = token
+        self.by_url = by_url or {}
+        self.by_reg_number = by_reg_number or {}
+        self.by_key_id = by_key_id or {}
+        self.by_subject = by_subject or {}
+
+
+class CARegistry:
+    def __init__(self):
+        self._snapshot = _RegistrySnapshot()
+        self._lock = threading.Lock()
+        self._force_reload = True
+
+    @staticmethod
+    def _build(mapping, token, keys=None):
+        by_url = {}
+        by_reg_number = {}
+        by_key_id = {}
+        by_subject = {}
+        for url, info in (mapping or {}).items():
+            if not url or not info:
+                continue
+            entry = {
+                'name': info.get('name'),
+                'reg_number': info.get('reg_number'),
+                'crl_number': info.get('crl_number'),
+                'issuer_key_id': info.get('issuer_key_id'),
+            }
+            by_url[normalize_url(url)] = entry
+            if entry['reg_number']:
+                by_reg_number.setdefault(entry['reg_number'], entry)
+            key_id = normalize_key_id(entry['issuer_key_id'])
+            if key_id:
+                by_key_id.setdefault(key_id, entry)
+        # Ключи из сертификатов TSL: все ключи УЦ, а не только первый из карты URL -> УЦ
+        for key in keys or []:
+            entry = by_reg_number.get(key.get('reg_number')) or {
+                'name': key.get('name'),
+                'reg_number': key.get('reg_number'),
+                'crl_number': None,
+                'issuer_key_id': key.get('key_id'),
+            }
+            if entry['reg_number'] and entry['reg_number'] not in by_reg_number:
+                by_reg_number[entry['reg_number']] = entry
+            key_id = normalize_key_id(key.get('key_id'))
+            if key_id:
+                by_key_id[key_id] = entry
+            subject = normalize_dn(key.get('subject_dn'))
+            if subject:
+                by_subject.setdefault(subject, entry)
+        return _RegistrySnapshot(token, by_url, by_reg_number, by_key_id, by_subject)
+
+    def current_token(self):
+        """Токен версии TSL из БД: (version, xml_sha256) или None."""
+        last = tsl_versions_get_last()
+        if not last:
+            return None
+        return last[0], last[1].get('xml_sha256')
+
+    def invalidate(self):
+        """Принудительная перезагрузка при следующей проверке (например, после записи ca_mapping)."""
+        self._force_reload = True
+
+    def reload_if_changed(self):
+        """Перезагружает индексы, если в tsl_versions появилась новая версия. Возвращает True при перезагрузке."""
+        try:
+            token = self.current_token()
+        except Exception as e:
+            logger.error(f"Не удалось получить версию TSL для реестра УЦ: {e}")
+            return False
+        if not self._force_reload and token == self._snapshot.token:
+            return False
+        with self._lock:
+            if not self._force_reload and token == self._snapshot.token:
+                return False
+            try:
+                mapping = ca_mapping_get_all()
+                keys = ca_keys_get_all()
+            except Exception as e:
+                logger.error(f"Ошибка загрузки реестра УЦ из БД: {e}")
+                return False
+            if not mapping and self._snapshot.by_url:
+                # Пустая таблица не должна затирать уже загруженный реестр (например, seed из JSON)
+                logger.warning("Таблица ca_mapping пуста, реестр УЦ оставлен без изменений")
+                self._force_reload = False
+                return False
+            self._snapshot = self._build(mapping, token, keys)
+            self._force_reload = False
+        logger.info(f"Реестр УЦ перезагружен: версия TSL={token[0] if token else None}, URL={len(self._snapshot.by_url)}, "
+                    f"УЦ={len(self._snapshot.by_reg_number)}, ключей={len(self._snapshot.by_key_id)}, DN={len(self._snapshot.by_subject)}")
+        return True
+
+    def seed(self, mapping):
+        """Первичное заполнение реестра из карты URL -> УЦ (если в БД еще нет данных)."""
+        if not mapping:
+            return
+        with self._lock:
+            self._snapshot = self._build(mapping, self._snapshot.token)
+        logger.info(f"Реестр УЦ заполнен из карты URL -> УЦ: {len(mapping)} URL")
+
+    def is_empty(self):
+        return not self._snapshot.by_url
+
+    def get_by_url(self, url):
+        if not url:
+            return None
+        return self._snapshot.by_url.get(normalize_url(url))
+
+    def get_by_reg_number(self, reg_number):
+        return self._snapshot.by_reg_number.get(reg_number) if reg_number else None
+
+    def get_by_key_id(self, key_id):
+        key_id = normalize_key_id(key_id)
+        return self._snapshot.by_key_id.get(key_id) if key_id else None
+
+    def get_by_subject(self, dn):
+        dn = normalize_dn(dn)
+        return self._snapshot.by_subject.get(dn) if dn else None
+
+    def lookup(self, url=None, issuer_key_id=None, issuer_dn=None):
+        """Поиск УЦ: по идентификатору ключа издателя (AKI CRL = SKI сертификата УЦ), затем по URL, затем по DN издателя."""
+        return self.get_by_key_id(issuer_key_id) or self.get_by_url(url) or self.get_by_subject(issuer_dn)
+
+
+# Общий экземпляр реестра для мониторов в одном процессе
+ca_registry = CARegistry()
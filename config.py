@@ -34,6 +34,40 @@ NOTIFY_MISSED_CRL = os.getenv('NOTIFY_MISSED_CRL', 'true').lower() == 'true'  #
 NOTIFY_WEEKLY_STATS = os.getenv('NOTIFY_WEEKLY_STATS', 'true').lower() == 'true'  # Недельная статистика
 NOTIFY_CRL_DOWNLOAD_FAIL = os.getenv('NOTIFY_CRL_DOWNLOAD_FAIL', 'false').lower() == 'true'  # Ошибки скачивания CRL
 
+# Очередь уведомлений: мониторы ставят сообщения в очередь и сразу продолжают работу,
+# отправка идет в отдельном потоке в порядке приоритета (истекшие CRL — первыми).
+# NOTIFY_ASYNC=false — синхронная отправка из потока монитора (прежнее поведение)
+NOTIFY_ASYNC = os.getenv('NOTIFY_ASYNC', 'true').lower() == 'true'
+# Сколько секунд при остановке ждать отправки оставшихся в очереди сообщений
+NOTIFY_SHUTDOWN_FLUSH_SECONDS = int(os.getenv('NOTIFY_SHUTDOWN_FLUSH_SECONDS', '30'))
+# Очередь хранится в БД (таблица notification_outbox) и переживает рестарт: отправитель забирает
+# уведомления пачками по NOTIFY_OUTBOX_BATCH_SIZE, неудачные повторяет с бэкоффом до NOTIFY_OUTBOX_MAX_ATTEMPTS раз.
+# Доставленные уведомления и их ключи идемпотентности хранятся NOTIFY_OUTBOX_RETENTION_DAYS дней
+NOTIFY_OUTBOX_BATCH_SIZE = int(os.getenv('NOTIFY_OUTBOX_BATCH_SIZE', '20'))
+NOTIFY_OUTBOX_MAX_ATTEMPTS = int(os.getenv('NOTIFY_OUTBOX_MAX_ATTEMPTS', '10'))
+NOTIFY_OUTBOX_RETENTION_DAYS = int(os.getenv('NOTIFY_OUTBOX_RETENTION_DAYS', '7'))
+# Сводки: события одного цикла проверки CRL или одной проверки TSL собираются и отправляются
+# сгруппированными сообщениями (до 4096 символов), если их не меньше NOTIFY_DIGEST_MIN_EVENTS.
+# Алерты приоритета critical/high (истекшие, истекающие, неопубликованные CRL, ошибки скачивания) отправляются сразу
+NOTIFY_DIGEST = os.getenv('NOTIFY_DIGEST', 'true').lower() == 'true'
+NOTIFY_DIGEST_MIN_EVENTS = int(os.getenv('NOTIFY_DIGEST_MIN_EVENTS', '3'))
+# Дедупликация уведомлений: повтор события (тип, CRL/УЦ, версия, порог) в течение NOTIFY_DEDUP_TTL_HOURS
+# подавляется (0 — отключить). В памяти хранится до NOTIFY_DEDUP_CACHE_SIZE последних ключей, остальные — в БД
+NOTIFY_DEDUP_TTL_HOURS = float(os.getenv('NOTIFY_DEDUP_TTL_HOURS', '24'))
+NOTIFY_DEDUP_CACHE_SIZE = int(os.getenv('NOTIFY_DEDUP_CACHE_SIZE', '10000'))
+# Табло состояния: одно сообщение в чате со сводкой состояния CRL, которое в конце каждого цикла проверки
+# редактируется (editMessageText), если содержимое изменилось. STATUS_BOARD_PIN — закрепить табло при создании,
+# STATUS_BOARD_MAX_ITEMS — сколько CRL перечислять в каждой категории
+STATUS_BOARD = os.getenv('STATUS_BOARD', 'false').lower() == 'true'
+STATUS_BOARD_PIN = os.getenv('STATUS_BOARD_PIN', 'true').lower() == 'true'
+STATUS_BOARD_MAX_ITEMS = int(os.getenv('STATUS_BOARD_MAX_ITEMS', '10'))
+# Ограничение частоты запросов к Telegram (token bucket): не больше TELEGRAM_CHAT_RATE_PER_MIN сообщений
+# в минуту в один чат (лимит Telegram для групп — 20) с всплеском до TELEGRAM_CHAT_BURST подряд
+# и не больше TELEGRAM_GLOBAL_RATE_PER_SEC сообщений в секунду суммарно (лимит бота — 30)
+TELEGRAM_CHAT_RATE_PER_MIN = float(os.getenv('TELEGRAM_CHAT_RATE_PER_MIN', '20'))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+TELEGRAM_GLOBAL_RATE_PER_SEC = float(os.getenv('TELEGRAM_GLOBAL_RATE_PER_SEC', '30'))
+
 # --- Остальные настройки ---
 # Список CDP источников
 # Источники CRL (CDP - Certificate Distribution Points)
@@ -48,6 +82,13 @@ else:
         # Добавьте новые источники здесь
     ]
 
+# Наборы хостов-зеркал CRL: одноименные CRL на хостах одного набора считаются одной CRL.
+# Хосты CDP_SOURCES образуют набор по умолчанию. Формат: CRL_MIRROR_HOSTS=a.ru,b.ru;c.ru,d.ru
+CRL_MIRROR_HOSTS = [
+    [host.strip().lower() for host in hosts.split(',') if host.strip()]
+    for hosts in os.getenv('CRL_MIRROR_HOSTS', '').split(';') if hosts.strip()
+]
+
 # Известные пути к CRL файлам (резервный метод)
 KNOWN_CRL_PATHS = [
     # 'crl1.crl',
@@ -75,6 +116,8 @@ TSL_CHECK_INTERVAL_HOURS = 3
 
 # --- Метрики и здоровье ---
 METRICS_PORT = int(os.getenv('METRICS_PORT', '8000'))
+# Сколько разных хостов получают собственное значение метки host в гистограммах загрузки (остальные — 'other')
+METRICS_MAX_HOSTS = int(os.getenv('METRICS_MAX_HOSTS', '100'))
 
 # --- Конфигурация для CRL Monitor ---
 # Режим работы: только ФНС (true) или все УЦ из TSL (false)
@@ -95,6 +138,23 @@ DB_PATH = f'{DATA_DIR}/crlchecker.db'
 # Путь к файлу с URL CRL из TSL (используется в crl_monitor.py)
 TSL_CRL_URLS_FILE = os.path.join(DATA_DIR, 'crl_urls_from_tsl.txt')
 
+# Докачка TSL и CRL (HTTP Range): недокачанные файлы сохраняются в partial/ и продолжаются со смещения.
+# Частичные загрузки меньше DOWNLOAD_RESUME_MIN_BYTES не сохраняются, старше DOWNLOAD_PARTIAL_MAX_AGE_HOURS — удаляются
+DOWNLOAD_PARTIAL_DIR = os.getenv('DOWNLOAD_PARTIAL_DIR', os.path.join(DATA_DIR, 'partial'))
+DOWNLOAD_RESUME_MIN_BYTES = int(os.getenv('DOWNLOAD_RESUME_MIN_BYTES', str(256 * 1024)))
+DOWNLOAD_PARTIAL_MAX_AGE_HOURS = int(os.getenv('DOWNLOAD_PARTIAL_MAX_AGE_HOURS', '24'))
+
+# Каналы уведомлений (NOTIFY_SINKS через запятую): telegram, webhook, file (JSONL), stdout. Событие формируется
+# один раз и передается всем каналам. У Telegram очередь notification_outbox; у остальных каналов — своя очередь
+# в памяти (до NOTIFY_SINK_QUEUE_SIZE событий), свои потоки и повторы: медленный webhook не задерживает Telegram
+NOTIFY_SINKS = [s.strip().lower() for s in os.getenv('NOTIFY_SINKS', 'telegram').split(',') if s.strip()]
+NOTIFY_SINK_QUEUE_SIZE = int(os.getenv('NOTIFY_SINK_QUEUE_SIZE', '10000'))
+NOTIFY_WEBHOOK_URL = os.getenv('NOTIFY_WEBHOOK_URL', '')
+NOTIFY_WEBHOOK_TIMEOUT = float(os.getenv('NOTIFY_WEBHOOK_TIMEOUT', '10'))
+NOTIFY_WEBHOOK_WORKERS = int(os.getenv('NOTIFY_WEBHOOK_WORKERS', '2'))
+NOTIFY_WEBHOOK_MAX_ATTEMPTS = int(os.getenv('NOTIFY_WEBHOOK_MAX_ATTEMPTS', '5'))
+NOTIFY_JSONL_FILE = os.getenv('NOTIFY_JSONL_FILE', os.path.join(DATA_DIR, 'notifications.jsonl'))
+
 # Таймаут для проверки доступности (в секундах)
 AVAILABILITY_TIMEOUT = 10
 
@@ -108,6 +168,28 @@ DB_ENABLED = True
 # Показывать размер CRL в уведомлениях
 SHOW_CRL_SIZE_MB = True
 
+# История версий CRL (таблица crl_versions): сколько дней хранить все версии,
+# до какого возраста хранить по одной версии в сутки (дальше — по одной в неделю)
+# и через сколько дней удалять историю полностью
+CRL_HISTORY_FULL_DAYS = int(os.getenv('CRL_HISTORY_FULL_DAYS', '90'))
+CRL_HISTORY_DAILY_DAYS = int(os.getenv('CRL_HISTORY_DAILY_DAYS', '365'))
+CRL_HISTORY_RETENTION_DAYS = int(os.getenv('CRL_HISTORY_RETENTION_DAYS', '1825'))
+
+# Ретеншн и компактизация БД (выполняется в отдельном потоке, вне циклов проверки)
+RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', 'true').lower() == 'true'
+RETENTION_INTERVAL_HOURS = int(os.getenv('RETENTION_INTERVAL_HOURS', '24'))
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '500'))
+TSL_SNAPSHOT_KEEP_VERSIONS = int(os.getenv('TSL_SNAPSHOT_KEEP_VERSIONS', '60'))  # Сколько последних версий TSL хранить со снимками УЦ
+TSL_DIFFS_RETENTION_DAYS = int(os.getenv('TSL_DIFFS_RETENTION_DAYS', '730'))
+WEEKLY_DETAILS_RETENTION_WEEKS = int(os.getenv('WEEKLY_DETAILS_RETENTION_WEEKS', '104'))  # Старше — сворачиваются в помесячные агрегаты
+MAINTAINED_CSV_RETENTION_WEEKS = int(os.getenv('MAINTAINED_CSV_RETENTION_WEEKS', '104'))  # Старше — переносятся в архив stats/maintained_archive.csv.gz
+URL_INVENTORY_RETENTION_DAYS = int(os.getenv('URL_INVENTORY_RETENTION_DAYS', '365'))  # Дельты инвентаря URL CRL
+RETENTION_FULL_VACUUM = os.getenv('RETENTION_FULL_VACUUM', 'false').lower() == 'true'  # Однократный VACUUM для перевода старой БД в auto_vacuum=INCREMENTAL
+
+# Пакетная загрузка архива TSL (tsl_monitor.py --backfill-dir=<каталог>)
+TSL_BACKFILL_WORKERS = int(os.getenv('TSL_BACKFILL_WORKERS', '0'))  # 0 — по числу CPU
+TSL_BACKFILL_BATCH_VERSIONS = int(os.getenv('TSL_BACKFILL_BATCH_VERSIONS', '50'))  # Версий TSL на одну транзакцию
+
 # Фильтры TSL
 TSL_OGRN_LIST = os.getenv('TSL_OGRN_LIST', '').split(',') if os.getenv('TSL_OGRN_LIST') else None
 TSL_REGISTRY_NUMBERS = os.getenv('TSL_REGISTRY_NUMBERS', '').split(',') if os.getenv('TSL_REGISTRY_NUMBERS') else None
\ No newline at end of file
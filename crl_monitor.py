@@ -5,15 +5,28 @@ import json
 import schedule
 import time
 import logging
+import hashlib
+import queue
+from urllib.parse import urlparse
 from datetime import datetime, timedelta, timezone
 from collections import defaultdict
 from config import *
-from db import init_db, get_ca_by_crl_url
+from db import init_db
+from ca_registry import ca_registry
+from tsl_cache import tsl_cache
+from url_events import crl_url_channel, UrlSetFileWatcher
+from url_inventory import UrlInventory
+from url_canon import normalize_url, group_crl_urls
 from crl_parser import CRLParser
 from telegram_notifier import TelegramNotifier
-from metrics import crl_checks_total, crl_processed_total, crl_unique_urls, crl_skipped_empty, crl_download_errors, crl_parse_errors, crl_status
-from db import weekly_details_bulk_upsert
-from utils import ensure_moscow_tz, parse_datetime_with_tz, get_current_time_msk, setup_logging
+from status_board import StatusBoard, render_crl_status
+from notification_sinks import shutdown_notifications
+from metrics_server import start_metrics_server
+from retention import start_retention_thread
+from metrics import crl_checks_total, crl_processed_total, crl_unique_urls, crl_skipped_empty, crl_download_errors, crl_parse_errors
+from metrics import crl_cycle_duration_seconds, crl_cycle_lag_seconds, observe_stage, crl_state_collector
+from db import weekly_details_bulk_upsert, crl_versions_append
+from utils import ensure_moscow_tz, parse_datetime_with_tz, get_current_time_msk, setup_logging, install_sigterm_handler
 
 # Настройка логирования
 logging.basicConfig(
@@ -31,7 +44,7 @@ TSL_CRL_URLS_FILE = os.path.join(DATA_DIR, 'crl_urls_from_tsl.txt')
 
 
 class CRLMonitor:
-    def __init__(self):
+    def __init__(self, watch_files=False):
         self.parser = CRLParser(CRL_CACHE_DIR)
         self.notifier = TelegramNotifier()
         self.state = self.load_state()
@@ -59,15 +72,43 @@ class CRLMonitor:
         self.metric_skipped_empty = crl_skipped_empty
         self.metric_download_errors = crl_download_errors
         self.metric_parse_errors = crl_parse_errors
-        self.metric_crl_status = crl_status
         
-        # Загружаем карту URL -> УЦ
-        self.url_to_ca_map = self.load_url_to_ca_mapping()
         # Инициализируем БД (идемпотентно)
         try:
             init_db()
         except Exception as e:
             logger.error(f"Не удалось инициализировать БД: {e}")
+        # In-memory реестр УЦ: загружается из БД и перезагружается только при смене версии TSL
+        self.ca_registry = ca_registry
+        self.ca_registry.reload_if_changed()
+        if self.ca_registry.is_empty():
+            # В БД еще нет карты URL -> УЦ — заполняем реестр из файла или кэша TSL
+            self.ca_registry.seed(self.load_url_to_ca_mapping())
+        # Инвентарь URL CRL: пересчитывается только при изменении CDP/TSL/фильтра, внутри цикла — один снимок.
+        # Набор URL из TSL: начальное значение из файла, далее — дельты из канала событий TSL Monitor
+        self.url_inventory = UrlInventory(self.parser)
+        self.url_inventory.set_tsl_urls(self.load_tsl_urls_file())
+        self.first_sweep_done = False
+        # Имена групп CRL последнего цикла (ключи состояния текущего набора URL)
+        self.crl_group_names = None
+        # CRL, которые в последней попытке не удалось скачать ни с одного URL группы
+        self.failed_crls = set()
+        # Итог последней обработки группы: имя CRL -> (статус, время последнего успеха); читается при опросе /metrics
+        self.crl_results = {}
+        crl_state_collector.attach(self)
+        # Время начала последнего цикла (для crl_cycle_lag_seconds)
+        self.last_cycle_started = None
+        # Табло состояния: одно сообщение в чате, редактируемое в конце цикла
+        self.status_board = StatusBoard(self.notifier) if STATUS_BOARD else None
+        # Добавленные в TSL URL, которые нужно проверить, не дожидаясь следующего цикла
+        self.pending_urls = queue.Queue()
+        crl_url_channel.subscribe(self.on_crl_urls_delta)
+        # При запуске в отдельном процессе изменения приходят только через файлы TSL Monitor
+        self.file_watcher = None
+        if watch_files:
+            self.file_watcher = UrlSetFileWatcher(
+                crl_url_channel, TSL_CRL_URLS_FILE, os.path.join(DATA_DIR, 'crl_url_to_ca_mapping.json')
+            )
 
     def load_state(self):
         """Загрузка состояния: сначала из БД, затем из файла (fallback)."""
@@ -86,7 +127,7 @@ class CRLMonitor:
         return {}
 
     def load_url_to_ca_mapping(self):
-        """Загрузка карты URL -> УЦ из файла или извлечение из TSL.xml"""
+        """Загрузка карты URL -> УЦ из файла или из общего кэша TSL (без обращения к сети)"""
         ca_mapping_file = os.path.join(DATA_DIR, 'crl_url_to_ca_mapping.json')
         if os.path.exists(ca_mapping_file):
             try:
@@ -94,82 +135,66 @@ class CRLMonitor:
                     return json.load(f)
             except Exception as e:
                 logger.error(f"Ошибка загрузки карты URL -> УЦ: {e}")
-        
-        # Если файл карты не существует, извлекаем информацию из TSL.xml
-        logger.info("Карта URL -> УЦ не найдена, извлекаем информацию из TSL.xml")
-        return self.extract_ca_info_from_tsl()
-    
-    def extract_ca_info_from_tsl(self):
-        """Извлечение информации об УЦ из TSL.xml"""
-        try:
-            import requests
-            import xml.etree.ElementTree as ET
-            import re
-            
-            TSL_URL = "https://e-trust.gosuslugi.ru/app/scc/portal/api/v1/portal/ca/getxml"
-            
-            # Загружаем TSL.xml
-            response = requests.get(TSL_URL, timeout=30, verify=VERIFY_TLS)
-            response.raise_for_status()
-            xml_content = response.content
-            
-            if isinstance(xml_content, bytes):
-                xml_content = xml_content.decode('utf-8')
-            
-            root = ET.fromstring(xml_content)
-            url_to_ca_map = {}
-            
-            # Подготавливаем фильтры
-            ogrn_filters = None
-            numeric_filters = None
-            if TSL_OGRN_LIST:
-                ogrn_filters = [re.sub(r'\D', '', n) for n in TSL_OGRN_LIST if n]
-                ogrn_filters = [n for n in ogrn_filters if n]
-            elif TSL_REGISTRY_NUMBERS:
-                numeric_filters = [re.sub(r'\D', '', n) for n in TSL_REGISTRY_NUMBERS if n]
-                numeric_filters = [n for n in numeric_filters if n]
-            
-            for ca_element in root.findall('.//УдостоверяющийЦентр'):
-                status_element = ca_element.find('.//Статус')
-                if status_element is not None and status_element.text == 'Действует':
-                    reg_number_element = ca_element.find('.//РеестровыйНомер')
-                    name_element = ca_element.find('.//Название')
-                    
-                    # Применяем фильтры
-                    if ogrn_filters is not None:
-                        ogrn_element = ca_element.find('.//ОГРН')
-                        ogrn_val = ogrn_element.text.strip() if (ogrn_element is not None and ogrn_element.text) else None
-                        if not ogrn_val:
-                            continue
-                        ogrn_digits = re.sub(r'\D', '', ogrn_val)
-                        if ogrn_digits not in ogrn_filters:
-                            continue
-                    elif numeric_filters is not None:
-                        reg_val = reg_number_element.text.strip() if (reg_number_element is not None and reg_number_element.text) else None
-                        if not reg_val:
-                            continue
-                        reg_digits = re.sub(r'\D', '', reg_val)
-                        if not any(reg_digits.startswith(flt) for flt in numeric_filters):
-                            continue
-                    
-                    # Извлекаем CRL URL и создаем карту
-                    for crl_addr in ca_element.findall('.//АдресаСписковОтзыва/Адрес'):
-                        if crl_addr.text:
-                            url = crl_addr.text.strip()
-                            if url:
-                                ca_name = name_element.text.strip() if name_element is not None and name_element.text else 'Неизвестный УЦ'
-                                reg_number = reg_number_element.text.strip() if reg_number_element is not None and reg_number_element.text else 'Неизвестный номер'
-                                url_to_ca_map[url] = {
-                                    'name': ca_name,
-                                    'reg_number': reg_number
-                                }
-            
-            logger.info(f"Извлечена информация об УЦ из TSL.xml: {len(url_to_ca_map)} URL")
-            return url_to_ca_map
-        except Exception as e:
-            logger.error(f"Ошибка извлечения информации об УЦ из TSL.xml: {e}")
+        parsed = tsl_cache.get()
+        if parsed is not None:
+            return parsed.url_to_ca_map
+        # TSL скачивает и разбирает только TSL Monitor; карта придет через кэш TSL
+        logger.info("Карта URL -> УЦ не найдена, будет получена после проверки TSL")
         return {}
 
+    def load_tsl_urls_file(self):
+        """Начальный набор URL CRL из файла TSL Monitor (None, если файла еще нет)."""
+        if not os.path.exists(TSL_CRL_URLS_FILE):
+            logger.info(f"Файл {TSL_CRL_URLS_FILE} не найден, URL из TSL придут после проверки TSL.")
+            return None
+        try:
+            with open(TSL_CRL_URLS_FILE, 'r', encoding='utf-8') as f:
+                return {line.strip() for line in f if line.strip()}
+        except Exception as e:
+            logger.error(f"Ошибка чтения URL CRL из {TSL_CRL_URLS_FILE}: {e}")
+            return None
+
+    def on_crl_urls_delta(self, delta):
+        """Обработчик изменения набора URL CRL из TSL (вызывается в потоке издателя)."""
+        added, removed = self.url_inventory.set_tsl_urls(delta.urls)
+        if delta.url_to_ca_map:
+            # Карта URL -> УЦ изменилась: перечитываем реестр, при пустой БД — берем карту из события
+            self.ca_registry.invalidate()
+            self.ca_registry.reload_if_changed()
+            if self.ca_registry.is_empty():
+                self.ca_registry.seed(delta.url_to_ca_map)
+        if removed:
+            logger.info(f"Из TSL исключено {len(removed)} URL CRL — они больше не проверяются")
+        if added:
+            logger.info(f"В TSL добавлено {len(added)} URL CRL")
+            # До первого цикла новые URL попадут в обычную проверку
+            if self.first_sweep_done:
+                self.pending_urls.put(added)
+
+    def process_added_urls(self, added):
+        """Внеплановая проверка CRL по добавленным в TSL URL."""
+        inventory = self.url_inventory.current()
+        # Инвентарь уже учитывает фильтр ФНС
+        added = {normalize_url(url) for url in added} & inventory.urls
+        if not added:
+            return
+        url_groups = self.group_urls(inventory.urls)
+        names = sorted(name for name, urls in url_groups.items() if added.intersection(urls))
+        logger.info(f"Внеплановая проверка {len(names)} CRL, добавленных в TSL")
+        with self.notifier.digest("Проверка CRL, добавленных в TSL"):
+            for name in names:
+                self.process_crl_group(name, url_groups[name])
+        self.save_state()
+
+    def group_urls(self, urls):
+        """Группировка URL по CRL (зеркала одной CRL — одна группа): {имя CRL: [URL]}"""
+        def issuer_of(url):
+            mapping = self.ca_registry.get_by_url(url)
+            return mapping.get('reg_number') if mapping else None
+
+        return {name: group.urls for name, group in group_crl_urls(urls, issuer_of).items()}
+
+    @observe_stage('state_save')
     def save_state(self):
         """Сохранение состояния: сначала в БД, затем в файл (fallback)."""
         if DB_ENABLED:
@@ -236,145 +261,111 @@ class CRLMonitor:
             logger.error(f"Ошибка сохранения logged_empty_crls: {e}")
 
     def get_all_crl_urls(self):
-        """Получение всех CRL URL: из CDP_SOURCES, KNOWN_CRL_PATHS и из файла TSL_CRL_URLS_FILE"""
-        all_urls = set() # Используем set для автоматического удаления дубликатов
-
-        # 1. URL из CDP_SOURCES и KNOWN_CRL_PATHS
-        for cdp_url in CDP_SOURCES:
-            # Проверяем, нужно ли фильтровать по доменам ФНС
-            if FNS_ONLY:
-                # В режиме FNS_ONLY обрабатываем только CDP, принадлежащие ФНС
-                if any(domain in cdp_url.lower() for domain in FNS_DOMAINS):
-                    # Получаем URL напрямую из CDP
-                    urls_from_cdp = self.parser.get_crl_urls_from_cdp(cdp_url)
-                    # Фильтруем полученные URL по доменам ФНС
-                    filtered_urls_from_cdp = {url for url in urls_from_cdp if any(domain in url.lower() for domain in FNS_DOMAINS)}
-                    all_urls.update(filtered_urls_from_cdp)
-                    logger.info(f"Найдено {len(filtered_urls_from_cdp)} CRL в CDP {cdp_url} (ФНС)")
-                    # Добавляем известные пути вручную (тоже фильтруем)
-                    for path in KNOWN_CRL_PATHS:
-                        full_url = cdp_url.rstrip('/') + '/' + path
-                         # Фильтруем и добавляем вручную указанные пути
-                        if any(domain in full_url.lower() for domain in FNS_DOMAINS):
-                             all_urls.add(full_url)
-                else:
-                    logger.info(f"CDP источник {cdp_url} не принадлежит доменам ФНС. Пропускаем в режиме FNS_ONLY.")
-            else:
-                # В режиме "все УЦ" обрабатываем все CDP
-                # Получаем URL напрямую из CDP
-                urls_from_cdp = self.parser.get_crl_urls_from_cdp(cdp_url)
-                all_urls.update(urls_from_cdp)
-                logger.info(f"Найдено {len(urls_from_cdp)} CRL в CDP {cdp_url}")
-                # Добавляем известные пути вручную (без фильтрации)
-                for path in KNOWN_CRL_PATHS:
-                    full_url = cdp_url.rstrip('/') + '/' + path
-                    all_urls.add(full_url)
-
-
-        # 2. URL из файла, созданного TSL монитором
-        # Обрабатываем файл TSL_CRL_URLS_FILE только если НЕ в режиме FNS_ONLY или если FNS_ONLY=True, но нужно применить фильтр
-        if os.path.exists(TSL_CRL_URLS_FILE):
-            try:
-                with open(TSL_CRL_URLS_FILE, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        url = line.strip()
-                        if url:
-                            if FNS_ONLY:
-                                # В режиме FNS_ONLY фильтруем URL из файла TSL
-                                if any(domain in url.lower() for domain in FNS_DOMAINS):
-                                    all_urls.add(url)
-                                # else: URL не относится к ФНС, пропускаем
-                            else:
-                                # В режиме "все УЦ" добавляем все URL из файла TSL
-                                all_urls.add(url)
-                logger.info(f"Загружено URL CRL из {TSL_CRL_URLS_FILE}. Применен фильтр ФНС: {FNS_ONLY}.")
-            except Exception as e:
-                logger.error(f"Ошибка чтения URL CRL из {TSL_CRL_URLS_FILE}: {e}")
-        else:
-            logger.info(f"Файл {TSL_CRL_URLS_FILE} не найден.")
-
-        mode_info = "ФНС" if FNS_ONLY else "Все УЦ"
-        logger.info(f"Всего уникальных URL CRL ({mode_info}): {len(all_urls)}")
-        return list(all_urls) # Возвращаем список URL
-
+        """Получение всех CRL URL (CDP_SOURCES, KNOWN_CRL_PATHS и TSL) для нового цикла проверки"""
+        return list(self.url_inventory.refresh())
 
     def run_check(self):
         """Основная проверка (высокоуровневая логика)."""
         try:
-            logger.info("Начало проверки CRL...")
-            crl_urls = self.get_all_crl_urls()
+            with self.notifier.digest("Проверка CRL"):
+                logger.info("Начало проверки CRL...")
+                self.ca_registry.reload_if_changed()
+                crl_urls = self.get_all_crl_urls()
 
-            # Группировка URL по имени файла
-            url_groups = defaultdict(list)
-            for url in crl_urls:
-                filename = os.path.basename(url)
-                url_groups[filename].append(url)
+                # Группировка URL по CRL: варианты одного URL и зеркала одной CRL загружаются один раз
+                url_groups = self.group_urls(crl_urls)
+                self.crl_group_names = set(url_groups)
 
-            logger.info(f"Найдено {len(url_groups)} уникальных CRL для проверки.")
+                logger.info(f"Найдено {len(url_groups)} уникальных CRL для проверки.")
 
-            # Обработка каждой группы URL
-            for filename, urls_in_group in url_groups.items():
-                self.process_crl_group(filename, urls_in_group)
+                # Обработка каждой группы URL
+                for filename, urls_in_group in url_groups.items():
+                    self.process_crl_group(filename, urls_in_group)
+                self.first_sweep_done = True
 
-            # Проверка неопубликованных CRL после всех попыток загрузки
-            self.check_missed_crl()
+                # Проверка неопубликованных CRL после всех попыток загрузки
+                self.check_missed_crl()
             
-            # Сохранение состояния после полного цикла проверок
-            self.save_state()
-            # Сбрасываем холодный старт после первого полного цикла
-            if self.cold_start:
-                self.cold_start = False
-            logger.info("Проверка CRL завершена.")
+                # Сохранение состояния после полного цикла проверок
+                self.save_state()
+                # Сбрасываем холодный старт после первого полного цикла
+                if self.cold_start:
+                    self.cold_start = False
+                logger.info("Проверка CRL завершена.")
+            self.update_status_board()
 
         except Exception as e:
             logger.error(f"Критическая ошибка во время проверки CRL: {e}", exc_info=True)
 
     def metric_run_check(self):
         """Основная проверка с метриками (высокоуровневая логика)."""
+        started = time.time()
+        # Отставание: насколько позже CHECK_INTERVAL после начала предыдущего цикла начался этот (долгий цикл сдвигает следующий)
+        if self.last_cycle_started is not None:
+            crl_cycle_lag_seconds.set(max(0.0, started - self.last_cycle_started - CHECK_INTERVAL * 60))
+        self.last_cycle_started = started
         try:
-            logger.info("Начало проверки CRL...")
-            self.metric_checks_total.inc()
-            crl_urls = self.get_all_crl_urls()
-
-            # Группировка URL по имени файла
-            url_groups = defaultdict(list)
-            for url in crl_urls:
-                filename = os.path.basename(url)
-                url_groups[filename].append(url)
-
-            logger.info(f"Найдено {len(url_groups)} уникальных CRL для проверки.")
-            self.metric_unique_urls.set(len(url_groups))
-
-            # Обработка каждой группы URL
-            for filename, urls_in_group in url_groups.items():
-                self.process_crl_group(filename, urls_in_group)
-
-            # Проверка неопубликованных CRL после всех попыток загрузки
-            self.check_missed_crl()
+            with self.notifier.digest("Проверка CRL"):
+                logger.info("Начало проверки CRL...")
+                self.metric_checks_total.inc()
+                self.ca_registry.reload_if_changed()
+                crl_urls = self.get_all_crl_urls()
+
+                # Группировка URL по CRL: варианты одного URL и зеркала одной CRL загружаются один раз
+                url_groups = self.group_urls(crl_urls)
+                self.crl_group_names = set(url_groups)
+
+                logger.info(f"Найдено {len(url_groups)} уникальных CRL для проверки.")
+                self.metric_unique_urls.set(len(url_groups))
+
+                # Обработка каждой группы URL
+                for filename, urls_in_group in url_groups.items():
+                    self.process_crl_group(filename, urls_in_group)
+                self.first_sweep_done = True
+
+                # Проверка неопубликованных CRL после всех попыток загрузки
+                self.check_missed_crl()
             
-            # Сохранение состояния после полного цикла проверок
-            self.save_state()
-            logger.info("Проверка CRL завершена.")
+                # Сохранение состояния после полного цикла проверок
+                self.save_state()
+                logger.info("Проверка CRL завершена.")
+            self.update_status_board()
 
         except Exception as e:
             logger.error(f"Критическая ошибка во время проверки CRL: {e}", exc_info=True)
+        finally:
+            crl_cycle_duration_seconds.set(time.time() - started)
 
+    def update_status_board(self):
+        """Обновление табло состояния по состоянию CRL текущего цикла (если включено)"""
+        if self.status_board is None or self.crl_group_names is None:
+            return
+        try:
+            failed = self.failed_crls & self.crl_group_names
+            self.status_board.update(render_crl_status(self.state, sorted(self.crl_group_names), failed, self.notifier.format_datetime))
+        except Exception as e:
+            logger.error(f"Ошибка обновления табло состояния: {e}", exc_info=True)
+
+    @observe_stage('group')
     def process_crl_group(self, filename, urls):
         """Обрабатывает группу URL-адресов, ведущих к одному и тому же файлу CRL."""
         logger.debug(f"Обработка группы CRL '{filename}' по {len(urls)} URL.")
         crl_processed = False
         last_error = "Неизвестная ошибка"
         last_url_tried = ""
+        status = 'unknown'
 
         for url in urls:
             last_url_tried = url
             try:
                 # 1. Загрузка CRL
+                fetch_started = time.monotonic()
                 crl_data = self.parser.download_crl(url)
+                fetch_latency_ms = int((time.monotonic() - fetch_started) * 1000)
                 if not crl_data:
                     last_error = f"Не удалось загрузить CRL с {url}"
                     self.metric_download_errors.labels(crl_name=filename, error_type='download_failed').inc()
-                    self.metric_crl_status.labels(crl_name=filename, status='download_failed').set(1)
+                    status = 'download_failed'
                     continue
 
                 # 2. Парсинг CRL (может вернуть объект cryptography или dict)
@@ -382,7 +373,7 @@ class CRLMonitor:
                 if not parsed_object:
                     last_error = f"Не удалось распарсить CRL '{filename}' с {url}"
                     self.metric_parse_errors.labels(crl_name=filename, error_type='parse_failed').inc()
-                    self.metric_crl_status.labels(crl_name=filename, status='parse_failed').set(1)
+                    status = 'parse_failed'
                     continue
 
                 # 3. Преобразование результата в стандартизированный словарь (crl_info)
@@ -396,18 +387,20 @@ class CRLMonitor:
                 if not crl_info:
                     last_error = f"Не удалось извлечь информацию из CRL '{filename}'"
                     self.metric_parse_errors.labels(crl_name=filename, error_type='info_extraction_failed').inc()
-                    self.metric_crl_status.labels(crl_name=filename, status='info_extraction_failed').set(1)
+                    status = 'info_extraction_failed'
                     continue
                 
                 # 4. Проверка на пустой CRL с длительным сроком действия
                 if self.should_skip_empty_crl(crl_info, filename):
                     self.metric_skipped_empty.inc()
+                    status = 'skipped_empty'
                     crl_processed = True  # Помечаем как обработанный, чтобы не пробовать другие URL
                     break
                 
                 # 5. Проверка на Delta CRL
                 if crl_info.get('is_delta', False):
                     last_error = f"CRL с {url} является Delta CRL и игнорируется."
+                    status = 'delta_ignored'
                     logger.debug(last_error)
                     continue
 
@@ -424,10 +417,11 @@ class CRLMonitor:
                     except Exception:
                         pass
                 self.handle_crl_info(filename, crl_info, url, size_mb=size_mb)
+                self.record_crl_version(filename, crl_info, url, crl_data, fetch_latency_ms)
                 
                 crl_processed = True
                 self.metric_processed_total.labels(result='success').inc()
-                self.metric_crl_status.labels(crl_name=filename, status='success').set(1)
+                status = 'success'
                 logger.info(f"Успешно обработан CRL '{filename}' с {url}")
                 break # Успех, выходим из цикла по зеркалам
                 
@@ -436,21 +430,21 @@ class CRLMonitor:
                 logger.error(last_error, exc_info=True)
                 self.metric_processed_total.labels(result='error').inc()
                 self.metric_parse_errors.labels(crl_name=filename, error_type='exception').inc()
-                self.metric_crl_status.labels(crl_name=filename, status='exception').set(1)
+                status = 'exception'
                 continue
 
         if not crl_processed:
+            self.failed_crls.add(filename)
             error_msg = f"Не удалось обработать CRL '{filename}' ни с одного из {len(urls)} URL. Последняя ошибка: {last_error}"
             logger.error(error_msg)
             # Отправим отдельное уведомление (если включено), с привязкой к УЦ на основе маппинга URL->УЦ
             try:
-                from db import get_ca_by_crl_url
                 ca_name = None
                 ca_reg_number = None
                 crl_number = None
                 issuer_key_id = None
                 for u in urls:
-                    mapping = get_ca_by_crl_url(u)
+                    mapping = self.ca_registry.get_by_url(u)
                     if mapping:
                         ca_name = mapping.get('name')
                         ca_reg_number = mapping.get('reg_number')
@@ -471,7 +465,36 @@ class CRLMonitor:
             except Exception as e:
                 logger.error(f"Ошибка отправки уведомления об ошибке скачивания CRL '{filename}': {e}")
             self.metric_processed_total.labels(result='failed_group').inc()
-            self.metric_crl_status.labels(crl_name=filename, status='failed_group').set(1)
+            self.crl_results[filename] = (status, self.crl_results.get(filename, (None, None))[1])
+        else:
+            self.failed_crls.discard(filename)
+            self.crl_results[filename] = (status, time.time())
+
+    @observe_stage('db_write')
+    def record_crl_version(self, filename, crl_info, url, crl_data, fetch_latency_ms):
+        """Добавляет версию CRL в историю crl_versions (повтор той же версии игнорируется)."""
+        if not DB_ENABLED:
+            return
+        try:
+            state = self.state.get(filename, {})
+            added = crl_versions_append({
+                'crl_name': filename,
+                'crl_url': url,
+                'ca_name': state.get('ca_name'),
+                'ca_reg_number': state.get('ca_reg_number'),
+                'crl_number': crl_info.get('crl_number'),
+                'this_update': state.get('this_update'),
+                'next_update': state.get('next_update'),
+                'revoked_count': crl_info.get('revoked_count'),
+                'size_bytes': len(crl_data),
+                'fetch_latency_ms': fetch_latency_ms,
+                'digest': hashlib.sha256(crl_data).hexdigest(),
+                'source_host': urlparse(url).netloc.lower(),
+            })
+            if added:
+                logger.debug(f"В историю добавлена версия CRL '{filename}' (номер {crl_info.get('crl_number')})")
+        except Exception as e:
+            logger.error(f"Ошибка записи истории версий CRL '{filename}': {e}")
 
     def should_skip_empty_crl(self, crl_info, filename):
         """Проверяет, нужно ли пропустить пустой CRL с длительным сроком действия"""
@@ -519,16 +542,8 @@ class CRLMonitor:
         this_update = ensure_moscow_tz(crl_info.get('this_update'))
         next_update = ensure_moscow_tz(crl_info.get('next_update'))
         
-        # Получение информации об УЦ (с попыткой из БД при отсутствии в карте) — ДО отправки любых уведомлений
-        ca_info = self.url_to_ca_map.get(url)
-        if not ca_info:
-            try:
-                from db import get_ca_by_crl_url
-                db_info = get_ca_by_crl_url(url)
-                if db_info:
-                    ca_info = db_info
-            except Exception as e:
-                logger.error(f"Ошибка получения информации об УЦ из БД: {e}")
+        # Получение информации об УЦ из in-memory реестра (по AKI, затем по URL и DN издателя) — ДО отправки любых уведомлений
+        ca_info = self.ca_registry.lookup(url=url, issuer_key_id=crl_info.get('crl_key_identifier'), issuer_dn=crl_info.get('issuer'))
         ca_name = (ca_info or {}).get('name', 'Неизвестный УЦ')
         ca_reg_number = (ca_info or {}).get('reg_number', 'Неизвестный номер')
 
@@ -742,7 +757,7 @@ class CRLMonitor:
                             
                     if should_send_alert:
                         # ИСПРАВЛЕНО: передаём данные об УЦ, полученные в handle_crl_info
-                        self.notifier.send_expiring_crl_alert(crl_name, time_left_hours, next_update_dt, crl_url, size_mb=size_mb, ca_name=ca_name, ca_reg_number=ca_reg_number, crl_fingerprint=self.state.get(crl_name, {}).get('crl_fingerprint'), crl_key_identifier=self.state.get(crl_name, {}).get('crl_key_identifier'), crl_number=self.state.get(crl_name, {}).get('crl_number'))
+                        self.notifier.send_expiring_crl_alert(crl_name, time_left_hours, next_update_dt, crl_url, size_mb=size_mb, ca_name=ca_name, ca_reg_number=ca_reg_number, crl_fingerprint=self.state.get(crl_name, {}).get('crl_fingerprint'), crl_key_identifier=self.state.get(crl_name, {}).get('crl_key_identifier'), crl_number=self.state.get(crl_name, {}).get('crl_number'), threshold=threshold)
                         logger.info(f"Отправлен алерт: CRL '{crl_name}' истекает через {time_left_hours:.2f} часов (порог {threshold}h).")
                         # Сохраняем время отправки алерта
                         self.state.setdefault(crl_name, {}).setdefault('last_alerts', {})[alert_key] = now_msk.isoformat()
@@ -755,6 +770,7 @@ class CRLMonitor:
 
     
 
+    @observe_stage('categorize')
     def categorize_revoked_certificates(self, revoked_certs):
         """Категоризация отозванных сертификатов по причине (регистронезависимая, устойчивая к формату)"""
         categories = defaultdict(int)
@@ -829,10 +845,12 @@ class CRLMonitor:
         now_msk = datetime.now(MOSCOW_TZ)
         # Ограничиваем проверку только текущим набором URL после всех фильтров (TSL/ФНС)
         try:
-            current_allowed_urls = set(self.get_all_crl_urls())
+            current_allowed_urls = self.url_inventory.current().urls
+            current_names = self.crl_group_names
         except Exception as e:
             logger.error(f"Не удалось получить текущий список CRL URL для фильтрации пропущенных: {e}")
             current_allowed_urls = None
+            current_names = None
         for crl_name, crl_state in self.state.items():
             # --- НОВАЯ ЛОГИКА ФИЛЬТРАЦИИ ---
             # Получаем URL из состояния для проверки принадлежности к ФНС
@@ -848,6 +866,10 @@ class CRLMonitor:
             if current_allowed_urls is not None and crl_url and crl_url not in current_allowed_urls:
                 logger.debug(f"Пропущена проверка неопубликованного CRL '{crl_name}' ({crl_url}) — не входит в текущий фильтр URL.")
                 continue
+            # Запись состояния, которая больше не соответствует ни одной группе (например, после разделения одноименных CRL)
+            if current_names is not None and crl_name not in current_names:
+                logger.debug(f"Пропущена проверка неопубликованного CRL '{crl_name}' — нет в текущем наборе CRL.")
+                continue
             # --- КОНЕЦ НОВОЙ ЛОГИКИ ---
             next_update_str = crl_state.get('next_update')
             # crl_url уже получен выше
@@ -947,22 +969,37 @@ class CRLMonitor:
     def run(self):
         """Запуск монитора"""
         logger.info("Запуск CRL Monitor")
-        # Первая проверка с метриками
-        self.metric_run_check()
-        # Настройка расписания
-        self.setup_schedule()
-        # Основной цикл
-        while True:
-            try:
-                schedule.run_pending()
-                time.sleep(60)
-            except KeyboardInterrupt:
-                logger.info("Получен сигнал завершения")
-                break
-            except Exception as e:
-                logger.error(f"Ошибка в основном цикле: {e}")
-                time.sleep(60)
+        if self.file_watcher:
+            self.file_watcher.start()
+        # Сигнал завершения может прийти и во время первой проверки — досылка очередей в одном месте
+        try:
+            # Первая проверка с метриками
+            self.metric_run_check()
+            # Настройка расписания
+            self.setup_schedule()
+            # Основной цикл
+            while True:
+                try:
+                    schedule.run_pending()
+                    # Ждем минуту либо новых URL из TSL, которые проверяются сразу
+                    try:
+                        added = self.pending_urls.get(timeout=60)
+                    except queue.Empty:
+                        continue
+                    self.process_added_urls(added)
+                except Exception as e:
+                    logger.error(f"Ошибка в основном цикле: {e}")
+                    time.sleep(60)
+        except KeyboardInterrupt:
+            logger.info("Получен сигнал завершения")
+            shutdown_notifications()
 
 if __name__ == "__main__":
-    monitor = CRLMonitor()
+    # Отдельный процесс: изменения набора URL из TSL отслеживаются по файлам TSL Monitor
+    install_sigterm_handler()
+    start_metrics_server(port=METRICS_PORT)
+    # Без run_all_monitors ретеншн (в том числе компактизация crl_versions) запускается здесь
+    if RETENTION_ENABLED:
+        start_retention_thread()
+    monitor = CRLMonitor(watch_files=True)
     monitor.run()
@@ -10,10 +10,11 @@ import subprocess
 from urllib.parse import urljoin, urlparse
 import re
 from datetime import datetime
-import time
 import hashlib
 import urllib3
 from config import VERIFY_TLS
+from http_download import fetch_resumable
+from metrics import observe_stage
 from utils import setup_logging
 
 # Отключаем предупреждения urllib3 при отключенной проверке TLS
@@ -32,44 +33,42 @@ class CRLParser:
         # Для хранения последних данных CRL при парсинге, если понадобится резервный метод
         self._last_crl_data = None 
 
+    @observe_stage('download')
     def download_crl(self, url):
             """Скачивание CRL по URL с использованием одного запроса с ретраями."""
             try:
                 headers = {
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                 }
-                backoff = 1
                 tries = 3
-                for attempt in range(1, tries + 1):
-                    try:
-                        with requests.get(url, timeout=30, headers=headers, stream=True, verify=VERIFY_TLS) as response:
-                            response.raise_for_status()
-                            full_content = response.content
-                            if not full_content:
-                                logger.warning(f"Файл по URL {url} пустой.")
-                                return None
-                            parsed_url = urlparse(url)
-                            filename_safe_netloc = parsed_url.netloc.replace(':', '_')
-                            filename_safe_path = parsed_url.path.replace('/', '_').replace('\\', '_')
-                            filename = os.path.join(
-                                self.cache_dir,
-                                f"{filename_safe_netloc}_{filename_safe_path.lstrip('_')}"
-                            )
-                            with open(filename, 'wb') as f:
-                                f.write(full_content)
-                            logger.debug(f"Файл загружен и сохранен: {url} -> {filename}")
-                            if self.is_crl_content(full_content):
-                                logger.info(f"Успешно распознан CRL: {url}")
-                            else:
-                                logger.debug(f"Загруженный файл по URL {url} не распознан как CRL напрямую. Сохранен для анализа.")
-                            return full_content
-                    except requests.exceptions.RequestException as e:
-                        logger.error(f"Ошибка загрузки CRL {url} (попытка {attempt}/{tries}): {e}")
-                        if attempt < tries:
-                            time.sleep(backoff)
-                            backoff *= 2
-                            continue
-                        return None
+
+                def _log_error(e, attempt):
+                    logger.error(f"Ошибка загрузки CRL {url} (попытка {attempt}/{tries}): {e}")
+
+                try:
+                    # Ретраи с бэкоффом; оборванная загрузка крупного CRL продолжается с места обрыва (HTTP Range)
+                    result = fetch_resumable(url, 'crl', headers=headers, timeout=30, tries=tries, backoff=1, on_error=_log_error)
+                except requests.exceptions.RequestException:
+                    return None
+                full_content = result.content
+                if not full_content:
+                    logger.warning(f"Файл по URL {url} пустой.")
+                    return None
+                parsed_url = urlparse(url)
+                filename_safe_netloc = parsed_url.netloc.replace(':', '_')
+                filename_safe_path = parsed_url.path.replace('/', '_').replace('\\', '_')
+                filename = os.path.join(
+                    self.cache_dir,
+                    f"{filename_safe_netloc}_{filename_safe_path.lstrip('_')}"
+                )
+                with open(filename, 'wb') as f:
+                    f.write(full_content)
+                logger.debug(f"Файл загружен и сохранен: {url} -> {filename}")
+                if self.is_crl_content(full_content):
+                    logger.info(f"Успешно распознан CRL: {url}")
+                else:
+                    logger.debug(f"Загруженный файл по URL {url} не распознан как CRL напрямую. Сохранен для анализа.")
+                return full_content
 
             except Exception as e:
                 logger.error(f"Неизвестная ошибка загрузки CRL {url}: {e}")
@@ -115,6 +114,7 @@ class CRLParser:
         return is_valid
 
     # Измените сигнатуру метода, добавив параметр crl_name (можно сделать его необязательным)
+    @observe_stage('parse')
     def parse_crl(self, crl_data, crl_name="Неизвестный CRL"):
         """Парсинг CRL данных"""
         if not crl_data:
@@ -184,6 +184,7 @@ class CRLParser:
         return crl
 
 
+    @observe_stage('extract')
     def get_crl_info(self, crl):
         """Получение информации о CRL с использованием cryptography"""
         logger.debug(f"get_crl_info вызван с объектом типа: {type(crl)}")
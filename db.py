@@ -3,8 +3,12 @@ import sqlite3
 from contextlib import contextmanager
 from typing import Optional, Dict, Any, Tuple
 import json
+import hashlib
+import functools
+import time
 
 from config import DB_PATH, DATA_DIR
+from metrics import db_operation_seconds
 
 
 def ensure_dirs():
@@ -14,6 +18,8 @@ def ensure_dirs():
 def init_db():
     ensure_dirs()
     with sqlite3.connect(DB_PATH) as conn:
+        # Инкрементальный vacuum (действует для новой БД; существующую переводит retention при RETENTION_FULL_VACUUM)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
         conn.execute("PRAGMA journal_mode=WAL;")
         # --- миграции схемы для ca_mapping: добавляем недостающие столбцы ---
         try:
@@ -57,6 +63,20 @@ def init_db():
             )
             """
         )
+        # Помесячные агрегаты недельной статистики (сюда сворачиваются старые строки weekly_details)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS weekly_details_rollup (
+                month TEXT NOT NULL,
+                ca_name TEXT,
+                ca_reg_number TEXT,
+                crl_name TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (month, crl_name, reason)
+            )
+            """
+        )
         # Состояния CRL
         conn.execute(
             """
@@ -74,6 +94,31 @@ def init_db():
             )
             """
         )
+        # История версий CRL (append-only, одна строка на каждую новую версию CRL)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS crl_versions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                crl_name TEXT NOT NULL,
+                crl_url TEXT,
+                ca_name TEXT,
+                ca_reg_number TEXT,
+                crl_number TEXT,
+                this_update TEXT,
+                next_update TEXT,
+                revoked_count INTEGER,
+                size_bytes INTEGER,
+                fetch_latency_ms INTEGER,
+                digest TEXT NOT NULL,
+                source_host TEXT,
+                fetched_at TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_crl_versions_digest ON crl_versions(crl_name, digest)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_crl_versions_crl_time ON crl_versions(crl_name, fetched_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_crl_versions_ca_time ON crl_versions(ca_reg_number, fetched_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_crl_versions_time ON crl_versions(fetched_at)")
         # Недельная статистика
         conn.execute(
             """
@@ -96,18 +141,61 @@ def init_db():
             )
             """
         )
+        # HTTP-валидаторы TSL для условной загрузки (If-None-Match / If-Modified-Since)
+        cur = conn.execute("PRAGMA table_info(tsl_versions);")
+        tsl_version_cols = {row[1] for row in cur.fetchall()}
+        for col in ('etag', 'last_modified', 'checked_at'):
+            if col not in tsl_version_cols:
+                conn.execute(f"ALTER TABLE tsl_versions ADD COLUMN {col} TEXT;")
+        # Версии из архива (tsl_backfill): ретеншн их не удаляет — created_at у них дата документа, а не загрузки
+        if 'backfilled' not in tsl_version_cols:
+            conn.execute("ALTER TABLE tsl_versions ADD COLUMN backfilled INTEGER NOT NULL DEFAULT 0;")
+        # Снимки УЦ по версиям TSL: уникальные JSON-снимки хранятся один раз (по хешу),
+        # а манифест версии ссылается на них: version -> (entity_key, blob_hash)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tsl_ca_blob (
+                blob_hash TEXT PRIMARY KEY,
+                snapshot_json TEXT NOT NULL
+            )
+            """
+        )
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS tsl_ca_snapshot (
+            CREATE TABLE IF NOT EXISTS tsl_ca_manifest (
                 version TEXT NOT NULL,
                 entity_key TEXT NOT NULL,
-                ca_reg_number TEXT,
-                ca_id TEXT,
-                snapshot_json TEXT NOT NULL,
+                blob_hash TEXT NOT NULL,
                 PRIMARY KEY (version, entity_key)
             )
             """
         )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tsl_ca_manifest_blob ON tsl_ca_manifest(blob_hash)")
+        # Миграция: полные снимки старой схемы (таблица tsl_ca_snapshot) переносим в blob + manifest
+        row = conn.execute("SELECT type FROM sqlite_master WHERE name='tsl_ca_snapshot'").fetchone()
+        if row and row[0] == 'table':
+            blobs = {}
+            manifest = []
+            for version, entity_key, snapshot_json in conn.execute("SELECT version, entity_key, snapshot_json FROM tsl_ca_snapshot"):
+                try:
+                    snapshot = json.loads(snapshot_json)
+                except Exception:
+                    snapshot = {}
+                blob_hash, canonical = tsl_snapshot_digest(snapshot)
+                blobs[blob_hash] = canonical
+                manifest.append((version, entity_key, blob_hash))
+            conn.executemany("INSERT OR IGNORE INTO tsl_ca_blob (blob_hash, snapshot_json) VALUES (?, ?)", list(blobs.items()))
+            conn.executemany("INSERT OR REPLACE INTO tsl_ca_manifest (version, entity_key, blob_hash) VALUES (?, ?, ?)", manifest)
+            conn.execute("DROP TABLE tsl_ca_snapshot")
+        # Совместимость со старыми запросами: tsl_ca_snapshot доступна как представление
+        conn.execute(
+            """
+            CREATE VIEW IF NOT EXISTS tsl_ca_snapshot AS
+            SELECT m.version AS version, m.entity_key AS entity_key, m.entity_key AS ca_reg_number,
+                   NULL AS ca_id, b.snapshot_json AS snapshot_json
+            FROM tsl_ca_manifest m JOIN tsl_ca_blob b ON b.blob_hash = m.blob_hash
+            """
+        )
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS tsl_diffs (
@@ -145,10 +233,114 @@ def init_db():
                 )
         except Exception:
             pass
-            
+
+        # Ключи УЦ из сертификатов TSL: SKI -> УЦ (привязка CRL к УЦ по AKI)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ca_keys (
+                key_id TEXT PRIMARY KEY,
+                ca_reg_number TEXT,
+                ca_name TEXT,
+                subject_dn TEXT,
+                cert_fingerprint TEXT,
+                tsl_version TEXT
+            )
+            """
+        )
+
+        # Инвентарь URL CRL: текущий набор, версии входных данных и дельты между версиями
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS url_inventory_versions (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                inputs_hash TEXT NOT NULL,
+                url_count INTEGER,
+                added_count INTEGER,
+                removed_count INTEGER,
+                created_at TEXT
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS url_inventory (
+                url TEXT PRIMARY KEY,
+                source TEXT,
+                first_version INTEGER
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS url_inventory_deltas (
+                version INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                action TEXT NOT NULL,
+                PRIMARY KEY (version, url)
+            )
+            """
+        )
+
+        # Очередь исходящих уведомлений (доставка хотя бы один раз, в том числе после рестарта)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                priority INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT,
+                last_error TEXT,
+                created_at TEXT,
+                sent_at TEXT
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox(status, priority, next_attempt_at)"
+        )
+
+        # Индекс дедупликации уведомлений: нормализованный ключ события -> окно подавления повторов (TTL)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS notification_dedup (
+                event_key TEXT PRIMARY KEY,
+                first_seen TEXT NOT NULL,
+                expires_at TEXT NOT NULL,
+                suppressed INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+
+        # Табло состояния: сообщение, которое редактируется в каждом чате, и хеш его последнего содержимого
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS status_board (
+                chat_id TEXT PRIMARY KEY,
+                message_id INTEGER,
+                content_hash TEXT,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+
         conn.commit()
 
 
+def timed(func):
+    """Длительность вызова хелпера в db_operation_duration_seconds{operation=<имя функции>}."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db_operation_seconds.labels(operation=func.__name__).observe(time.perf_counter() - started)
+    return wrapper
+
+
 @contextmanager
 def get_conn():
     ensure_dirs()
@@ -207,7 +399,18 @@ def get_ca_by_crl_url(crl_url: str) -> Optional[Dict[str, str]]:
         return {"name": row[0], "reg_number": row[1], "crl_number": row[2], "issuer_key_id": row[3]}
 
 
+def ca_mapping_get_all() -> Dict[str, Dict[str, str]]:
+    """Вся карта URL -> УЦ одним запросом (для in-memory реестра УЦ)."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT crl_url, ca_name, ca_reg_number, crl_number, issuer_key_id FROM ca_mapping")
+        return {
+            row[0]: {"name": row[1], "reg_number": row[2], "crl_number": row[3], "issuer_key_id": row[4]}
+            for row in cur.fetchall()
+        }
+
+
 # ---- CRL state helpers ----
+@timed
 def crl_state_get_all() -> Dict[str, Dict[str, Any]]:
     with get_conn() as conn:
         cur = conn.execute("SELECT crl_name, last_check, this_update, next_update, revoked_count, crl_number, url, last_alerts, ca_name, ca_reg_number FROM crl_state")
@@ -227,6 +430,7 @@ def crl_state_get_all() -> Dict[str, Dict[str, Any]]:
         return res
 
 
+@timed
 def crl_state_upsert(crl_name: str, state: Dict[str, Any]) -> None:
     with get_conn() as conn:
         conn.execute(
@@ -266,6 +470,7 @@ def weekly_stats_get_all() -> Dict[str, int]:
         return {row[0]: int(row[1]) for row in cur.fetchall()}
 
 
+@timed
 def weekly_stats_set(category: str, count: int) -> None:
     with get_conn() as conn:
         conn.execute(
@@ -278,6 +483,7 @@ def weekly_stats_set(category: str, count: int) -> None:
         conn.commit()
 
 
+@timed
 def weekly_details_bulk_upsert(rows: list) -> None:
     """rows: list of (week_start, ca_name, ca_reg_number, crl_name, crl_url, reason, count)"""
     if not rows:
@@ -299,6 +505,7 @@ def weekly_details_bulk_upsert(rows: list) -> None:
 
 
 # ---- Bulk import of CRL state (migration) ----
+@timed
 def bulk_upsert_crl_state(state: Dict[str, Dict[str, Any]]) -> None:
     if not state:
         return
@@ -339,11 +546,322 @@ def bulk_upsert_crl_state(state: Dict[str, Dict[str, Any]]) -> None:
         conn.commit()
 
 
+# ---- CRL version history helpers ----
+@timed
+def crl_versions_append(row: Dict[str, Any]) -> bool:
+    """Добавляет версию CRL в историю. Повтор той же версии (crl_name, digest) игнорируется. Возвращает True, если строка добавлена."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            INSERT OR IGNORE INTO crl_versions (crl_name, crl_url, ca_name, ca_reg_number, crl_number, this_update, next_update,
+                                                revoked_count, size_bytes, fetch_latency_ms, digest, source_host, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, datetime('now')))
+            """,
+            (
+                row.get("crl_name"),
+                row.get("crl_url"),
+                row.get("ca_name"),
+                row.get("ca_reg_number"),
+                None if row.get("crl_number") is None else str(row.get("crl_number")),
+                row.get("this_update"),
+                row.get("next_update"),
+                int(row.get("revoked_count") or 0),
+                row.get("size_bytes"),
+                row.get("fetch_latency_ms"),
+                row.get("digest"),
+                row.get("source_host"),
+                row.get("fetched_at"),
+            ),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
+
+def _delete_in_batches(conn, table: str, select_rowids_sql: str, params: tuple, batch_size: int) -> int:
+    """Удаляет строки таблицы пачками по batch_size (короткие транзакции, не блокируют писателей надолго)."""
+    total = 0
+    while True:
+        cur = conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN ({select_rowids_sql} LIMIT ?)",
+            params + (batch_size,),
+        )
+        conn.commit()
+        total += cur.rowcount
+        if cur.rowcount < batch_size:
+            return total
+
+
+def crl_versions_compact(full_days: int, daily_days: int, retention_days: int, batch_size: int = 500) -> Dict[str, int]:
+    """
+    Ретеншн и даунсемплинг истории CRL:
+    - моложе full_days — все версии;
+    - от full_days до daily_days — последняя версия за сутки на каждый CRL;
+    - от daily_days до retention_days — последняя версия за неделю на каждый CRL;
+    - старше retention_days — удаляются.
+    """
+    full_cutoff = f"-{int(full_days)} days"
+    daily_cutoff = f"-{int(daily_days)} days"
+    retention_cutoff = f"-{int(retention_days)} days"
+    with get_conn() as conn:
+        expired = _delete_in_batches(
+            conn,
+            "crl_versions",
+            "SELECT id FROM crl_versions WHERE fetched_at < datetime('now', ?)",
+            (retention_cutoff,),
+            batch_size,
+        )
+        daily = _delete_in_batches(
+            conn,
+            "crl_versions",
+            """
+            SELECT id FROM crl_versions
+            WHERE fetched_at < datetime('now', ?) AND fetched_at >= datetime('now', ?)
+              AND id NOT IN (
+                  SELECT MAX(id) FROM crl_versions
+                  WHERE fetched_at < datetime('now', ?) AND fetched_at >= datetime('now', ?)
+                  GROUP BY crl_name, date(fetched_at)
+              )
+            """,
+            (full_cutoff, daily_cutoff, full_cutoff, daily_cutoff),
+            batch_size,
+        )
+        weekly = _delete_in_batches(
+            conn,
+            "crl_versions",
+            """
+            SELECT id FROM crl_versions
+            WHERE fetched_at < datetime('now', ?) AND fetched_at >= datetime('now', ?)
+              AND id NOT IN (
+                  SELECT MAX(id) FROM crl_versions
+                  WHERE fetched_at < datetime('now', ?) AND fetched_at >= datetime('now', ?)
+                  GROUP BY crl_name, strftime('%Y-%W', fetched_at)
+              )
+            """,
+            (daily_cutoff, retention_cutoff, daily_cutoff, retention_cutoff),
+            batch_size,
+        )
+    return {"expired": expired, "daily": daily, "weekly": weekly}
+
+
+# ---- Retention helpers ----
+def tsl_manifest_prune(keep_versions: int, batch_size: int = 500) -> int:
+    """Удаляет манифесты снимков УЦ для всех версий TSL, кроме последних keep_versions (версии из архива не удаляются)."""
+    with get_conn() as conn:
+        return _delete_in_batches(
+            conn,
+            "tsl_ca_manifest",
+            """
+            SELECT rowid FROM tsl_ca_manifest
+            WHERE version IN (
+                SELECT version FROM tsl_versions WHERE backfilled = 0 ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (max(1, int(keep_versions)),),
+            batch_size,
+        )
+
+
+def tsl_blobs_gc(batch_size: int = 500) -> int:
+    """Удаляет blob-ы снимков УЦ, на которые не ссылается ни один манифест."""
+    with get_conn() as conn:
+        return _delete_in_batches(
+            conn,
+            "tsl_ca_blob",
+            """
+            SELECT b.rowid FROM tsl_ca_blob b
+            WHERE NOT EXISTS (SELECT 1 FROM tsl_ca_manifest m WHERE m.blob_hash = b.blob_hash)
+            """,
+            (),
+            batch_size,
+        )
+
+
+def tsl_diffs_prune(retention_days: int, batch_size: int = 500) -> int:
+    """Удаляет диффы TSL, целевая версия которых старше retention_days (кроме версий из архива)."""
+    with get_conn() as conn:
+        return _delete_in_batches(
+            conn,
+            "tsl_diffs",
+            """
+            SELECT d.rowid FROM tsl_diffs d JOIN tsl_versions v ON v.version = d.to_version
+            WHERE v.created_at < datetime('now', ?) AND v.backfilled = 0
+            """,
+            (f"-{int(retention_days)} days",),
+            batch_size,
+        )
+
+
+def weekly_details_rollup(before_week_start: str, batch_size: int = 500) -> int:
+    """Сворачивает строки weekly_details с week_start < before_week_start в помесячные агрегаты и удаляет их."""
+    total = 0
+    with get_conn() as conn:
+        while True:
+            rows = conn.execute(
+                """
+                SELECT rowid, substr(week_start, 1, 7), ca_name, ca_reg_number, crl_name, reason, count
+                FROM weekly_details WHERE week_start < ? LIMIT ?
+                """,
+                (before_week_start, batch_size),
+            ).fetchall()
+            if not rows:
+                return total
+            conn.executemany(
+                """
+                INSERT INTO weekly_details_rollup (month, ca_name, ca_reg_number, crl_name, reason, count)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(month, crl_name, reason) DO UPDATE SET
+                    ca_name=excluded.ca_name,
+                    ca_reg_number=excluded.ca_reg_number,
+                    count=weekly_details_rollup.count + excluded.count
+                """,
+                [r[1:] for r in rows],
+            )
+            conn.executemany("DELETE FROM weekly_details WHERE rowid=?", [(r[0],) for r in rows])
+            conn.commit()
+            total += len(rows)
+
+
+def db_table_sizes() -> Dict[str, int]:
+    """Число строк в каждой таблице БД."""
+    with get_conn() as conn:
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+        return {t: int(conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0]) for t in tables}
+
+
+def db_checkpoint_and_vacuum(incremental_pages: int = 0, full_vacuum: bool = False) -> Dict[str, Any]:
+    """
+    Сброс WAL (wal_checkpoint(TRUNCATE)) и освобождение места.
+    При auto_vacuum=INCREMENTAL выполняется incremental_vacuum; full_vacuum=True однократно
+    переводит существующую БД в режим INCREMENTAL через полный VACUUM.
+    """
+    with get_conn() as conn:
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum;").fetchone()[0]
+        if full_vacuum and auto_vacuum != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            conn.execute("VACUUM;")
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum;").fetchone()[0]
+        freelist_before = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        if auto_vacuum == 2:
+            # fetchall() обязателен: pragma освобождает страницы по мере пошагового чтения результата
+            conn.execute(f"PRAGMA incremental_vacuum({int(incremental_pages)});" if incremental_pages else "PRAGMA incremental_vacuum;").fetchall()
+            conn.commit()
+        checkpoint = conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+        freelist_after = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+    return {
+        "auto_vacuum": auto_vacuum,
+        "freed_pages": max(0, freelist_before - freelist_after),
+        "checkpoint_busy": checkpoint[0] if checkpoint else None,
+    }
+
+
+def crl_versions_history(crl_name: str, since: Optional[str] = None, limit: Optional[int] = None) -> list:
+    """История версий одного CRL (по возрастанию времени). since — 'YYYY-MM-DD[ HH:MM:SS]' UTC."""
+    sql = (
+        "SELECT crl_number, this_update, next_update, revoked_count, size_bytes, fetch_latency_ms, digest, source_host, fetched_at "
+        "FROM crl_versions WHERE crl_name=? AND fetched_at >= COALESCE(?, '') ORDER BY fetched_at"
+    )
+    params: tuple = (crl_name, since)
+    if limit:
+        sql += " LIMIT ?"
+        params += (int(limit),)
+    with get_conn() as conn:
+        cur = conn.execute(sql, params)
+        return [
+            {
+                "crl_number": r[0], "this_update": r[1], "next_update": r[2], "revoked_count": r[3],
+                "size_bytes": r[4], "fetch_latency_ms": r[5], "digest": r[6], "source_host": r[7], "fetched_at": r[8],
+            }
+            for r in cur.fetchall()
+        ]
+
+
+def crl_versions_ca_trend(ca_reg_number: str, since: Optional[str] = None, bucket: str = "day") -> list:
+    """Тренд по УЦ: на каждый CRL и интервал (day|week|month) — число версий, максимум отозванных, размер и средняя задержка скачивания."""
+    fmt = {"day": "%Y-%m-%d", "week": "%Y-%W", "month": "%Y-%m"}.get(bucket, "%Y-%m-%d")
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            SELECT strftime(?, fetched_at) AS bucket, crl_name, COUNT(*), MAX(revoked_count), MAX(size_bytes), AVG(fetch_latency_ms)
+            FROM crl_versions
+            WHERE ca_reg_number=? AND fetched_at >= COALESCE(?, '')
+            GROUP BY bucket, crl_name
+            ORDER BY bucket, crl_name
+            """,
+            (fmt, ca_reg_number, since),
+        )
+        return [
+            {
+                "bucket": r[0], "crl_name": r[1], "versions": r[2], "max_revoked_count": r[3],
+                "max_size_bytes": r[4], "avg_fetch_latency_ms": None if r[5] is None else round(r[5], 1),
+            }
+            for r in cur.fetchall()
+        ]
+
+
+def crl_versions_publication_delays(crl_name: str, since: Optional[str] = None) -> list:
+    """
+    Задержки публикации по версиям CRL:
+    - publication_delay_s — thisUpdate новой версии минус nextUpdate предыдущей (>0 — опоздание);
+    - detection_delay_s — время обнаружения версии минус её thisUpdate.
+    """
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            SELECT crl_number, this_update, fetched_at,
+                   (julianday(this_update) - julianday(LAG(next_update) OVER w)) * 86400.0,
+                   (julianday(fetched_at) - julianday(this_update)) * 86400.0
+            FROM crl_versions
+            WHERE crl_name=? AND fetched_at >= COALESCE(?, '')
+            WINDOW w AS (ORDER BY fetched_at)
+            ORDER BY fetched_at
+            """,
+            (crl_name, since),
+        )
+        return [
+            {
+                "crl_number": r[0], "this_update": r[1], "fetched_at": r[2],
+                "publication_delay_s": None if r[3] is None else round(r[3]),
+                "detection_delay_s": None if r[4] is None else round(r[4]),
+            }
+            for r in cur.fetchall()
+        ]
+
+
+# ---- CA key index helpers ----
+def ca_keys_replace(tsl_version: str, rows: list) -> None:
+    """Замена индекса ключей УЦ набором текущей версии TSL: rows — (key_id, reg_number, ca_name, subject_dn, cert_fingerprint)."""
+    if not rows:
+        return
+    with get_conn() as conn:
+        conn.execute("DELETE FROM ca_keys")
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO ca_keys (key_id, ca_reg_number, ca_name, subject_dn, cert_fingerprint, tsl_version)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(r[0], r[1], r[2], r[3], r[4], tsl_version) for r in rows if r[0]],
+        )
+        conn.commit()
+
+
+def ca_keys_get_all() -> list:
+    """Все ключи УЦ: [{key_id, reg_number, name, subject_dn, cert_fingerprint}]."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT key_id, ca_reg_number, ca_name, subject_dn, cert_fingerprint FROM ca_keys")
+        return [
+            {'key_id': r[0], 'reg_number': r[1], 'name': r[2], 'subject_dn': r[3], 'cert_fingerprint': r[4]}
+            for r in cur.fetchall()
+        ]
+
+
 # ---- TSL versioning helpers ----
 
 def tsl_versions_get_last() -> Optional[Tuple[str, Dict[str, Any]]]:
     with get_conn() as conn:
-        cur = conn.execute("SELECT version, date, root_schema_location, xml_sha256, created_at FROM tsl_versions ORDER BY created_at DESC LIMIT 1")
+        cur = conn.execute(
+            "SELECT version, date, root_schema_location, xml_sha256, created_at, etag, last_modified, checked_at "
+            "FROM tsl_versions ORDER BY created_at DESC LIMIT 1"
+        )
         row = cur.fetchone()
         if not row:
             return None
@@ -352,8 +870,12 @@ def tsl_versions_get_last() -> Optional[Tuple[str, Dict[str, Any]]]:
             'root_schema_location': row[2],
             'xml_sha256': row[3],
             'created_at': row[4],
+            'etag': row[5],
+            'last_modified': row[6],
+            'checked_at': row[7],
         }
 
+@timed
 def tsl_versions_upsert(version: str, date: Optional[str], root_schema_location: Optional[str], xml_sha256: Optional[str]) -> None:
     with get_conn() as conn:
         conn.execute(
@@ -369,33 +891,125 @@ def tsl_versions_upsert(version: str, date: Optional[str], root_schema_location:
         )
         conn.commit()
 
-def tsl_ca_snapshots_get(version: str) -> Dict[str, Dict[str, Any]]:
+def tsl_versions_mark_checked(version: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+    """Отметка проверки версии TSL и сохранение HTTP-валидаторов для следующей условной загрузки."""
     with get_conn() as conn:
-        cur = conn.execute("SELECT entity_key, snapshot_json FROM tsl_ca_snapshot WHERE version=?", (version,))
-        res: Dict[str, Dict[str, Any]] = {}
-        for row in cur.fetchall():
-            key = row[0]
-            try:
-                res[key] = json.loads(row[1])
-            except Exception:
-                res[key] = {}
+        conn.execute(
+            """
+            UPDATE tsl_versions SET
+                etag=COALESCE(?, etag),
+                last_modified=COALESCE(?, last_modified),
+                checked_at=datetime('now')
+            WHERE version=?
+            """,
+            (etag, last_modified, version),
+        )
+        conn.commit()
+
+def tsl_versions_get_all() -> Dict[str, Dict[str, Any]]:
+    """Все сохраненные версии TSL: version -> {date, root_schema_location, xml_sha256, created_at}."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT version, date, root_schema_location, xml_sha256, created_at FROM tsl_versions")
+        return {
+            row[0]: {'date': row[1], 'root_schema_location': row[2], 'xml_sha256': row[3], 'created_at': row[4]}
+            for row in cur.fetchall()
+        }
+
+def tsl_backfill_write(versions: list, blobs: Dict[str, str], manifest: list, diffs: list) -> None:
+    """
+    Загрузка пачки исторических версий TSL одной транзакцией; версии помечаются backfilled и не удаляются ретеншном.
+    versions — (version, date, root_schema_location, xml_sha256, created_at), blobs — blob_hash -> JSON,
+    manifest — (version, entity_key, blob_hash), diffs — строки tsl_diffs.
+    """
+    with get_conn() as conn:
+        conn.executemany(
+            """
+            INSERT INTO tsl_versions (version, date, root_schema_location, xml_sha256, created_at, backfilled)
+            VALUES (?, ?, ?, ?, ?, 1)
+            ON CONFLICT(version) DO NOTHING
+            """,
+            versions,
+        )
+        conn.executemany("INSERT OR IGNORE INTO tsl_ca_blob (blob_hash, snapshot_json) VALUES (?, ?)", list(blobs.items()))
+        conn.executemany("INSERT OR REPLACE INTO tsl_ca_manifest (version, entity_key, blob_hash) VALUES (?, ?, ?)", manifest)
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO tsl_diffs (from_version, to_version, entity_type, entity_key, path, old_value, new_value)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            diffs,
+        )
+        conn.commit()
+
+def tsl_snapshot_digest(snapshot: Dict[str, Any]) -> Tuple[str, str]:
+    """Канонический JSON снимка УЦ и его SHA-256: (blob_hash, snapshot_json)."""
+    canonical = json.dumps(snapshot, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest(), canonical
+
+
+def tsl_ca_manifest_get(version: str) -> Dict[str, str]:
+    """Манифест версии TSL: entity_key -> blob_hash (без чтения самих снимков)."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT entity_key, blob_hash FROM tsl_ca_manifest WHERE version=?", (version,))
+        return {row[0]: row[1] for row in cur.fetchall()}
+
+
+def tsl_ca_blobs_get(blob_hashes) -> Dict[str, Dict[str, Any]]:
+    """Снимки УЦ по хешам (читаются только запрошенные blob-ы)."""
+    hashes = list(set(blob_hashes or []))
+    res: Dict[str, Dict[str, Any]] = {}
+    if not hashes:
         return res
+    with get_conn() as conn:
+        # SQLite ограничивает число параметров запроса — читаем порциями
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            cur = conn.execute(
+                f"SELECT blob_hash, snapshot_json FROM tsl_ca_blob WHERE blob_hash IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for row in cur.fetchall():
+                try:
+                    res[row[0]] = json.loads(row[1])
+                except Exception:
+                    res[row[0]] = {}
+    return res
+
 
-def tsl_ca_snapshots_write(version: str, snapshots: Dict[str, Dict[str, Any]]) -> None:
+def tsl_ca_snapshots_get(version: str) -> Dict[str, Dict[str, Any]]:
+    manifest = tsl_ca_manifest_get(version)
+    blobs = tsl_ca_blobs_get(manifest.values())
+    return {key: blobs.get(blob_hash, {}) for key, blob_hash in manifest.items()}
+
+@timed
+def tsl_ca_snapshots_write(version: str, snapshots: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """Записывает снимки версии: новые blob-ы один раз, плюс манифест версии. Возвращает манифест entity_key -> blob_hash."""
     if not snapshots:
-        return
+        return {}
+    manifest: Dict[str, str] = {}
+    blobs: Dict[str, str] = {}
+    for key, snapshot in snapshots.items():
+        blob_hash, canonical = tsl_snapshot_digest(snapshot)
+        manifest[key] = blob_hash
+        blobs[blob_hash] = canonical
     with get_conn() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO tsl_ca_blob (blob_hash, snapshot_json) VALUES (?, ?)",
+            list(blobs.items()),
+        )
         conn.executemany(
             """
-            INSERT INTO tsl_ca_snapshot (version, entity_key, snapshot_json)
+            INSERT INTO tsl_ca_manifest (version, entity_key, blob_hash)
             VALUES (?, ?, ?)
             ON CONFLICT(version, entity_key) DO UPDATE SET
-                snapshot_json=excluded.snapshot_json
+                blob_hash=excluded.blob_hash
             """,
-            [(version, k, json.dumps(v, ensure_ascii=False)) for k, v in snapshots.items()],
+            [(version, k, h) for k, h in manifest.items()],
         )
         conn.commit()
+    return manifest
 
+@timed
 def tsl_diffs_write(from_version: Optional[str], to_version: str, diffs: list) -> None:
     if not diffs:
         return
@@ -410,3 +1024,282 @@ def tsl_diffs_write(from_version: Optional[str], to_version: str, diffs: list) -
         conn.commit()
 
 
+# ---- URL inventory helpers ----
+
+def url_inventory_load() -> Optional[Tuple[int, str, Dict[str, str]]]:
+    """Последняя версия инвентаря URL: (version, inputs_hash, {url: source}) или None."""
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT version, inputs_hash FROM url_inventory_versions ORDER BY version DESC LIMIT 1"
+        ).fetchone()
+        if not row:
+            return None
+        urls = {r[0]: r[1] for r in conn.execute("SELECT url, source FROM url_inventory")}
+        return row[0], row[1], urls
+
+
+@timed
+def url_inventory_commit(inputs_hash: str, urls: Dict[str, str], added, removed) -> int:
+    """Новая версия инвентаря URL одной транзакцией: строка версии, дельты и изменения текущего набора. Возвращает номер версии."""
+    added = sorted(added or ())
+    removed = sorted(removed or ())
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO url_inventory_versions (inputs_hash, url_count, added_count, removed_count, created_at)
+            VALUES (?, ?, ?, ?, datetime('now'))
+            """,
+            (inputs_hash, len(urls), len(added), len(removed)),
+        )
+        version = cur.lastrowid
+        conn.executemany(
+            "INSERT OR REPLACE INTO url_inventory_deltas (version, url, action) VALUES (?, ?, ?)",
+            [(version, url, 'added') for url in added] + [(version, url, 'removed') for url in removed],
+        )
+        conn.executemany("DELETE FROM url_inventory WHERE url=?", [(url,) for url in removed])
+        conn.executemany(
+            "INSERT OR IGNORE INTO url_inventory (url, source, first_version) VALUES (?, ?, ?)",
+            [(url, urls.get(url), version) for url in added],
+        )
+        conn.commit()
+        return version
+
+
+def url_inventory_deltas_prune(retention_days: int, batch_size: int = 500) -> int:
+    """Удаляет версии инвентаря URL (и их дельты) старше retention_days, кроме последней версии."""
+    with get_conn() as conn:
+        deleted = _delete_in_batches(
+            conn,
+            "url_inventory_deltas",
+            """
+            SELECT d.rowid FROM url_inventory_deltas d JOIN url_inventory_versions v ON v.version = d.version
+            WHERE v.created_at < datetime('now', ?)
+              AND v.version < (SELECT MAX(version) FROM url_inventory_versions)
+            """,
+            (f"-{int(retention_days)} days",),
+            batch_size,
+        )
+        deleted += _delete_in_batches(
+            conn,
+            "url_inventory_versions",
+            """
+            SELECT rowid FROM url_inventory_versions
+            WHERE created_at < datetime('now', ?)
+              AND version < (SELECT MAX(version) FROM url_inventory_versions)
+            """,
+            (f"-{int(retention_days)} days",),
+            batch_size,
+        )
+        return deleted
+
+
+# ---- Notification outbox helpers ----
+# status: pending — ждет отправки; sending — взято отправителем (до next_attempt_at, затем снова доступно);
+# sent — доставлено; failed — исчерпаны попытки
+
+def _notification_dedup_admit(conn, event_key: str, ttl_seconds: int) -> Tuple[bool, int]:
+    """Событие впервые за окно TTL? (admitted, expires_at unix). Повтор внутри окна увеличивает счетчик suppressed."""
+    cur = conn.execute(
+        """
+        INSERT INTO notification_dedup (event_key, first_seen, expires_at, suppressed)
+        VALUES (?, datetime('now'), datetime('now', ?), 0)
+        ON CONFLICT(event_key) DO UPDATE SET
+            first_seen=excluded.first_seen, expires_at=excluded.expires_at, suppressed=0
+        WHERE notification_dedup.expires_at <= datetime('now')
+        """,
+        (event_key, f"+{int(ttl_seconds)} seconds"),
+    )
+    admitted = cur.rowcount > 0
+    if not admitted:
+        conn.execute("UPDATE notification_dedup SET suppressed=suppressed+1 WHERE event_key=?", (event_key,))
+    row = conn.execute(
+        "SELECT CAST(strftime('%s', expires_at) AS INTEGER) FROM notification_dedup WHERE event_key=?", (event_key,)
+    ).fetchone()
+    return admitted, int(row[0]) if row and row[0] else 0
+
+
+@timed
+def notification_dedup_admit(event_key: str, ttl_seconds: int) -> Tuple[bool, int]:
+    with get_conn() as conn:
+        result = _notification_dedup_admit(conn, event_key, ttl_seconds)
+        conn.commit()
+        return result
+
+
+def notification_dedup_prune(batch_size: int = 500) -> int:
+    """Удаляет ключи дедупликации с истекшим окном."""
+    with get_conn() as conn:
+        return _delete_in_batches(
+            conn,
+            "notification_dedup",
+            "SELECT rowid FROM notification_dedup WHERE expires_at < datetime('now')",
+            (),
+            batch_size,
+        )
+
+
+@timed
+def notification_outbox_enqueue(idempotency_key: str, priority: int, message: str, dedup_ttl_seconds: Optional[int] = None,
+                                rearm: bool = False) -> Tuple[str, int]:
+    """
+    Добавляет уведомление в очередь. Возвращает (результат, expires_at окна дедупликации):
+    queued — поставлено; duplicate — уведомление с таким ключом уже ждет отправки;
+    suppressed — событие уже было в пределах dedup_ttl_seconds.
+    С dedup_ttl_seconds проверка индекса дедупликации и запись в очередь — одна транзакция;
+    доставленное ранее уведомление с тем же ключом после окна TTL ставится заново.
+    rearm — событие уже прошло дедупликацию (например, при сборе сводки): доставленное ранее уведомление
+    с тем же ключом ставится заново без проверки индекса.
+    """
+    with get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        expires_at = 0
+        if dedup_ttl_seconds:
+            admitted, expires_at = _notification_dedup_admit(conn, idempotency_key, dedup_ttl_seconds)
+            if not admitted:
+                conn.commit()
+                return 'suppressed', expires_at
+        if dedup_ttl_seconds or rearm:
+            conflict = """
+                ON CONFLICT(idempotency_key) DO UPDATE SET
+                    priority=excluded.priority, message=excluded.message, status='pending', attempts=0,
+                    next_attempt_at=excluded.next_attempt_at, last_error=NULL, created_at=excluded.created_at, sent_at=NULL
+                WHERE notification_outbox.status IN ('sent', 'failed')
+            """
+        else:
+            conflict = "ON CONFLICT(idempotency_key) DO NOTHING"
+        cur = conn.execute(
+            f"""
+            INSERT INTO notification_outbox (idempotency_key, priority, message, status, next_attempt_at, created_at)
+            VALUES (?, ?, ?, 'pending', datetime('now'), datetime('now'))
+            {conflict}
+            """,
+            (idempotency_key, priority, message),
+        )
+        conn.commit()
+        return ('queued' if cur.rowcount > 0 else 'duplicate'), expires_at
+
+
+@timed
+def notification_outbox_claim(limit: int, lease_seconds: int) -> list:
+    """
+    Забирает до limit уведомлений, готовых к отправке, в порядке приоритета и постановки.
+    Взятые строки недоступны другим отправителям lease_seconds секунд: если процесс
+    упал посреди отправки, по истечении аренды строка будет отправлена снова.
+    """
+    with get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            """
+            SELECT id, idempotency_key, priority, message, attempts, CAST(strftime('%s', created_at) AS INTEGER)
+            FROM notification_outbox
+            WHERE status IN ('pending', 'sending') AND next_attempt_at <= datetime('now')
+            ORDER BY priority, id
+            LIMIT ?
+            """,
+            (int(limit),),
+        ).fetchall()
+        conn.executemany(
+            """
+            UPDATE notification_outbox
+            SET status='sending', attempts=attempts+1, next_attempt_at=datetime('now', ?)
+            WHERE id=?
+            """,
+            [(f"+{int(lease_seconds)} seconds", row[0]) for row in rows],
+        )
+        conn.commit()
+        return [
+            {'id': r[0], 'idempotency_key': r[1], 'priority': r[2], 'message': r[3], 'attempts': r[4] + 1, 'created_ts': r[5] or 0}
+            for r in rows
+        ]
+
+
+@timed
+def notification_outbox_mark_sent(outbox_id: int) -> None:
+    with get_conn() as conn:
+        conn.execute(
+            "UPDATE notification_outbox SET status='sent', sent_at=datetime('now'), last_error=NULL WHERE id=?",
+            (outbox_id,),
+        )
+        conn.commit()
+
+
+@timed
+def notification_outbox_mark_retry(outbox_id: int, error: Optional[str], delay_seconds: int, give_up: bool) -> None:
+    """Неудачная попытка: повтор через delay_seconds или статус failed, если попытки исчерпаны."""
+    with get_conn() as conn:
+        conn.execute(
+            """
+            UPDATE notification_outbox
+            SET status=?, last_error=?, next_attempt_at=datetime('now', ?)
+            WHERE id=?
+            """,
+            ('failed' if give_up else 'pending', error, f"+{int(delay_seconds)} seconds", outbox_id),
+        )
+        conn.commit()
+
+
+def notification_outbox_release(outbox_ids) -> None:
+    """Возвращает взятые, но не отправленные уведомления в очередь без учета попытки."""
+    with get_conn() as conn:
+        conn.executemany(
+            """
+            UPDATE notification_outbox
+            SET status='pending', attempts=MAX(attempts-1, 0), next_attempt_at=datetime('now')
+            WHERE id=? AND status='sending'
+            """,
+            [(outbox_id,) for outbox_id in outbox_ids],
+        )
+        conn.commit()
+
+
+def notification_outbox_pending() -> Tuple[int, int]:
+    """(готовые к отправке сейчас, всего неотправленные) — для метрик и ожидания при остановке."""
+    with get_conn() as conn:
+        row = conn.execute(
+            """
+            SELECT
+                COALESCE(SUM(CASE WHEN status='sending' OR next_attempt_at <= datetime('now') THEN 1 ELSE 0 END), 0),
+                COUNT(*)
+            FROM notification_outbox WHERE status IN ('pending', 'sending')
+            """
+        ).fetchone()
+        return int(row[0]), int(row[1])
+
+
+def notification_outbox_prune(retention_days: int, batch_size: int = 500) -> int:
+    """Удаляет доставленные и окончательно неотправленные уведомления старше retention_days (вместе с их ключами идемпотентности)."""
+    with get_conn() as conn:
+        return _delete_in_batches(
+            conn,
+            "notification_outbox",
+            """
+            SELECT rowid FROM notification_outbox
+            WHERE status IN ('sent', 'failed') AND created_at < datetime('now', ?)
+            """,
+            (f"-{int(retention_days)} days",),
+            batch_size,
+        )
+
+
+# ---- Status board helpers ----
+
+def status_board_get(chat_id: str) -> Tuple[Optional[int], Optional[str]]:
+    """(message_id, content_hash) табло состояния чата или (None, None)."""
+    with get_conn() as conn:
+        row = conn.execute("SELECT message_id, content_hash FROM status_board WHERE chat_id=?", (str(chat_id),)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+
+@timed
+def status_board_set(chat_id: str, message_id: Optional[int], content_hash: Optional[str]) -> None:
+    with get_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO status_board (chat_id, message_id, content_hash, updated_at)
+            VALUES (?, ?, ?, datetime('now'))
+            ON CONFLICT(chat_id) DO UPDATE SET
+                message_id=excluded.message_id, content_hash=excluded.content_hash, updated_at=excluded.updated_at
+            """,
+            (str(chat_id), message_id, content_hash),
+        )
+        conn.commit()
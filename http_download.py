@@ -0,0 +1,199 @@
+# ./http_download.py
+"""
+Загрузка TSL и CRL с докачкой через HTTP Range.
+
+Успешная загрузка целиком идет в память, без записи на диск. Если соединение
+оборвалось посреди передачи, полученные байты сохраняются в DOWNLOAD_PARTIAL_DIR
+вместе с валидатором ответа (сильный ETag или Last-Modified). Следующая попытка —
+в том же вызове или в следующем цикле — запрашивает `Range: bytes=N-` с `If-Range`;
+если сервер вернул 206 с тем же смещением, загрузка продолжается, иначе
+(200 — файл изменился или Range не поддерживается) начинается заново.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+import requests
+
+from config import VERIFY_TLS, DOWNLOAD_PARTIAL_DIR, DOWNLOAD_RESUME_MIN_BYTES, DOWNLOAD_PARTIAL_MAX_AGE_HOURS
+from metrics import download_bytes_total, download_resumed_bytes_total, download_resume_total, download_retry_seconds, http_stage_seconds, url_host
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class DownloadResult:
+    def __init__(self, status_code, content, headers, resumed_from=0):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.resumed_from = resumed_from
+
+
+class PartialDownload:
+    """Недокачанный файл: partial/<sha1(url)>.part и метаданные .json (url, валидатор, время)."""
+
+    def __init__(self, url, partial_dir=DOWNLOAD_PARTIAL_DIR):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        self.url = url
+        self.data_path = os.path.join(partial_dir, name + '.part')
+        self.meta_path = os.path.join(partial_dir, name + '.json')
+
+    def load(self):
+        """(size, validator) сохраненной части или (0, None), если докачка невозможна."""
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            size = os.path.getsize(self.data_path)
+        except (OSError, ValueError):
+            return 0, None
+        too_old = time.time() - meta.get('saved_at', 0) > DOWNLOAD_PARTIAL_MAX_AGE_HOURS * 3600
+        if meta.get('url') != self.url or not meta.get('validator') or size != meta.get('size') or too_old:
+            self.discard()
+            return 0, None
+        return size, meta['validator']
+
+    def read(self):
+        with open(self.data_path, 'rb') as f:
+            return f.read()
+
+    def save(self, data, validator):
+        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+        with open(self.data_path, 'wb') as f:
+            f.write(data)
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'url': self.url, 'validator': validator, 'size': len(data), 'saved_at': time.time()}, f)
+
+    def discard(self):
+        for path in (self.data_path, self.meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def resume_validator(headers):
+    """Валидатор для If-Range: сильный ETag (слабый W/ для Range не допускается) или Last-Modified."""
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def _expected_total(response, offset):
+    content_range = _CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+    if content_range and content_range.group(3) != '*':
+        return int(content_range.group(3))
+    length = response.headers.get('Content-Length')
+    return offset + int(length) if length and length.isdigit() else None
+
+
+def _attempt(url, kind, part, headers, timeout, verify):
+    request_headers = dict(headers or {})
+    offset, validator = part.load()
+    if offset:
+        request_headers['Range'] = f'bytes={offset}-'
+        request_headers['If-Range'] = validator
+    host = url_host(url)
+    started = time.perf_counter()
+    with requests.get(url, timeout=timeout, headers=request_headers, stream=True, verify=verify) as response:
+        # stream=True: запрос возвращается после заголовков — это DNS, TCP/TLS и ожидание ответа сервера
+        http_stage_seconds.labels(kind=kind, stage='connect', host=host).observe(time.perf_counter() - started)
+        if response.status_code == 304:
+            return DownloadResult(304, None, response.headers)
+        if response.status_code == 416 and offset:
+            # Сохраненная часть не соответствует файлу на сервере
+            part.discard()
+            download_resume_total.labels(kind=kind, result='discarded').inc()
+            raise requests.exceptions.RequestException(f"416 Range Not Satisfiable для {url}, частичная загрузка удалена")
+        response.raise_for_status()
+
+        prefix = b''
+        if offset and response.status_code == 206:
+            content_range = _CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+            if not content_range or int(content_range.group(1)) != offset:
+                part.discard()
+                download_resume_total.labels(kind=kind, result='discarded').inc()
+                raise requests.exceptions.RequestException(f"Неожиданный Content-Range для {url}: {response.headers.get('Content-Range')}")
+            prefix = part.read()
+            download_resume_total.labels(kind=kind, result='resumed').inc()
+            download_resumed_bytes_total.labels(kind=kind).inc(offset)
+            logger.info(f"Докачка {url} с {offset} байт")
+        elif offset:
+            # 200: файл изменился (If-Range) или сервер не поддерживает Range — загрузка с начала
+            part.discard()
+            offset = 0
+            download_resume_total.labels(kind=kind, result='restarted').inc()
+            logger.info(f"Сервер вернул {url} целиком, частичная загрузка отброшена")
+
+        # Докачивать можно только байты без Content-Encoding: для них смещение совпадает с Range
+        encoding = response.headers.get('Content-Encoding', 'identity').lower()
+        resumable = encoding == 'identity'
+        expected_total = _expected_total(response, offset) if resumable else None
+        buffer = bytearray(prefix)
+        body_started = time.perf_counter()
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                buffer.extend(chunk)
+            if expected_total is not None and len(buffer) < expected_total:
+                raise requests.exceptions.ChunkedEncodingError(f"получено {len(buffer)} из {expected_total} байт")
+            http_stage_seconds.labels(kind=kind, stage='body', host=host).observe(time.perf_counter() - body_started)
+        except requests.exceptions.RequestException:
+            validator = resume_validator(response.headers) or (validator if response.status_code == 206 else None)
+            download_bytes_total.labels(kind=kind).inc(len(buffer) - len(prefix))
+            if resumable and validator and len(buffer) >= DOWNLOAD_RESUME_MIN_BYTES:
+                part.save(bytes(buffer), validator)
+                download_resume_total.labels(kind=kind, result='saved').inc()
+                logger.info(f"Загрузка {url} прервана на {len(buffer)} байт, частичная загрузка сохранена для докачки")
+            raise
+        download_bytes_total.labels(kind=kind).inc(len(buffer) - len(prefix))
+    part.discard()
+    return DownloadResult(response.status_code, bytes(buffer), response.headers, resumed_from=offset)
+
+
+def fetch_resumable(url, kind, headers=None, timeout=30, tries=3, backoff=1, verify=VERIFY_TLS, on_error=None):
+    """
+    GET с ретраями, экспоненциальным бэкоффом и докачкой. Возвращает DownloadResult
+    (status_code 200/206 с content или 304 без него); после последней неудачной попытки
+    пробрасывает исключение requests. on_error(exc, attempt) вызывается на каждую неудачную попытку.
+    """
+    part = PartialDownload(url)
+    first_failure = None
+    for attempt in range(1, tries + 1):
+        try:
+            result = _attempt(url, kind, part, headers, timeout, verify)
+            if first_failure is not None:
+                download_retry_seconds.labels(kind=kind).observe(time.monotonic() - first_failure)
+            return result
+        except requests.exceptions.RequestException as e:
+            if first_failure is None:
+                first_failure = time.monotonic()
+            if on_error is not None:
+                on_error(e, attempt)
+            if attempt >= tries:
+                download_retry_seconds.labels(kind=kind).observe(time.monotonic() - first_failure)
+                raise
+            time.sleep(backoff)
+            backoff *= 2
+
+
+def cleanup_stale_partials(partial_dir=DOWNLOAD_PARTIAL_DIR, max_age_hours=DOWNLOAD_PARTIAL_MAX_AGE_HOURS):
+    """Удаление частичных загрузок старше max_age_hours (например, для URL, исключенных из проверки). Возвращает число файлов."""
+    if not os.path.isdir(partial_dir):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for name in os.listdir(partial_dir):
+        path = os.path.join(partial_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
@@ -2,8 +2,16 @@
 """
 Общие метрики для проекта CRL Checker
 """
-from prometheus_client import Counter, Gauge
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from config import METRICS_MAX_HOSTS
 from metrics_server import MetricsRegistry
+from utils import parse_datetime_with_tz
 
 # CRL Monitor метрики
 crl_checks_total = Counter('crl_checks_total', 'Total CRL check runs', registry=MetricsRegistry.registry)
@@ -12,10 +20,173 @@ crl_unique_urls = Gauge('crl_unique_urls', 'Unique CRL URLs per run', registry=M
 crl_skipped_empty = Counter('crl_skipped_empty', 'Skipped empty CRLs with long validity', registry=MetricsRegistry.registry)
 crl_download_errors = Counter('crl_download_errors_total', 'CRL download errors', ['crl_name', 'error_type'], registry=MetricsRegistry.registry)
 crl_parse_errors = Counter('crl_parse_errors_total', 'CRL parsing errors', ['crl_name', 'error_type'], registry=MetricsRegistry.registry)
-crl_status = Gauge('crl_status', 'CRL processing status', ['crl_name', 'status'], registry=MetricsRegistry.registry)
+crl_url_inventory_size = Gauge('crl_url_inventory_size', 'CRL URLs in the current URL inventory version', registry=MetricsRegistry.registry)
+crl_url_inventory_rebuilds = Counter('crl_url_inventory_rebuilds_total', 'URL inventory rebuild attempts by result (changed/unchanged)', ['result'], registry=MetricsRegistry.registry)
+crl_cycle_duration_seconds = Gauge('crl_cycle_duration_seconds', 'Duration of the last full CRL check cycle', registry=MetricsRegistry.registry)
+crl_cycle_lag_seconds = Gauge('crl_cycle_lag_seconds', 'How much later than CHECK_INTERVAL after the previous start the last CRL cycle started', registry=MetricsRegistry.registry)
+
+# Длительность этапов конвейера CRL (stage: download/parse/extract/categorize/db_write/state_save/group)
+crl_stage_seconds = Histogram(
+    'crl_stage_duration_seconds', 'CRL pipeline stage duration', ['stage'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300), registry=MetricsRegistry.registry,
+)
+# Этапы HTTP-загрузки (stage: connect — DNS, TCP/TLS и ожидание заголовков ответа; body — получение тела)
+http_stage_seconds = Histogram(
+    'http_stage_duration_seconds', 'HTTP download stage duration by host', ['kind', 'stage', 'host'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120), registry=MetricsRegistry.registry,
+)
+db_operation_seconds = Histogram(
+    'db_operation_duration_seconds', 'SQLite helper call duration', ['operation'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5), registry=MetricsRegistry.registry,
+)
 
 # TSL Monitor метрики
 tsl_checks_total = Counter('tsl_checks_total', 'Total TSL check runs', registry=MetricsRegistry.registry)
 tsl_fetch_status = Counter('tsl_fetch_total', 'TSL fetch attempts', ['result'], registry=MetricsRegistry.registry)
 tsl_active_cas = Gauge('tsl_active_cas', 'Active CAs parsed from TSL', registry=MetricsRegistry.registry)
 tsl_crl_urls = Gauge('tsl_crl_urls', 'Unique CRL URLs extracted from TSL', registry=MetricsRegistry.registry)
+tsl_check_outcome = Counter('tsl_check_outcome_total', 'TSL check outcomes (changed/unchanged/error)', ['outcome'], registry=MetricsRegistry.registry)
+
+# Ретеншн и размер БД
+db_table_rows = Gauge('db_table_rows', 'Rows per SQLite table', ['table'], registry=MetricsRegistry.registry)
+db_file_size_bytes = Gauge('db_file_size_bytes', 'SQLite database file sizes', ['file'], registry=MetricsRegistry.registry)
+retention_deleted_rows = Counter('retention_deleted_rows_total', 'Rows deleted or rolled up by retention', ['table'], registry=MetricsRegistry.registry)
+retention_last_run_seconds = Gauge('retention_last_run_duration_seconds', 'Duration of the last retention run', registry=MetricsRegistry.registry)
+
+# Загрузки TSL/CRL с докачкой (kind: tsl/crl)
+download_bytes_total = Counter('download_bytes_total', 'Bytes received from the network', ['kind'], registry=MetricsRegistry.registry)
+download_resumed_bytes_total = Counter('download_resumed_bytes_total', 'Bytes not re-downloaded thanks to Range resume', ['kind'], registry=MetricsRegistry.registry)
+download_resume_total = Counter('download_resume_total', 'Partial download events (saved/resumed/restarted/discarded)', ['kind', 'result'], registry=MetricsRegistry.registry)
+download_retry_seconds = Histogram(
+    'download_retry_duration_seconds', 'Wall time from the first failed attempt to the final outcome', ['kind'],
+    buckets=(1, 2, 5, 10, 30, 60, 120, 300, 600), registry=MetricsRegistry.registry,
+)
+
+# Очередь уведомлений (priority: critical/high/normal/low)
+notification_queue_size = Gauge('notification_queue_size', 'Notifications waiting in the outbox queue', registry=MetricsRegistry.registry)
+notifications_total = Counter('notifications_total', 'Notifications by priority and result (queued/sent/failed)', ['priority', 'result'], registry=MetricsRegistry.registry)
+notification_queue_delay_seconds = Histogram(
+    'notification_queue_delay_seconds', 'Time from enqueue to successful delivery', ['priority'],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600), registry=MetricsRegistry.registry,
+)
+telegram_rate_limit_wait_seconds = Histogram(
+    'telegram_rate_limit_wait_seconds', 'Time a Telegram request waited for rate limiter tokens',
+    buckets=(0.1, 0.5, 1, 3, 5, 10, 30, 60, 300), registry=MetricsRegistry.registry,
+)
+telegram_request_seconds = Histogram(
+    'telegram_request_duration_seconds', 'Telegram Bot API request duration without rate limiter wait', ['result'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30), registry=MetricsRegistry.registry,
+)
+telegram_throttled_total = Counter('telegram_throttled_total', 'Telegram 429 Too Many Requests responses', registry=MetricsRegistry.registry)
+notification_digest_total = Counter('notification_digest_total', 'Digest mode: events collected and digest messages produced', ['result'], registry=MetricsRegistry.registry)
+notifications_suppressed_total = Counter('notifications_suppressed_total', 'Notifications suppressed by the dedup index (repeat within TTL)', ['event'], registry=MetricsRegistry.registry)
+status_board_updates_total = Counter('status_board_updates_total', 'Status board updates by result (created/edited/unchanged/skipped/error)', ['result'], registry=MetricsRegistry.registry)
+
+# Каналы уведомлений кроме Telegram (sink: webhook/file/stdout)
+notification_sink_queue_size = Gauge('notification_sink_queue_size', 'Events waiting in a notification sink queue', ['sink'], registry=MetricsRegistry.registry)
+notification_sink_events_total = Counter('notification_sink_events_total', 'Notification sink events by result (queued/delivered/retry/failed/dropped)', ['sink', 'result'], registry=MetricsRegistry.registry)
+notification_sink_delivery_seconds = Histogram(
+    'notification_sink_delivery_seconds', 'Duration of a successful delivery attempt per sink', ['sink'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10), registry=MetricsRegistry.registry,
+)
+
+
+class BoundedLabel:
+    """Значения метки с ограниченной кардинальностью: первые limit разных значений — как есть, остальные — 'other'."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        value = value or 'unknown'
+        with self._lock:
+            if value in self._seen:
+                return value
+            if len(self._seen) < self.limit:
+                self._seen.add(value)
+                return value
+        return 'other'
+
+
+host_label = BoundedLabel(METRICS_MAX_HOSTS)
+
+
+def url_host(url):
+    """Метка host для URL (не больше METRICS_MAX_HOSTS разных значений)."""
+    return host_label(urlparse(url).hostname)
+
+
+@contextmanager
+def observe_stage(stage):
+    """Замер этапа конвейера CRL в crl_stage_duration_seconds (контекстный менеджер или декоратор)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        crl_stage_seconds.labels(stage=stage).observe(time.perf_counter() - started)
+
+
+class CRLStateCollector:
+    """
+    Метрики по каждой CRL, вычисляемые при опросе /metrics из состояния монитора в памяти.
+
+    Серии есть только у CRL текущего набора URL, поэтому удаленные CRL и прошлые
+    статусы пропадают из выдачи сами, а цикл проверки не обновляет gauge на
+    каждое событие — он лишь записывает результат группы в словарь.
+    """
+
+    def __init__(self):
+        self._monitor = None
+
+    def attach(self, monitor):
+        self._monitor = monitor
+
+    def describe(self):
+        # Без describe prometheus_client вызвал бы collect при регистрации, до появления монитора
+        return []
+
+    def collect(self):
+        monitor = self._monitor
+        if monitor is None:
+            return
+        # Копии dict/set делаются под GIL целиком — цикл проверки в другом потоке им не мешает
+        state = dict(monitor.state)
+        results = dict(monitor.crl_results)
+        names = monitor.crl_group_names
+        names = sorted(set(names) if names is not None else state)
+        now = time.time()
+
+        next_update = GaugeMetricFamily('crl_next_update_seconds', 'Seconds until CRL nextUpdate (negative when expired)', labels=['crl_name'])
+        this_update = GaugeMetricFamily('crl_this_update_age_seconds', 'Seconds since CRL thisUpdate', labels=['crl_name'])
+        revoked = GaugeMetricFamily('crl_revoked_certificates', 'Revoked certificates in the last processed CRL version', labels=['crl_name'])
+        last_success = GaugeMetricFamily('crl_last_success_age_seconds', 'Seconds since the CRL was last processed successfully', labels=['crl_name'])
+        status = GaugeMetricFamily('crl_status', 'Current CRL processing status (one series per CRL)', labels=['crl_name', 'status'])
+        for name in names:
+            entry = state.get(name) or {}
+            dt = _timestamp(entry.get('next_update'))
+            if dt is not None:
+                next_update.add_metric([name], dt - now)
+            dt = _timestamp(entry.get('this_update'))
+            if dt is not None:
+                this_update.add_metric([name], now - dt)
+            if entry.get('revoked_count') is not None:
+                revoked.add_metric([name], entry['revoked_count'])
+            result, success_at = results.get(name, (None, None))
+            # До первой обработки после рестарта — время последней проверки из сохраненного состояния
+            success_at = success_at or _timestamp(entry.get('last_check'))
+            if success_at is not None:
+                last_success.add_metric([name], now - success_at)
+            status.add_metric([name, result or ('success' if entry else 'unknown')], 1)
+        yield from (next_update, this_update, revoked, last_success, status)
+
+
+def _timestamp(value):
+    dt = parse_datetime_with_tz(value)
+    return dt.timestamp() if dt is not None else None
+
+
+# Регистрируется один раз; монитор CRL подключается через attach()
+crl_state_collector = CRLStateCollector()
+MetricsRegistry.registry.register(crl_state_collector)
@@ -1,14 +1,23 @@
 import threading
 import json
+import logging
 import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest
 
 
+logger = logging.getLogger(__name__)
+
+
 class MetricsRegistry:
     registry = CollectorRegistry()
 
 
+# Сервер метрик процесса: /metrics отдает реестр того процесса, где работают мониторы
+_server = None
+_server_lock = threading.Lock()
+
+
 def check_system_health():
     """Проверяет состояние системы и возвращает информацию о здоровье"""
     issues = []
@@ -94,10 +103,27 @@ class MetricsHandler(BaseHTTPRequestHandler):
         self.end_headers()
 
 
+    def log_message(self, format, *args):
+        pass
+
+
 def start_metrics_server(host: str = '0.0.0.0', port: int = 8000):
-    server = HTTPServer((host, port), MetricsHandler)
-    thread = threading.Thread(target=server.serve_forever, name='MetricsHTTP', daemon=True)
-    thread.start()
-    return server
+    """Запуск HTTP-сервера метрик в фоновом потоке текущего процесса (повторный вызов возвращает тот же сервер)."""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            # Порт занят (например, второй монитор в том же контейнере) — мониторы работают без /metrics
+            logger.error(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+            return None
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name='MetricsHTTP', daemon=True)
+        thread.start()
+        _server = server
+        logger.info(f"Сервер метрик запущен на {host}:{port} (/metrics, /healthz)")
+        return server
 
 
@@ -0,0 +1,116 @@
+# ./notification_dedup.py
+"""
+Индекс дедупликации уведомлений с TTL.
+
+Ключ события — нормализованная идентичность (тип, CRL или УЦ, версия, порог,
+новое значение), а не текст сообщения: время проверки и форматирование не
+влияют на ключ. Повтор события в пределах NOTIFY_DEDUP_TTL_HOURS подавляется
+до постановки в очередь — например, после рестарта или перехода состояния на
+резервный JSON-файл, когда last_alerts и состояние TSL потеряны.
+
+Проверка — O(1) по LRU-кэшу в памяти (NOTIFY_DEDUP_CACHE_SIZE ключей); при
+промахе кэша источником истины служит таблица notification_dedup, и при
+DB_ENABLED запись ключа выполняется в одной транзакции с постановкой в очередь.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from config import DB_ENABLED, NOTIFY_DEDUP_TTL_HOURS, NOTIFY_DEDUP_CACHE_SIZE
+from metrics import notifications_suppressed_total
+
+logger = logging.getLogger(__name__)
+
+MAX_IDENTITY_LENGTH = 200
+
+
+def _normalize_part(value):
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        # Одно и то же время из состояния в БД, JSON-файла и CRL дает один ключ
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return ','.join(sorted(_normalize_part(v) for v in value))
+    return str(value).strip()
+
+
+def event_key(kind, *parts):
+    """Нормализованный ключ события: '<тип>:<части через |>' (длинные части заменяются хешем)."""
+    identity = '|'.join(_normalize_part(part) for part in parts)
+    if len(identity) > MAX_IDENTITY_LENGTH:
+        identity = 'sha256=' + hashlib.sha256(identity.encode('utf-8', 'replace')).hexdigest()[:32]
+    return f"{kind}:{identity}"
+
+
+def event_kind(key):
+    return key.split(':', 1)[0]
+
+
+class DedupIndex:
+    def __init__(self, ttl_seconds=NOTIFY_DEDUP_TTL_HOURS * 3600, capacity=NOTIFY_DEDUP_CACHE_SIZE, persist=DB_ENABLED):
+        self.ttl_seconds = int(ttl_seconds)
+        self.capacity = max(1, capacity)
+        self.persist = persist
+        self._cache = OrderedDict()  # ключ -> время окончания окна (unix)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0
+
+    def is_suppressed(self, key):
+        """O(1): событие уже было в пределах TTL по данным кэша."""
+        now = time.time()
+        with self._lock:
+            expires_at = self._cache.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= now:
+                del self._cache[key]
+                return False
+            self._cache.move_to_end(key)
+            return True
+
+    def remember(self, key, expires_at=None):
+        with self._lock:
+            self._cache[key] = expires_at or time.time() + self.ttl_seconds
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def admit(self, key):
+        """Регистрирует событие. Возвращает False, если оно уже было в пределах TTL."""
+        if self.is_suppressed(key):
+            self.count_suppressed(key)
+            return False
+        admitted, expires_at = True, None
+        if self.persist:
+            try:
+                from db import notification_dedup_admit
+                admitted, expires_at = notification_dedup_admit(key, self.ttl_seconds)
+            except Exception as e:
+                logger.error(f"Ошибка индекса дедупликации уведомлений: {e}")
+        self.remember(key, expires_at)
+        if not admitted:
+            self.count_suppressed(key)
+        return admitted
+
+    def count_suppressed(self, key):
+        notifications_suppressed_total.labels(event=event_kind(key)).inc()
+        logger.info(f"Повтор уведомления подавлен (ключ {key}, окно {self.ttl_seconds // 3600} ч)")
+
+
+# Общий индекс дедупликации для мониторов одного процесса
+notification_dedup = DedupIndex()
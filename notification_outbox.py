@@ -0,0 +1,237 @@
+# ./notification_outbox.py
+"""
+Очередь исходящих уведомлений с приоритетами.
+
+Мониторы не отправляют сообщения сами: TelegramNotifier.send_message ставит
+сообщение в очередь и сразу возвращает управление. Отдельный поток отправки
+забирает сообщения по приоритету (истекшие CRL раньше истекающих, истекающие
+раньше новых версий CRL и изменений TSL), при равном приоритете — в порядке
+постановки. Ожидание Retry-After при 429 блокирует только поток отправки,
+а не проверку CRL.
+
+При DB_ENABLED очередь хранится в таблице notification_outbox: уведомление
+записывается до того, как монитор отметит алерт в last_alerts, поэтому рестарт
+не теряет сообщений. Ключ идемпотентности не дает поставить одно и то же
+уведомление дважды (например, когда после рестарта монитор повторно находит
+тот же алерт). Строка помечается доставленной только после ответа Telegram;
+если процесс упал посреди отправки, сообщение будет отправлено повторно
+(доставка «хотя бы один раз»).
+"""
+import hashlib
+import itertools
+import logging
+import queue
+import threading
+import time
+
+from config import DB_ENABLED, NOTIFY_OUTBOX_BATCH_SIZE, NOTIFY_OUTBOX_MAX_ATTEMPTS
+from metrics import notification_queue_size, notifications_total, notification_queue_delay_seconds
+from notification_dedup import notification_dedup
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CRITICAL = 0  # истекшие CRL
+PRIORITY_HIGH = 1      # истекающие и неопубликованные CRL, ошибки скачивания
+PRIORITY_NORMAL = 2    # новые версии CRL
+PRIORITY_LOW = 3       # изменения TSL, недельная статистика
+
+PRIORITY_NAMES = {
+    PRIORITY_CRITICAL: 'critical',
+    PRIORITY_HIGH: 'high',
+    PRIORITY_NORMAL: 'normal',
+    PRIORITY_LOW: 'low',
+}
+
+# Аренда взятых из БД уведомлений: после падения процесса они снова станут доступны через это время
+CLAIM_LEASE_SECONDS = 600
+POLL_INTERVAL_SECONDS = 5
+
+
+def message_key(message):
+    """Ключ идемпотентности по умолчанию — хеш текста сообщения."""
+    return 'sha256:' + hashlib.sha256(message.encode('utf-8', 'replace')).hexdigest()
+
+
+def retry_delay(attempts):
+    """Бэкофф повторной отправки: 30 с, 60 с, 120 с … не больше часа."""
+    return min(30 * 2 ** max(attempts - 1, 0), 3600)
+
+
+class NotificationOutbox:
+    def __init__(self, persist=DB_ENABLED, batch_size=NOTIFY_OUTBOX_BATCH_SIZE, max_attempts=NOTIFY_OUTBOX_MAX_ATTEMPTS):
+        self.persist = persist
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max(1, max_attempts)
+        # Очередь в памяти — только при отключенной БД
+        self._queue = queue.PriorityQueue()
+        self._queued_keys = set()
+        self._seq = itertools.count()
+        self._deliver = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        # Наивысший приоритет, поставленный в очередь во время отправки пачки
+        self._preempt = None
+
+    def start(self, deliver):
+        """Запуск потока отправки (идемпотентно). deliver(message) отправляет одно сообщение и возвращает True при успехе."""
+        with self._lock:
+            if self._deliver is None:
+                self._deliver = deliver
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="NotificationSender", daemon=True)
+            self._thread.start()
+
+    def put(self, message, priority=PRIORITY_NORMAL, key=None, dedup=False, rearm=False):
+        """
+        Постановка уведомления в очередь. Возвращает False, если уведомление с таким ключом уже поставлено
+        или (dedup=True) событие уже было в пределах TTL индекса дедупликации.
+        rearm=True — событие уже прошло дедупликацию: отправленное ранее уведомление с тем же ключом ставится заново.
+        """
+        key = key or message_key(message)
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        dedup = dedup and notification_dedup.enabled
+        if self.persist:
+            from db import notification_outbox_enqueue
+            # Проверка дедупликации и запись в очередь — одна транзакция: рестарт между ними не теряет и не дублирует событие
+            result, expires_at = notification_outbox_enqueue(key, priority, message, notification_dedup.ttl_seconds if dedup else None, rearm)
+            if dedup:
+                notification_dedup.remember(key, expires_at)
+            if result == 'suppressed':
+                notification_dedup.count_suppressed(key)
+                return False
+            queued = result == 'queued'
+        else:
+            if dedup and not notification_dedup.admit(key):
+                return False
+            with self._lock:
+                queued = key not in self._queued_keys
+                if queued:
+                    self._queued_keys.add(key)
+                    self._queue.put((priority, next(self._seq), time.time(), key, message))
+        if not queued:
+            logger.info(f"Уведомление с ключом {key} уже в очереди, повторно не ставится")
+            notifications_total.labels(priority=name, result='duplicate').inc()
+            return False
+        notifications_total.labels(priority=name, result='queued').inc()
+        with self._lock:
+            if self._preempt is None or priority < self._preempt:
+                self._preempt = priority
+        self._wakeup.set()
+        self._update_size()
+        return True
+
+    def pending(self):
+        """Число неотправленных уведомлений."""
+        if self.persist:
+            from db import notification_outbox_pending
+            return notification_outbox_pending()[1]
+        return self._queue.qsize()
+
+    def _update_size(self):
+        try:
+            notification_queue_size.set(self.pending())
+        except Exception as e:
+            logger.debug(f"Не удалось обновить размер очереди уведомлений: {e}")
+
+    def _send(self, message, priority, enqueued_at):
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        try:
+            delivered = bool(self._deliver(message))
+            error = None if delivered else 'Telegram не принял сообщение'
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления из очереди: {e}")
+            delivered, error = False, str(e)
+        if delivered:
+            waited = max(0.0, time.time() - enqueued_at)
+            notification_queue_delay_seconds.labels(priority=name).observe(waited)
+            if waited > 60:
+                logger.info(f"Уведомление ({name}) отправлено через {waited:.0f} с после постановки в очередь")
+        return delivered, error, name
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                sent_any = self._drain_db() if self.persist else self._drain_memory()
+            except Exception as e:
+                logger.error(f"Ошибка в потоке отправки уведомлений: {e}")
+                sent_any = False
+            if not sent_any:
+                self._wakeup.wait(POLL_INTERVAL_SECONDS)
+                self._wakeup.clear()
+
+    def _drain_db(self):
+        from db import notification_outbox_claim, notification_outbox_mark_sent, notification_outbox_mark_retry, notification_outbox_release
+        with self._lock:
+            self._preempt = None
+        rows = notification_outbox_claim(self.batch_size, CLAIM_LEASE_SECONDS)
+        for index, row in enumerate(rows):
+            delivered, error, name = self._send(row['message'], row['priority'], row['created_ts'])
+            if delivered:
+                notification_outbox_mark_sent(row['id'])
+                notifications_total.labels(priority=name, result='sent').inc()
+            else:
+                give_up = row['attempts'] >= self.max_attempts
+                notification_outbox_mark_retry(row['id'], error, retry_delay(row['attempts']), give_up)
+                notifications_total.labels(priority=name, result='failed' if give_up else 'retry').inc()
+                if give_up:
+                    logger.error(f"Уведомление {row['idempotency_key']} не отправлено после {row['attempts']} попыток")
+            rest = rows[index + 1:]
+            with self._lock:
+                preempt = self._preempt
+            # Более срочное уведомление, поставленное во время отправки пачки, отправляется до остатка пачки
+            if rest and preempt is not None and preempt < rest[0]['priority']:
+                notification_outbox_release([r['id'] for r in rest])
+                break
+            if rest and self._stop.is_set():
+                notification_outbox_release([r['id'] for r in rest])
+                break
+        self._update_size()
+        return bool(rows)
+
+    def _drain_memory(self):
+        try:
+            priority, _, enqueued_at, key, message = self._queue.get_nowait()
+        except queue.Empty:
+            return False
+        try:
+            delivered, _, name = self._send(message, priority, enqueued_at)
+        finally:
+            with self._lock:
+                self._queued_keys.discard(key)
+            self._queue.task_done()
+        notifications_total.labels(priority=name, result='sent' if delivered else 'failed').inc()
+        self._update_size()
+        return True
+
+    def _unfinished(self):
+        if self.persist:
+            from db import notification_outbox_pending
+            return notification_outbox_pending()[0]
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout):
+        """Ожидание отправки уведомлений, готовых к отправке, не дольше timeout секунд. Возвращает True, если таких не осталось."""
+        deadline = time.monotonic() + timeout
+        while self._unfinished():
+            if time.monotonic() >= deadline:
+                return False
+            self._wakeup.set()
+            time.sleep(0.2)
+        return True
+
+    def stop(self, timeout=0):
+        """Остановка потока отправки; перед остановкой до timeout секунд досылаются сообщения очереди."""
+        if self._thread is not None and self._thread.is_alive() and timeout > 0:
+            if not self.flush(timeout):
+                remaining = "сохранены в БД и будут отправлены после запуска" if self.persist else "будут потеряны"
+                logger.warning(f"Очередь уведомлений не отправлена полностью: осталось {self.pending()} сообщений ({remaining})")
+        self._stop.set()
+        self._wakeup.set()
+
+
+# Общая очередь уведомлений мониторов одного процесса
+notification_outbox = NotificationOutbox()
@@ -0,0 +1,271 @@
+# ./notification_sinks.py
+"""
+Каналы уведомлений помимо Telegram: webhook, JSONL-файл (для SIEM), stdout.
+
+TelegramNotifier формирует событие один раз (текст, приоритет, ключ события,
+строка сводки) и передает один и тот же неизменяемый объект NotificationEvent
+всем каналам из NOTIFY_SINKS; JSON события сериализуется тоже один раз.
+У каждого канала своя ограниченная очередь в памяти, свои потоки отправки и
+своя политика повторов: медленный или недоступный webhook копит очередь у себя
+и не задерживает ни Telegram, ни мониторы. При переполнении очереди канала
+новые события этого канала отбрасываются (метрика dropped).
+
+Telegram в этот список не входит: его очередь — notification_outbox
+(приоритеты, хранение в БД, ограничение частоты).
+"""
+import abc
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from config import (
+    VERIFY_TLS, NOTIFY_SINKS, NOTIFY_SINK_QUEUE_SIZE, NOTIFY_WEBHOOK_URL, NOTIFY_WEBHOOK_TIMEOUT,
+    NOTIFY_WEBHOOK_WORKERS, NOTIFY_WEBHOOK_MAX_ATTEMPTS, NOTIFY_JSONL_FILE, NOTIFY_SHUTDOWN_FLUSH_SECONDS,
+)
+from metrics import notification_sink_queue_size, notification_sink_events_total, notification_sink_delivery_seconds
+from notification_dedup import event_kind
+from notification_outbox import PRIORITY_NAMES, notification_outbox
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationEvent:
+    """Событие, сформированное один раз и общее для всех каналов (только для чтения)."""
+
+    __slots__ = ('key', 'kind', 'priority', 'text', 'title', 'summary', 'created_at', 'json')
+
+    def __init__(self, text, priority, key=None, title=None, summary=None):
+        self.key = key
+        self.kind = event_kind(key) if key else 'message'
+        self.priority = PRIORITY_NAMES.get(priority, str(priority))
+        self.text = text
+        self.title = title
+        self.summary = summary
+        self.created_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        self.json = json.dumps(self.as_dict(), ensure_ascii=False)
+
+    def as_dict(self):
+        return {
+            'key': self.key,
+            'event': self.kind,
+            'priority': self.priority,
+            'created_at': self.created_at,
+            'title': self.title,
+            'summary': self.summary,
+            'text': self.text,
+        }
+
+
+class NotificationSink(abc.ABC):
+    """Канал уведомлений: своя очередь, workers потоков отправки и max_attempts попыток на событие."""
+
+    name = 'sink'
+
+    def __init__(self, workers=1, max_attempts=3, queue_size=NOTIFY_SINK_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @abc.abstractmethod
+    def deliver(self, event):
+        """Одна попытка доставки; исключение — неудачная попытка."""
+
+    def retry_delay(self, attempt):
+        return min(2 ** (attempt - 1), 60)
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return
+            self._stop.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._loop, name=f"NotificationSink-{self.name}-{index + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            notification_sink_events_total.labels(sink=self.name, result='dropped').inc()
+            logger.error(f"Очередь канала уведомлений {self.name} переполнена, событие {event.key or event.kind} отброшено")
+            return False
+        notification_sink_events_total.labels(sink=self.name, result='queued').inc()
+        notification_sink_queue_size.labels(sink=self.name).set(self._queue.qsize())
+        return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                event = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self._deliver_with_retries(event)
+            finally:
+                self._queue.task_done()
+                notification_sink_queue_size.labels(sink=self.name).set(self._queue.qsize())
+
+    def _deliver_with_retries(self, event):
+        for attempt in range(1, self.max_attempts + 1):
+            started = time.monotonic()
+            try:
+                self.deliver(event)
+            except Exception as e:
+                if attempt >= self.max_attempts:
+                    notification_sink_events_total.labels(sink=self.name, result='failed').inc()
+                    logger.error(f"Канал {self.name}: событие {event.key or event.kind} не доставлено после {attempt} попыток: {e}")
+                    return
+                notification_sink_events_total.labels(sink=self.name, result='retry').inc()
+                logger.warning(f"Канал {self.name}: ошибка доставки (попытка {attempt}/{self.max_attempts}): {e}")
+                if self._stop.wait(self.retry_delay(attempt)):
+                    notification_sink_events_total.labels(sink=self.name, result='failed').inc()
+                    return
+                continue
+            notification_sink_delivery_seconds.labels(sink=self.name).observe(time.monotonic() - started)
+            notification_sink_events_total.labels(sink=self.name, result='delivered').inc()
+            return
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout):
+        """Ожидание доставки событий очереди не дольше timeout секунд. Возвращает True, если очередь пуста."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+
+class WebhookSink(NotificationSink):
+    """POST JSON события на NOTIFY_WEBHOOK_URL (Idempotency-Key — ключ события)."""
+
+    name = 'webhook'
+
+    def __init__(self, url, timeout=NOTIFY_WEBHOOK_TIMEOUT, workers=NOTIFY_WEBHOOK_WORKERS,
+                 max_attempts=NOTIFY_WEBHOOK_MAX_ATTEMPTS, queue_size=NOTIFY_SINK_QUEUE_SIZE):
+        super().__init__(workers=workers, max_attempts=max_attempts, queue_size=queue_size)
+        self.url = url
+        self.timeout = timeout
+        # Сессия на поток отправки: keep-alive соединения без общей блокировки
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def retry_delay(self, attempt):
+        return min(5 * 2 ** (attempt - 1), 300)
+
+    def deliver(self, event):
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        if event.key:
+            headers['Idempotency-Key'] = event.key
+        response = self._session().post(self.url, data=event.json.encode('utf-8'), headers=headers, timeout=self.timeout, verify=VERIFY_TLS)
+        response.raise_for_status()
+
+
+class FileSink(NotificationSink):
+    """Дописывает событие строкой JSON в NOTIFY_JSONL_FILE (один поток — строки не перемешиваются)."""
+
+    name = 'file'
+
+    def __init__(self, path=NOTIFY_JSONL_FILE, max_attempts=3, queue_size=NOTIFY_SINK_QUEUE_SIZE):
+        super().__init__(workers=1, max_attempts=max_attempts, queue_size=queue_size)
+        self.path = path
+
+    def deliver(self, event):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(event.json + '\n')
+
+
+class StdoutSink(NotificationSink):
+    """Событие строкой JSON в stdout (для сборщиков логов контейнера)."""
+
+    name = 'stdout'
+
+    def __init__(self, queue_size=NOTIFY_SINK_QUEUE_SIZE):
+        super().__init__(workers=1, max_attempts=1, queue_size=queue_size)
+
+    def deliver(self, event):
+        sys.stdout.write(event.json + '\n')
+        sys.stdout.flush()
+
+
+def build_sinks(names=NOTIFY_SINKS):
+    """Каналы из NOTIFY_SINKS, кроме telegram."""
+    sinks = []
+    for name in names:
+        if name == 'telegram':
+            continue
+        if name == 'webhook':
+            if not NOTIFY_WEBHOOK_URL:
+                logger.warning("В NOTIFY_SINKS указан webhook, но NOTIFY_WEBHOOK_URL не задан — канал отключен")
+                continue
+            sinks.append(WebhookSink(NOTIFY_WEBHOOK_URL))
+        elif name == 'file':
+            sinks.append(FileSink())
+        elif name == 'stdout':
+            sinks.append(StdoutSink())
+        else:
+            logger.warning(f"Неизвестный канал уведомлений в NOTIFY_SINKS: {name}")
+    return sinks
+
+
+class NotificationFanout:
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+
+    def publish(self, text, priority, key=None, title=None, summary=None):
+        """Событие формируется один раз и ставится в очередь каждого канала. Возвращает событие или None без каналов."""
+        if not self.sinks:
+            return None
+        event = NotificationEvent(text, priority, key, title, summary)
+        for sink in self.sinks:
+            sink.put(event)
+        return event
+
+    def stop(self, timeout=0):
+        """Остановка каналов; общий срок досылки очередей — timeout секунд."""
+        deadline = time.monotonic() + timeout
+        for sink in self.sinks:
+            if not sink.flush(max(0.0, deadline - time.monotonic())):
+                logger.warning(f"Очередь канала уведомлений {sink.name} не доставлена полностью: осталось {sink.pending()} событий")
+        for sink in self.sinks:
+            sink.stop()
+
+
+# Общие каналы уведомлений для мониторов одного процесса
+notification_sinks = NotificationFanout(build_sinks())
+
+
+def shutdown_notifications(timeout=NOTIFY_SHUTDOWN_FLUSH_SECONDS):
+    """Досылка при остановке процесса (Ctrl-C или SIGTERM): очередь Telegram и очереди каналов — в общий срок timeout секунд."""
+    deadline = time.monotonic() + timeout
+    notification_outbox.stop(timeout)
+    notification_sinks.stop(max(0.0, deadline - time.monotonic()))
@@ -0,0 +1,99 @@
+# ./rate_limiter.py
+"""
+Ограничение частоты запросов к Telegram Bot API (token bucket).
+
+Перед каждым sendMessage берется токен из двух корзин: корзины чата
+(TELEGRAM_CHAT_RATE_PER_MIN в минуту, всплеск до TELEGRAM_CHAT_BURST) и общей
+корзины бота (TELEGRAM_GLOBAL_RATE_PER_SEC в секунду). Если токена нет, поток
+отправки ждет ровно до его появления — сообщения уходят равномерно, а не
+пачкой до ответа 429. Ответ 429 с Retry-After блокирует корзину чата на
+указанное время для всех последующих сообщений.
+
+Ограничитель общий для мониторов одного процесса (все сообщения проходят
+через один поток отправки); при запуске мониторов отдельными процессами
+лимиты действуют в каждом процессе отдельно.
+"""
+import threading
+import time
+
+from config import TELEGRAM_CHAT_RATE_PER_MIN, TELEGRAM_CHAT_BURST, TELEGRAM_GLOBAL_RATE_PER_SEC
+from metrics import telegram_rate_limit_wait_seconds
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec, capacity):
+        self.rate = max(rate_per_sec, 1e-6)
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Сколько секунд ждать до появления целого токена (0 — токен есть)."""
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+
+class TelegramRateLimiter:
+    def __init__(self, chat_rate_per_min=TELEGRAM_CHAT_RATE_PER_MIN, chat_burst=TELEGRAM_CHAT_BURST,
+                 global_rate_per_sec=TELEGRAM_GLOBAL_RATE_PER_SEC):
+        self.chat_rate = chat_rate_per_min / 60.0
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate_per_sec, global_rate_per_sec)
+        self._chats = {}
+        self._lock = threading.Lock()
+
+    def _chat(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def acquire(self, chat_id):
+        """Блокирует поток до появления токенов в корзине чата и общей корзине. Возвращает время ожидания в секундах."""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                chat = self._chat(chat_id)
+                chat.refill(now)
+                self._global.refill(now)
+                wait = max(chat.wait_time(now), self._global.wait_time(now))
+                if wait <= 0:
+                    chat.tokens -= 1
+                    self._global.tokens -= 1
+                    break
+            time.sleep(wait)
+        waited = time.monotonic() - started
+        telegram_rate_limit_wait_seconds.observe(waited)
+        return waited
+
+    def try_acquire(self, chat_id):
+        """Берет токены без ожидания. Возвращает False, если токенов сейчас нет (или чат заблокирован после 429)."""
+        with self._lock:
+            now = time.monotonic()
+            chat = self._chat(chat_id)
+            chat.refill(now)
+            self._global.refill(now)
+            if chat.wait_time(now) > 0 or self._global.wait_time(now) > 0:
+                return False
+            chat.tokens -= 1
+            self._global.tokens -= 1
+            return True
+
+    def penalize(self, chat_id, seconds):
+        """Ответ 429: чат недоступен для отправки seconds секунд."""
+        with self._lock:
+            chat = self._chat(chat_id)
+            chat.blocked_until = max(chat.blocked_until, time.monotonic() + seconds)
+            chat.tokens = min(chat.tokens, 0.0)
+
+
+# Общий ограничитель для всех экземпляров TelegramNotifier процесса
+telegram_rate_limiter = TelegramRateLimiter()
@@ -0,0 +1,185 @@
+# ./retention.py
+"""
+Ретеншн и компактизация данных CRL Checker.
+
+Выполняется в отдельном потоке вне циклов проверки CRL/TSL: удаляет и сворачивает
+старые строки небольшими пачками, ротирует stats/maintained.csv, сбрасывает WAL
+и освобождает место в БД, экспортирует размеры таблиц в метрики.
+"""
+import csv
+import fcntl
+import gzip
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from config import (
+    DATA_DIR, DB_PATH, MOSCOW_TZ,
+    RETENTION_INTERVAL_HOURS, RETENTION_BATCH_SIZE, RETENTION_FULL_VACUUM,
+    TSL_SNAPSHOT_KEEP_VERSIONS, TSL_DIFFS_RETENTION_DAYS,
+    WEEKLY_DETAILS_RETENTION_WEEKS, MAINTAINED_CSV_RETENTION_WEEKS, URL_INVENTORY_RETENTION_DAYS,
+    NOTIFY_OUTBOX_RETENTION_DAYS,
+    CRL_HISTORY_FULL_DAYS, CRL_HISTORY_DAILY_DAYS, CRL_HISTORY_RETENTION_DAYS,
+)
+from db import (
+    tsl_manifest_prune, tsl_blobs_gc, tsl_diffs_prune, weekly_details_rollup,
+    crl_versions_compact, url_inventory_deltas_prune, notification_outbox_prune, notification_dedup_prune, db_table_sizes, db_checkpoint_and_vacuum,
+)
+from http_download import cleanup_stale_partials
+from metrics import db_table_rows, db_file_size_bytes, retention_deleted_rows, retention_last_run_seconds
+from utils import get_current_time_msk
+
+logger = logging.getLogger(__name__)
+
+MAINTAINED_CSV = os.path.join(DATA_DIR, 'stats', 'maintained.csv')
+MAINTAINED_ARCHIVE = os.path.join(DATA_DIR, 'stats', 'maintained_archive.csv.gz')
+# Межпроцессная блокировка: при отдельных процессах CRL и TSL Monitor ретеншн выполняет один из них
+RETENTION_LOCK_FILE = os.path.join(DATA_DIR, 'retention.lock')
+
+
+def week_start_cutoff(weeks):
+    """Начало недели (понедельник 00:00 МСК) weeks недель назад в формате week_start из weekly_details."""
+    now = get_current_time_msk()
+    start = (now - timedelta(days=now.weekday(), weeks=weeks)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return start.astimezone(MOSCOW_TZ).isoformat()
+
+
+class RetentionEngine:
+    def __init__(self, batch_size=RETENTION_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._full_vacuum_pending = RETENTION_FULL_VACUUM
+
+    def _step(self, table, func, *args):
+        """Выполняет шаг ретеншна, учитывает удаленные строки в метриках; ошибки шага не прерывают остальные."""
+        try:
+            removed = func(*args)
+            if isinstance(removed, dict):
+                removed = sum(removed.values())
+            removed = int(removed or 0)
+            if removed:
+                retention_deleted_rows.labels(table=table).inc(removed)
+            logger.info(f"Ретеншн {table}: обработано строк {removed}")
+            return removed
+        except Exception as e:
+            logger.error(f"Ошибка ретеншна {table}: {e}")
+            return 0
+
+    def rotate_maintained_csv(self, cutoff):
+        """Переносит строки stats/maintained.csv с week_start < cutoff в gzip-архив. Возвращает число перенесенных строк."""
+        if not os.path.exists(MAINTAINED_CSV):
+            return 0
+        with open(MAINTAINED_CSV, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            rows = list(reader)
+        if not header:
+            return 0
+        old_rows = [r for r in rows if r and r[0] < cutoff]
+        if not old_rows:
+            return 0
+        keep_rows = [r for r in rows if not (r and r[0] < cutoff)]
+        new_archive = not os.path.exists(MAINTAINED_ARCHIVE)
+        # gzip в режиме 'at' дописывает новый member — архив остается валидным gzip-файлом
+        with gzip.open(MAINTAINED_ARCHIVE, 'at', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            if new_archive:
+                w.writerow(header)
+            w.writerows(old_rows)
+        tmp_path = MAINTAINED_CSV + '.tmp'
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(header)
+            w.writerows(keep_rows)
+        os.replace(tmp_path, MAINTAINED_CSV)
+        return len(old_rows)
+
+    def export_sizes(self):
+        """Экспорт размеров таблиц и файлов БД в метрики."""
+        try:
+            for table, rows in db_table_sizes().items():
+                db_table_rows.labels(table=table).set(rows)
+        except Exception as e:
+            logger.error(f"Ошибка получения размеров таблиц БД: {e}")
+        for name, path in (('db', DB_PATH), ('wal', DB_PATH + '-wal'), ('maintained_csv', MAINTAINED_CSV)):
+            try:
+                db_file_size_bytes.labels(file=name).set(os.path.getsize(path) if os.path.exists(path) else 0)
+            except OSError as e:
+                logger.debug(f"Не удалось получить размер файла {path}: {e}")
+
+    def run_once(self):
+        """Один проход ретеншна по всем таблицам; пропускается, если проход уже идет в другом процессе."""
+        with open(RETENTION_LOCK_FILE, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                logger.info("Ретеншн уже выполняется другим процессом, проход пропущен")
+                return False
+            try:
+                self._run()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return True
+
+    def _run(self):
+        started = time.monotonic()
+        logger.info("Запуск ретеншна и компактизации БД")
+        self._step('crl_versions', crl_versions_compact,
+                   CRL_HISTORY_FULL_DAYS, CRL_HISTORY_DAILY_DAYS, CRL_HISTORY_RETENTION_DAYS, self.batch_size)
+        self._step('tsl_ca_manifest', tsl_manifest_prune, TSL_SNAPSHOT_KEEP_VERSIONS, self.batch_size)
+        self._step('tsl_ca_blob', tsl_blobs_gc, self.batch_size)
+        self._step('tsl_diffs', tsl_diffs_prune, TSL_DIFFS_RETENTION_DAYS, self.batch_size)
+        self._step('url_inventory_deltas', url_inventory_deltas_prune, URL_INVENTORY_RETENTION_DAYS, self.batch_size)
+        self._step('notification_outbox', notification_outbox_prune, NOTIFY_OUTBOX_RETENTION_DAYS, self.batch_size)
+        self._step('notification_dedup', notification_dedup_prune, self.batch_size)
+        self._step('weekly_details', weekly_details_rollup, week_start_cutoff(WEEKLY_DETAILS_RETENTION_WEEKS), self.batch_size)
+        self._step('maintained_csv', self.rotate_maintained_csv, week_start_cutoff(MAINTAINED_CSV_RETENTION_WEEKS))
+        self._step('partial_downloads', cleanup_stale_partials)
+        try:
+            result = db_checkpoint_and_vacuum(full_vacuum=self._full_vacuum_pending)
+            self._full_vacuum_pending = False
+            if result['auto_vacuum'] != 2:
+                logger.info("БД не в режиме auto_vacuum=INCREMENTAL; для перевода включите RETENTION_FULL_VACUUM=true")
+            logger.info(f"WAL checkpoint выполнен, освобождено страниц: {result['freed_pages']}")
+        except Exception as e:
+            logger.error(f"Ошибка checkpoint/vacuum БД: {e}")
+        self.export_sizes()
+        duration = time.monotonic() - started
+        retention_last_run_seconds.set(duration)
+        logger.info(f"Ретеншн завершен за {duration:.1f} с")
+
+
+# Поток ретеншна процесса: run_all_monitors и отдельно запущенные мониторы стартуют его одинаково
+_stop_event = None
+_start_lock = threading.Lock()
+
+
+def start_retention_thread(engine=None, interval_hours=RETENTION_INTERVAL_HOURS, initial_delay=600):
+    """Запускает ретеншн в фоновом потоке: первый проход через initial_delay секунд, далее раз в interval_hours.
+    Повторный вызов в том же процессе возвращает событие остановки уже запущенного потока."""
+    global _stop_event
+    with _start_lock:
+        if _stop_event is not None:
+            return _stop_event
+        _stop_event = _start(engine or RetentionEngine(), interval_hours, initial_delay)
+        return _stop_event
+
+
+def _start(engine, interval_hours, initial_delay):
+    stop_event = threading.Event()
+
+    def _loop():
+        if stop_event.wait(initial_delay):
+            return
+        while True:
+            try:
+                engine.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка в потоке ретеншна: {e}")
+            if stop_event.wait(max(1, interval_hours) * 3600):
+                return
+
+    thread = threading.Thread(target=_loop, name="RetentionThread", daemon=True)
+    thread.start()
+    return stop_event
@@ -5,6 +5,11 @@ import logging
 from db import init_db
 from crl_monitor import CRLMonitor
 from tsl_monitor import TSLMonitor
+from retention import start_retention_thread
+from notification_sinks import shutdown_notifications
+from metrics_server import start_metrics_server
+from utils import install_sigterm_handler
+from config import RETENTION_ENABLED, METRICS_PORT
 
 def run_crl_monitor():
     monitor = CRLMonitor()
@@ -21,19 +26,30 @@ if __name__ == "__main__":
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
+    # docker stop: SIGTERM как Ctrl-C, чтобы досылка очереди уведомлений выполнялась и в контейнере
+    install_sigterm_handler()
+
     # Инициализация БД перед запуском потоков (идемпотентно)
     try:
         init_db()
     except Exception as e:
         logging.error(f"DB init failed in run_all_monitors: {e}")
 
+    # /metrics в том же процессе, что и мониторы: отдаются их живые счетчики
+    start_metrics_server(port=METRICS_PORT)
+
     # Создаем потоки для каждого монитора
-    crl_thread = threading.Thread(target=run_crl_monitor, name="CRLMonitorThread")
-    tsl_thread = threading.Thread(target=run_tsl_monitor, name="TSLMonitorThread")
+    # daemon: после досылки уведомлений процесс завершается, не дожидаясь бесконечных циклов мониторов
+    crl_thread = threading.Thread(target=run_crl_monitor, name="CRLMonitorThread", daemon=True)
+    tsl_thread = threading.Thread(target=run_tsl_monitor, name="TSLMonitorThread", daemon=True)
     
     # Запускаем потоки
     crl_thread.start()
     tsl_thread.start()
+
+    # Ретеншн и компактизация БД в отдельном фоновом потоке
+    if RETENTION_ENABLED:
+        start_retention_thread()
     
     try:
         # Ждем завершения (на самом деле они работают бесконечно)
@@ -41,6 +57,8 @@ if __name__ == "__main__":
             time.sleep(1)
     except KeyboardInterrupt:
         print("Получен сигнал завершения, ожидание остановки потоков...")
+        # Досылаем уведомления, уже поставленные в очередь
+        shutdown_notifications()
         # В реальном приложении здесь должна быть логика корректной остановки
         # Для простоты просто выходим
         exit(0)
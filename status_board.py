@@ -0,0 +1,152 @@
+# ./status_board.py
+"""
+Табло состояния CRL: одно сообщение в чате вместо потока сообщений.
+
+В конце каждого цикла проверки CRL табло строится из состояния монитора в
+памяти (nextUpdate из состояния, набор CRL цикла, CRL, которые не удалось
+скачать) и сравнивается по хешу с последним отправленным. Если содержимое
+не изменилось, Telegram не вызывается; иначе сообщение редактируется через
+editMessageText — не больше одного вызова API за цикл. Табло создается
+sendMessage при первом запуске (и закрепляется при STATUS_BOARD_PIN), а также
+если сообщение удалили из чата. Идентификатор сообщения и хеш хранятся в
+таблице status_board, поэтому после рестарта редактируется то же сообщение.
+"""
+import hashlib
+import logging
+
+from config import DB_ENABLED, DRY_RUN, ALERT_THRESHOLDS, STATUS_BOARD_PIN, STATUS_BOARD_MAX_ITEMS
+from metrics import status_board_updates_total
+from utils import parse_datetime_with_tz, get_current_time_msk
+from telegram_notifier import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# Ответы editMessageText, после которых табло создается заново
+_MESSAGE_GONE = ('message to edit not found', "message can't be edited")
+
+
+def render_crl_status(state, names, failed, format_datetime, now=None, max_items=STATUS_BOARD_MAX_ITEMS):
+    """Текст табло по состоянию CRL цикла. Без текущего времени: текст меняется, только когда меняется состояние."""
+    now = now or get_current_time_msk()
+    expiring_hours = max(ALERT_THRESHOLDS) if ALERT_THRESHOLDS else 0
+    expired, expiring, unknown = [], [], []
+    healthy = 0
+    for name in names:
+        if name in failed:
+            continue
+        next_update = parse_datetime_with_tz((state.get(name) or {}).get('next_update'))
+        if next_update is None:
+            unknown.append(name)
+            continue
+        left = (next_update - now).total_seconds()
+        if left <= 0:
+            expired.append((next_update, name))
+        elif left <= expiring_hours * 3600:
+            expiring.append((next_update, name))
+        else:
+            healthy += 1
+
+    lines = [
+        "📊 <b>Состояние CRL</b>",
+        f"Всего: <b>{len(names)}</b>",
+        f"✅ В порядке: <b>{healthy}</b>",
+        f"⚠️ Истекают в ближайшие {expiring_hours} ч: <b>{len(expiring)}</b>",
+        f"❌ Истекли: <b>{len(expired)}</b>",
+        f"🚫 Не удалось скачать: <b>{len(failed)}</b>",
+    ]
+    if unknown:
+        lines.append(f"❔ Без nextUpdate: <b>{len(unknown)}</b>")
+
+    def section(title, entries):
+        if not entries:
+            return
+        lines.append("")
+        lines.append(f"<b>{title}</b>")
+        lines.extend(entries[:max_items])
+        if len(entries) > max_items:
+            lines.append(f"… и еще {len(entries) - max_items}")
+
+    section("⚠️ Истекают:", [f"• <code>{name}</code> — до {format_datetime(dt)}" for dt, name in sorted(expiring)])
+    section("❌ Истекли:", [f"• <code>{name}</code> — {format_datetime(dt)}" for dt, name in sorted(expired, reverse=True)])
+    section("🚫 Не удалось скачать:", [f"• <code>{name}</code>" for name in sorted(failed)])
+    return "\n".join(lines)
+
+
+class StatusBoard:
+    def __init__(self, notifier, persist=DB_ENABLED, pin=STATUS_BOARD_PIN):
+        self.notifier = notifier
+        self.persist = persist
+        self.pin = pin
+        self.message_id = None
+        self.content_hash = None
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.persist:
+            try:
+                from db import status_board_get
+                self.message_id, self.content_hash = status_board_get(self.notifier.chat_id)
+            except Exception as e:
+                logger.error(f"Не удалось загрузить табло состояния из БД: {e}")
+
+    def _save(self):
+        if self.persist:
+            try:
+                from db import status_board_set
+                status_board_set(self.notifier.chat_id, self.message_id, self.content_hash)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить табло состояния в БД: {e}")
+
+    def update(self, body):
+        """Обновление табло. Возвращает результат: created / edited / unchanged / skipped / error."""
+        self._load()
+        content_hash = hashlib.sha256(body.encode('utf-8', 'replace')).hexdigest()
+        if content_hash == self.content_hash and self.message_id:
+            status_board_updates_total.labels(result='unchanged').inc()
+            logger.debug("Табло состояния не изменилось, редактирование пропущено")
+            return 'unchanged'
+        if DRY_RUN:
+            logger.info(f"[DRY-RUN] Табло состояния НЕ обновлено в Telegram: {body[:100]}...")
+            return 'unchanged'
+        if not self.notifier.bot_token or not self.notifier.chat_id:
+            logger.warning("Токен бота или ID чата не заданы. Табло состояния не обновлено.")
+            return 'error'
+
+        text = f"{body}\n\n🕐 Обновлено: {self.notifier.format_datetime(get_current_time_msk())}"
+        data = {'chat_id': self.notifier.chat_id, 'text': text[:4096], 'parse_mode': 'HTML'}
+        result = 'edited'
+        # Вызовы без ожидания ограничителя частоты: табло обновляется из потока CRL Monitor, и при исчерпанном
+        # лимите (или блокировке чата после 429) цикл проверки не ждет — табло будет обновлено в следующем цикле
+        description = ''
+        if self.message_id:
+            ok, _, description = self.notifier.call_api('editMessageText', dict(data, message_id=self.message_id), wait=False)
+            if not ok and 'message is not modified' in description:
+                ok = True
+            elif not ok and any(reason in description for reason in _MESSAGE_GONE):
+                logger.info("Сообщение табло состояния удалено из чата, табло будет создано заново")
+                self.message_id = None
+        if not self.message_id:
+            ok, message, description = self.notifier.call_api('sendMessage', data, wait=False)
+            if ok:
+                self.message_id = message['message_id']
+                result = 'created'
+                if self.pin:
+                    self.notifier.call_api('pinChatMessage', {
+                        'chat_id': self.notifier.chat_id, 'message_id': self.message_id, 'disable_notification': True,
+                    }, wait=False)
+        if not ok and description == RATE_LIMITED:
+            status_board_updates_total.labels(result='skipped').inc()
+            logger.info("Лимит запросов Telegram исчерпан, обновление табло состояния отложено до следующего цикла")
+            return 'skipped'
+        if not ok:
+            # Хеш не обновляется: в следующем цикле табло будет отредактировано повторно
+            status_board_updates_total.labels(result='error').inc()
+            return 'error'
+        self.content_hash = content_hash
+        self._save()
+        status_board_updates_total.labels(result=result).inc()
+        logger.info(f"Табло состояния {'создано' if result == 'created' else 'обновлено'} (сообщение {self.message_id})")
+        return result
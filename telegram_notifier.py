@@ -5,16 +5,47 @@ from datetime import datetime, timezone
 import time  # <-- Новый импорт
 import re    # <-- Новый импорт (на всякий случай, если Retry-After будет в body)
 import json
+import hashlib
+import threading
+from contextlib import contextmanager
 from config import *
+from rate_limiter import telegram_rate_limiter
+from metrics import telegram_throttled_total, notification_digest_total, telegram_request_seconds
+from notification_dedup import notification_dedup, event_key
+from notification_sinks import notification_sinks
+from notification_outbox import notification_outbox, PRIORITY_CRITICAL, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 
 logger = logging.getLogger(__name__)
 
+# call_api(wait=False): токена ограничителя частоты нет, запрос не отправлялся
+RATE_LIMITED = 'rate limited'
+
+
+def request_result(response):
+    """Метка result для telegram_request_duration_seconds"""
+    if response is None:
+        return 'error'
+    if response.status_code == 429:
+        return 'throttled'
+    return 'ok' if response.ok else 'error'
+
+
 class TelegramNotifier:
     def __init__(self):
         self.bot_token = TELEGRAM_BOT_TOKEN
         self.chat_id = TELEGRAM_CHAT_ID
         self.max_retries = 3 # Максимальное количество повторных попыток отправки
         self.base_delay = 1  # Базовая задержка в секундах между попытками
+        # Сводка текущего цикла проверки (None — уведомления отправляются по одному)
+        self._digest = None
+        self._digest_depth = 0
+        self._digest_lock = threading.RLock()
+        # Telegram — один из каналов NOTIFY_SINKS; остальные каналы получают те же события
+        self.telegram_enabled = 'telegram' in NOTIFY_SINKS
+        if self.telegram_enabled and NOTIFY_ASYNC and not DRY_RUN:
+            # Поток отправки запускается сразу: после рестарта он досылает уведомления, сохраненные в очереди
+            notification_outbox.start(self.deliver)
+        notification_sinks.start()
 
     def split_message(self, message, max_length=4096):
         """Разбивает длинное сообщение на части для Telegram (лимит 4096 символов)"""
@@ -48,21 +79,122 @@ class TelegramNotifier:
             
         return parts
 
-    def send_message(self, message):
-        """Отправка сообщения в Telegram с обработкой 429"""
-        # Проверяем режим Dry-run
-        if DRY_RUN:
-            logger.info(f"[DRY-RUN] Уведомление НЕ отправлено в Telegram: {message[:100]}...")
+    @contextmanager
+    def digest(self, title):
+        """Сбор уведомлений цикла проверки в сводку; сводка отправляется при выходе из самого внешнего блока"""
+        if not NOTIFY_DIGEST:
+            yield
             return
-            
-        if not self.bot_token or not self.chat_id:
-            logger.warning("Токен бота или ID чата не заданы. Уведомление не отправлено.")
+        with self._digest_lock:
+            if self._digest_depth == 0:
+                self._digest = {'title': title, 'items': []}
+            self._digest_depth += 1
+        try:
+            yield
+        finally:
+            with self._digest_lock:
+                self._digest_depth -= 1
+                collected = None
+                if self._digest_depth == 0:
+                    collected, self._digest = self._digest, None
+            if collected:
+                self.flush_digest(collected)
+
+    def flush_digest(self, collected):
+        """Отправка собранных событий: сводкой или, если событий мало, обычными сообщениями"""
+        items = collected['items']
+        if not items:
             return
-        url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+        if len(items) < NOTIFY_DIGEST_MIN_EVENTS:
+            for message, priority, key, _, _ in items:
+                self._enqueue(message, priority, key, admitted=notification_dedup.enabled)
+            return
+        groups = {}
+        for _, priority, _, group, line in items:
+            entry = groups.setdefault(group, {'priority': priority, 'lines': []})
+            entry['priority'] = min(entry['priority'], priority)
+            entry['lines'].append(line)
+        body_lines = []
+        for group, entry in sorted(groups.items(), key=lambda kv: kv[1]['priority']):
+            body_lines.append(f"\n<b>{group}</b> ({len(entry['lines'])}):")
+            body_lines.extend(f"• {line}" for line in entry['lines'])
+        title = f"📋 <b>{collected['title']}</b>: событий {len(items)}"
+        check_time = self.get_check_time_string()
+        # Части сводки упаковываются до лимита Telegram с запасом на заголовок и номер части
+        chunks = self.split_message("\n".join(body_lines).strip('\n'), max_length=4096 - len(title) - len(check_time) - 32)
+        priority = min(entry['priority'] for entry in groups.values())
+        for index, chunk in enumerate(chunks):
+            part = f" ({index + 1}/{len(chunks)})" if len(chunks) > 1 else ""
+            key = 'digest:' + hashlib.sha256(chunk.encode('utf-8', 'replace')).hexdigest()
+            self._enqueue(f"{title}{part}\n{check_time}\n\n{chunk}", priority, key, admitted=notification_dedup.enabled)
+        notification_digest_total.labels(result='events').inc(len(items))
+        notification_digest_total.labels(result='messages').inc(len(chunks))
+        logger.info(f"Сводка «{collected['title']}»: событий {len(items)}, сообщений {len(chunks)}")
+
+    def ca_label(self, info):
+        """Краткое обозначение АУЦ для строки сводки"""
+        return f"<b>{info.get('name', 'Не указано')}</b> (<code>{info.get('reg_number', '')}</code>)"
+
+    def code_list(self, values, limit=3):
+        """Краткий список значений для строки сводки"""
+        values = list(values or [])
+        text = ", ".join(f"<code>{value}</code>" for value in values[:limit])
+        if len(values) > limit:
+            text += f" и еще {len(values) - limit}"
+        return text or "—"
+
+    def send_message(self, message, priority=PRIORITY_NORMAL, key=None, digest=None):
+        """Отправка события во все каналы уведомлений: в очередь Telegram (или синхронно при NOTIFY_ASYNC=false)
+        и в каналы NOTIFY_SINKS (webhook, файл, stdout).
+        key — нормализованный ключ события (event_key): повтор события в пределах NOTIFY_DEDUP_TTL_HOURS
+        подавляется; он же ключ идемпотентности очереди.
+        digest — (группа, строка) для сводки: внутри блока digest() сообщение приоритета normal/low попадает
+        в сводку цикла Telegram; critical и high сразу ставятся в хранимую очередь."""
         # Убедимся, что message - это строка
         if not isinstance(message, str):
              logger.error(f"Попытка отправить сообщение неверного типа: {type(message)}. Ожидалась строка.")
              return
+        dedup = key is not None and notification_dedup.enabled and not DRY_RUN
+        # O(1)-проверка по кэшу индекса дедупликации до любой другой работы
+        if dedup and notification_dedup.is_suppressed(key):
+            notification_dedup.count_suppressed(key)
+            return
+        title, summary = digest if digest is not None else (None, None)
+        # Сводка живет в памяти до конца цикла, а состояние алертов (last_alerts) сохраняется сразу:
+        # critical/high в сводку не берутся, иначе при падении процесса посреди цикла алерт потерялся бы
+        if digest is not None and priority >= PRIORITY_NORMAL and self.telegram_enabled:
+            with self._digest_lock:
+                if self._digest is not None:
+                    if dedup and not notification_dedup.admit(key):
+                        return
+                    self._digest['items'].append((message, priority, key, title, summary))
+                    # Сводка — только представление для Telegram: остальные каналы получают событие сразу
+                    notification_sinks.publish(message, priority, key, title, summary)
+                    return
+        if self._enqueue(message, priority, key, dedup):
+            notification_sinks.publish(message, priority, key, title, summary)
+
+    def _enqueue(self, message, priority, key=None, dedup=False, admitted=False):
+        """Постановка сообщения в очередь Telegram. Возвращает False, если событие подавлено дедупликацией или уже в очереди.
+        admitted=True — события сводки, уже прошедшие индекс дедупликации при сборе"""
+        if not self.telegram_enabled or DRY_RUN or not self.bot_token or not self.chat_id:
+            if DRY_RUN and self.telegram_enabled:
+                logger.info(f"[DRY-RUN] Уведомление НЕ отправлено в Telegram: {message[:100]}...")
+            elif self.telegram_enabled:
+                logger.warning("Токен бота или ID чата не заданы. Уведомление не отправлено.")
+            # Без Telegram событие все равно регистрируется в индексе дедупликации для остальных каналов
+            return not dedup or notification_dedup.admit(key)
+        if NOTIFY_ASYNC:
+            # Монитор не ждет Telegram: отправка в потоке очереди по приоритету
+            notification_outbox.start(self.deliver)
+            return notification_outbox.put(message, priority, key, dedup=dedup, rearm=admitted)
+        if dedup and not notification_dedup.admit(key):
+            return False
+        self.deliver(message)
+        return True
+
+    def deliver(self, message):
+        """Отправка сообщения в Telegram с обработкой 429. Возвращает True, если отправлены все части"""
         # Убираем или заменяем недопустимые символы UTF-16 суррогатов
         # Telegram API может не принимать их напрямую
         try:
@@ -75,6 +207,7 @@ class TelegramNotifier:
              logger.warning("Обнаружены и заменены проблемные символы UTF в сообщении.")
         # Разбиваем сообщение на части, если оно слишком длинное
         message_parts = self.split_message(message)
+        delivered = True
         
         for part_index, message_part in enumerate(message_parts):
             # Добавляем номер части, если сообщение разбито
@@ -88,11 +221,10 @@ class TelegramNotifier:
             }
             
             # Отправляем каждую часть отдельно
-            self._send_single_message(data, part_index + 1, len(message_parts))
-            
-            # Небольшая задержка между частями, чтобы избежать rate limiting
-            if part_index < len(message_parts) - 1:
-                time.sleep(0.5)
+            # Паузы между частями и сообщениями задает ограничитель частоты (token bucket)
+            if not self._send_single_message(data, part_index + 1, len(message_parts)):
+                delivered = False
+        return delivered
 
     def _send_single_message(self, data, part_number=None, total_parts=None):
         """Отправка одной части сообщения"""
@@ -100,17 +232,26 @@ class TelegramNotifier:
         
         for attempt in range(self.max_retries):
              try:
-                 response = requests.post(url, data=data, timeout=30) # Добавим таймаут
+                 # Ждем токен лимитов Telegram (на чат и на бота), вместо того чтобы получить 429
+                 telegram_rate_limiter.acquire(data['chat_id'])
+                 started = time.perf_counter()
+                 response = None
+                 try:
+                     response = requests.post(url, data=data, timeout=30) # Добавим таймаут
+                 finally:
+                     # Время запроса без ожидания ограничителя частоты
+                     telegram_request_seconds.labels(result=request_result(response)).observe(time.perf_counter() - started)
                  response.raise_for_status() # Вызовет исключение для статусов 4xx и 5xx
                  if part_number and total_parts:
                      logger.info(f"Часть {part_number}/{total_parts} успешно отправлена в Telegram.")
                  else:
                      logger.info("Уведомление успешно отправлено в Telegram.")
-                 return # Успешно отправлено, выходим из функции
+                 return True # Успешно отправлено, выходим из функции
              except requests.exceptions.HTTPError as e:
                  if response.status_code == 429:
                      # Обработка ошибки 429 Too Many Requests
                      logger.warning(f"Получен статус 429 (Too Many Requests) при отправке в Telegram. Попытка {attempt + 1}/{self.max_retries}")
+                     telegram_throttled_total.inc()
                      # Извлекаем время ожидания из заголовка Retry-After
                      retry_after = None
                      if 'Retry-After' in response.headers:
@@ -136,7 +277,8 @@ class TelegramNotifier:
                      # Добавим небольшой запас к времени ожидания
                      wait_time = retry_after + 1
                      logger.warning(f"Ожидание {wait_time} секунд перед повторной попыткой...")
-                     time.sleep(wait_time)
+                     # Блокируем чат в ограничителе: ждать будет и эта попытка, и следующие сообщения
+                     telegram_rate_limiter.penalize(data['chat_id'], wait_time)
                  else:
                      # Другая HTTP ошибка (не 429)
                      logger.error(f"Ошибка отправки сообщения в Telegram (попытка {attempt + 1}/{self.max_retries}): {e}")
@@ -157,6 +299,35 @@ class TelegramNotifier:
                  break # Прерываем цикл повторных попыток
         # Если дошли до этой точки, все попытки исчерпаны
         logger.error(f"Не удалось отправить сообщение в Telegram после {self.max_retries} попыток.")
+        return False
+
+    def call_api(self, method, data, wait=True):
+        """Один вызов метода Bot API через ограничитель частоты. Возвращает (ok, result, description).
+        wait=False — без ожидания токена: если лимит исчерпан, вызов не выполняется (description RATE_LIMITED)"""
+        url = f"https://api.telegram.org/bot{self.bot_token}/{method}"
+        if not wait:
+            if not telegram_rate_limiter.try_acquire(data['chat_id']):
+                return False, None, RATE_LIMITED
+        else:
+            telegram_rate_limiter.acquire(data['chat_id'])
+        started = time.perf_counter()
+        response = None
+        try:
+            response = requests.post(url, data=data, timeout=30)
+            payload = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Ошибка вызова {method} Telegram: {e}")
+            return False, None, str(e)
+        finally:
+            telegram_request_seconds.labels(result=request_result(response)).observe(time.perf_counter() - started)
+        if response.status_code == 429:
+            telegram_throttled_total.inc()
+            retry_after = (payload.get('parameters') or {}).get('retry_after') or self.base_delay
+            telegram_rate_limiter.penalize(data['chat_id'], retry_after + 1)
+        description = payload.get('description', '')
+        if not payload.get('ok'):
+            logger.warning(f"Telegram отклонил {method}: {response.status_code} {description}")
+        return bool(payload.get('ok')), payload.get('result'), description
 
     def get_current_time_msk(self):
         """Получение текущего времени в московском часовом поясе"""
@@ -208,7 +379,7 @@ class TelegramNotifier:
                 return str(dt)
         return "Не указано"
 
-    def send_expiring_crl_alert(self, crl_name, time_left_hours, next_update, crl_url, size_mb=None, ca_name=None, ca_reg_number=None, crl_fingerprint=None, crl_key_identifier=None, crl_number=None):
+    def send_expiring_crl_alert(self, crl_name, time_left_hours, next_update, crl_url, size_mb=None, ca_name=None, ca_reg_number=None, crl_fingerprint=None, crl_key_identifier=None, crl_number=None, threshold=None):
         """Уведомление об истекающем CRL"""
         if not self.check_notification_enabled(NOTIFY_EXPIRING_CRL, "об истекающих CRL"):
             return
@@ -228,7 +399,8 @@ class TelegramNotifier:
             f"📅 Следующее обновление: {self.format_datetime(next_update)}\n"
             f"🕐 Текущее время: {self.format_datetime(now_msk)}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_HIGH, key=event_key('crl_expiring', crl_name, next_update, threshold),
+                          digest=("⚠️ CRL скоро истекают", f"<code>{crl_name}</code> — {ca_name or 'Неизвестный АУЦ'}: осталось <b>{time_left_hours:.1f} ч</b> (до {self.format_datetime(next_update)})"))
 
     def send_expired_crl_alert(self, crl_name, expired_time, crl_url, size_mb=None, ca_name=None, ca_reg_number=None, crl_fingerprint=None, crl_key_identifier=None, crl_number=None):
         """Уведомление об истекшем CRL"""
@@ -249,7 +421,7 @@ class TelegramNotifier:
             f"⏰ Истек: {self.format_datetime(expired_time)}\n"
             f"🕐 Текущее время: {self.format_datetime(now_msk)}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_CRITICAL, key=event_key('crl_expired', crl_name, expired_time))
 
     def send_new_crl_info(self, crl_name, revoked_count, revoked_increase, categories_total, categories_delta, publication_time, crl_number, crl_url, total_revoked, next_update, size_mb=None, ca_name=None, ca_reg_number=None, crl_fingerprint=None, crl_key_identifier=None):
         """Уведомление о новом CRL и приросте отозванных сертификатов"""
@@ -303,7 +475,8 @@ class TelegramNotifier:
                 pass
         if categories_text:
             message += f"📊 По категориям:\n{categories_text}"
-        self.send_message(message)
+        self.send_message(message, PRIORITY_NORMAL, key=event_key('crl_new', crl_name, crl_number, crl_fingerprint),
+                          digest=("🆕 Новые версии CRL", f"<code>{crl_name}</code> — {ca_name or 'Неизвестный АУЦ'}: № <code>{crl_number_formatted}</code>, отозвано {total_revoked} (+{revoked_increase})"))
 
     def send_missed_crl_alert(self, crl_name, expected_update_time, crl_url, ca_name=None, ca_reg_number=None):
         """Уведомление о неопубликованном CRL"""
@@ -319,7 +492,8 @@ class TelegramNotifier:
             f"📅 Ожидалось: {self.format_datetime(expected_update_time)}\n"
             f"🕐 Текущее время: {self.format_datetime(now_msk)}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_HIGH, key=event_key('crl_missed', crl_name, expected_update_time),
+                          digest=("❌ CRL не опубликованы вовремя", f"<code>{crl_name}</code> — {ca_name or 'Неизвестный АУЦ'}: ожидался {self.format_datetime(expected_update_time)}"))
 
     def send_weekly_stats(self, stats):
         """Уведомление о недельной статистике"""
@@ -333,7 +507,7 @@ class TelegramNotifier:
             f"📈 Прирост по категориям:\n{categories_text}\n"
             f"🕐 Отчет сформирован: {self.format_datetime(now_msk)}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW)
 
     # --- Добавленные методы для уведомлений TSL ---
     def send_tsl_new_ca(self, ca_info):
@@ -349,7 +523,8 @@ class TelegramNotifier:
             f"📅 Дата аккредитации: {self.format_datetime(ca_info['effective_date'])}\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_new_ca', ca_info['reg_number'], ca_info.get('tsl_version')),
+                          digest=("🆕 Новые действующие АУЦ", f"{self.ca_label(ca_info)}, аккредитация {self.format_datetime(ca_info['effective_date'])}"))
 
     def send_tsl_date_change(self, ca_info, old_date, new_date):
         """Уведомление об изменении даты аккредитации АУЦ"""
@@ -365,7 +540,8 @@ class TelegramNotifier:
             f"📅 Новая дата: {self.format_datetime(new_date)}\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_date_change', ca_info['reg_number'], ca_info.get('tsl_version'), new_date),
+                          digest=("📆 Изменение даты аккредитации АУЦ", f"{self.ca_label(ca_info)}: {self.format_datetime(old_date)} → {self.format_datetime(new_date)}"))
 
     def send_tsl_crl_change(self, ca_info, new_crls):
         """Уведомление о новых или измененных CRL у действующих АУЦ"""
@@ -384,7 +560,8 @@ class TelegramNotifier:
             f"📄 Новые CRL:\n{crl_list}\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_crl_change', ca_info['reg_number'], ca_info.get('tsl_version'), new_crls),
+                          digest=("🔗 Новые или измененные CRL у действующих АУЦ", f"{self.ca_label(ca_info)}: {self.code_list(new_crls)}"))
 
     def send_tsl_status_change(self, ca_info, reason):
         """Уведомление об изменении статуса АУЦ"""
@@ -399,7 +576,8 @@ class TelegramNotifier:
             f"📝 Причина: {reason}\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_status_change', ca_info['reg_number'], ca_info.get('tsl_version'), reason),
+                          digest=("❌ Изменение статуса АУЦ", f"{self.ca_label(ca_info)}: {reason}"))
 
     def send_tsl_removed_ca(self, ca_info):
         """Уведомление об удаленном АУЦ"""
@@ -415,7 +593,8 @@ class TelegramNotifier:
             f"📝 Причина: {ca_info['reason']}\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_removed_ca', ca_info['reg_number'], ca_info.get('tsl_version')),
+                          digest=("🗑️ АУЦ удалены из списка", f"{self.ca_label(ca_info)}: {ca_info['reason']}"))
 
     def send_tsl_name_change(self, change_info):
         """Уведомление об изменении названия АУЦ"""
@@ -430,7 +609,8 @@ class TelegramNotifier:
             f"📄 Стало: <b>{change_info['new_name']}</b>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_name_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['new_name']),
+                          digest=("📝 Изменение названия АУЦ", f"<code>{change_info['reg_number']}</code>: <b>{change_info['old_name']}</b> → <b>{change_info['new_name']}</b>"))
 
     def send_tsl_ogrn_change(self, change_info):
         """Уведомление об изменении ОГРН АУЦ"""
@@ -446,7 +626,8 @@ class TelegramNotifier:
             f"📄 Стало: <code>{change_info['new_ogrn']}</code>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_ogrn_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['new_ogrn']),
+                          digest=("🏛️ Изменение ОГРН АУЦ", f"{self.ca_label(change_info)}: <code>{change_info['old_ogrn']}</code> → <code>{change_info['new_ogrn']}</code>"))
 
     def send_tsl_crl_added(self, change_info):
         """Уведомление о добавлении новых CRL"""
@@ -486,7 +667,8 @@ class TelegramNotifier:
             f"📋 Новые CRL:\n{crl_list}\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_crl_added', change_info['reg_number'], change_info.get('tsl_version'), change_info['crls']),
+                          digest=("➕ Добавлены CRL", f"{self.ca_label(change_info)}: {self.code_list(change_info['crls'])}"))
 
     def send_tsl_crl_removed(self, change_info):
         """Уведомление об удалении CRL"""
@@ -502,7 +684,8 @@ class TelegramNotifier:
             f"📋 Удаленные CRL:\n{crl_list}\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_crl_removed', change_info['reg_number'], change_info.get('tsl_version'), change_info['crls']),
+                          digest=("➖ Удалены CRL", f"{self.ca_label(change_info)}: {self.code_list(change_info['crls'])}"))
 
     def send_tsl_crl_url_change(self, change_info):
         """Уведомление об изменении адресов CRL"""
@@ -520,7 +703,8 @@ class TelegramNotifier:
             f"📄 Стало:\n{new_urls}\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_crl_url_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['new_urls']),
+                          digest=("🔄 Изменены адреса CRL", f"{self.ca_label(change_info)}: {self.code_list(change_info['old_urls'])} → {self.code_list(change_info['new_urls'])}"))
 
     def send_tsl_other_change(self, change_info):
         """Уведомление о других изменениях в TSL"""
@@ -537,7 +721,8 @@ class TelegramNotifier:
             f"📄 Стало: <code>{change_info['new_value']}</code>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_other_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['field'], change_info['new_value']),
+                          digest=("📋 Другие изменения в файле TSL", f"{self.ca_label(change_info)}: {change_info['field']}: <code>{change_info['old_value']}</code> → <code>{change_info['new_value']}</code>"))
 
     def send_tsl_short_name_change(self, change_info):
         """Уведомление об изменении краткого названия АУЦ"""
@@ -553,7 +738,8 @@ class TelegramNotifier:
             f"📄 Стало: <b>{change_info['new_short_name']}</b>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_short_name_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['new_short_name']),
+                          digest=("📝 Изменение краткого названия АУЦ", f"{self.ca_label(change_info)}: <b>{change_info['old_short_name']}</b> → <b>{change_info['new_short_name']}</b>"))
 
     def send_tsl_inn_change(self, change_info):
         """Уведомление об изменении ИНН АУЦ"""
@@ -569,7 +755,8 @@ class TelegramNotifier:
             f"📄 Стало: <code>{change_info['new_inn']}</code>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_inn_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['new_inn']),
+                          digest=("🏛️ Изменение ИНН АУЦ", f"{self.ca_label(change_info)}: <code>{change_info['old_inn']}</code> → <code>{change_info['new_inn']}</code>"))
 
     def send_tsl_email_change(self, change_info):
         """Уведомление об изменении email АУЦ"""
@@ -585,7 +772,8 @@ class TelegramNotifier:
             f"📄 Стало: <code>{change_info['new_email']}</code>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_email_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['new_email']),
+                          digest=("📧 Изменение email АУЦ", f"{self.ca_label(change_info)}: <code>{change_info['old_email']}</code> → <code>{change_info['new_email']}</code>"))
 
     def send_tsl_website_change(self, change_info):
         """Уведомление об изменении веб-сайта АУЦ"""
@@ -601,7 +789,8 @@ class TelegramNotifier:
             f"📄 Стало: <code>{change_info['new_website']}</code>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_website_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['new_website']),
+                          digest=("🌐 Изменение веб-сайта АУЦ", f"{self.ca_label(change_info)}: <code>{change_info['old_website']}</code> → <code>{change_info['new_website']}</code>"))
 
     def send_tsl_registry_url_change(self, change_info):
         """Уведомление об изменении URL реестра сертификатов АУЦ"""
@@ -617,7 +806,8 @@ class TelegramNotifier:
             f"📄 Стало: <code>{change_info['new_registry_url']}</code>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_registry_url_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['new_registry_url']),
+                          digest=("📋 Изменение URL реестра сертификатов АУЦ", f"{self.ca_label(change_info)}: <code>{change_info['old_registry_url']}</code> → <code>{change_info['new_registry_url']}</code>"))
 
     def send_tsl_address_change(self, change_info):
         """Уведомление об изменении адреса АУЦ"""
@@ -633,7 +823,8 @@ class TelegramNotifier:
             f"📄 Стало: <code>{change_info['new_address']}</code>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_LOW, key=event_key('tsl_address_change', change_info['reg_number'], change_info.get('tsl_version'), change_info['new_address']),
+                          digest=("📍 Изменение адреса АУЦ", f"{self.ca_label(change_info)}: <code>{change_info['old_address']}</code> → <code>{change_info['new_address']}</code>"))
 
     def send_crl_download_failed(self, crl_name, tried_urls, last_error, ca_name=None, ca_reg_number=None, crl_number=None, issuer_key_id=None):
         """Отдельное уведомление: не удалось скачать/найти CRL (по итогам всех попыток)"""
@@ -655,4 +846,5 @@ class TelegramNotifier:
             f"🔑 Идентификатор ключа издателя: <code>{issuer_key_id or 'Не указано'}</code>\n"
             f"{self.get_check_time_string()}"
         )
-        self.send_message(message)
+        self.send_message(message, PRIORITY_HIGH, key=event_key('crl_download_failed', crl_name, crl_number),
+                          digest=("❗ Не удалось скачать CRL", f"<code>{crl_name}</code> — {ca_name or 'Неизвестный АУЦ'}: URL {len(tried_urls)}"))
@@ -0,0 +1,207 @@
+# ./tsl_backfill.py
+"""
+Пакетная загрузка архива TSL в tsl_versions, tsl_ca_manifest/tsl_ca_blob и tsl_diffs.
+
+Файлы каталога разбираются параллельно в пуле процессов (каждый процесс
+возвращает только манифест версии и JSON-снимки УЦ). Диффы считаются
+последовательно в порядке версий — так же, как при обычной проверке, но без
+чтения предыдущей версии из БД — и записываются пачками по
+TSL_BACKFILL_BATCH_VERSIONS версий в одной транзакции.
+
+Запуск: python tsl_monitor.py --backfill-dir=/app/data/tsl_archive [--workers=4]
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timezone
+
+from config import TSL_BACKFILL_WORKERS, TSL_BACKFILL_BATCH_VERSIONS
+from db import init_db, tsl_versions_get_all, tsl_ca_manifest_get, tsl_ca_blobs_get, tsl_backfill_write, tsl_snapshot_digest
+from tsl_diff import ca_snapshot, diff_cas, root_diff_rows
+from tsl_parser import stream_tsl, build_tsl_filters, ca_passes_filters
+from utils import parse_tsl_datetime
+
+logger = logging.getLogger(__name__)
+
+TSL_FILE_SUFFIXES = ('.xml', '.xml.gz')
+
+
+def list_tsl_files(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(TSL_FILE_SUFFIXES) and os.path.isfile(os.path.join(directory, name))
+    )
+
+
+def parse_tsl_file(path):
+    """Разбор одного файла архива (выполняется в процессе пула)."""
+    opener = gzip.open if path.lower().endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        data = f.read()
+    meta, cas = stream_tsl(data)
+    ogrn_filters, numeric_filters = build_tsl_filters()
+    manifest = {}
+    blobs = {}
+    for ca in cas:
+        # Те же фильтры и тот же снимок, что и при обычной проверке TSL
+        if not ca['reg_number'] or not ca_passes_filters(ca, ogrn_filters, numeric_filters):
+            continue
+        blob_hash, canonical = tsl_snapshot_digest(ca_snapshot(dict(ca, name=ca['name'] or 'Не указано')))
+        manifest[ca['reg_number']] = blob_hash
+        blobs[blob_hash] = canonical
+    return {
+        'path': path,
+        'version': meta['version'],
+        'date': meta['date'],
+        'root_schema_location': meta['schema_location'],
+        'xml_sha256': hashlib.sha256(data).hexdigest(),
+        'mtime': os.path.getmtime(path),
+        'manifest': manifest,
+        'blobs': blobs,
+    }
+
+
+def _parse_safe(path):
+    try:
+        return parse_tsl_file(path)
+    except Exception as e:
+        return {'path': path, 'error': str(e)}
+
+
+def version_order_key(version, date=None):
+    """Порядок версий: номер версии (числовой), затем дата TSL."""
+    dt = parse_tsl_datetime(date) if date else None
+    number = int(version) if version and version.isdigit() else float('inf')
+    return number, dt.timestamp() if dt else 0.0, version or ''
+
+
+def created_at_for(item):
+    """created_at версии — дата документа TSL (UTC), чтобы исторические версии не стали «последней» версией."""
+    dt = parse_tsl_datetime(item['date']) if item['date'] else None
+    if dt is None:
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(item['mtime']))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class TSLBackfill:
+    def __init__(self, directory, workers=None, batch_versions=TSL_BACKFILL_BATCH_VERSIONS):
+        self.directory = directory
+        self.workers = workers or TSL_BACKFILL_WORKERS or os.cpu_count() or 1
+        self.batch_versions = max(1, batch_versions)
+        self._snapshots = {}
+        self._written_blobs = set()
+
+    def _load_snapshots(self, hashes, blobs):
+        """Снимки УЦ по хешам: из JSON текущего разбора, из кэша или (для базовой версии из БД) из tsl_ca_blob."""
+        missing = [h for h in hashes if h not in self._snapshots and h not in blobs]
+        if missing:
+            self._snapshots.update(tsl_ca_blobs_get(missing))
+        for h in hashes:
+            if h not in self._snapshots and h in blobs:
+                self._snapshots[h] = json.loads(blobs[h])
+        return {h: self._snapshots.get(h, {}) for h in hashes}
+
+    def parse_all(self, paths):
+        started = time.monotonic()
+        parsed = []
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for item in pool.map(_parse_safe, paths, chunksize=1):
+                if 'error' in item:
+                    logger.error(f"Ошибка разбора {item['path']}: {item['error']}")
+                elif not item['version']:
+                    logger.warning(f"В {item['path']} не найдена версия TSL, файл пропущен")
+                else:
+                    parsed.append(item)
+        logger.info(f"Разобрано {len(parsed)} из {len(paths)} файлов TSL за {time.monotonic() - started:.1f} с ({self.workers} процессов)")
+        return parsed
+
+    def run(self):
+        init_db()
+        started = time.monotonic()
+        paths = list_tsl_files(self.directory)
+        if not paths:
+            logger.warning(f"В каталоге {self.directory} нет файлов TSL ({', '.join(TSL_FILE_SUFFIXES)})")
+            return 0
+        parsed = self.parse_all(paths)
+        parsed.sort(key=lambda item: version_order_key(item['version'], item['date']))
+
+        existing = tsl_versions_get_all()
+        # База для первой версии архива — ближайшая более ранняя версия, уже сохраненная в БД
+        prev_version, prev_meta, prev_manifest, prev_blobs = None, {}, {}, {}
+        if parsed:
+            first_key = version_order_key(parsed[0]['version'], parsed[0]['date'])
+            older = [v for v, meta in existing.items() if version_order_key(v, meta.get('date')) < first_key]
+            if older:
+                prev_version = max(older, key=lambda v: version_order_key(v, existing[v].get('date')))
+                prev_meta = existing[prev_version]
+                prev_manifest = tsl_ca_manifest_get(prev_version)
+                logger.info(f"Базовая версия для архива из БД: {prev_version}")
+
+        batch = {'versions': [], 'blobs': {}, 'manifest': [], 'diffs': []}
+        batch_count = 0
+        loaded = skipped = diff_count = 0
+        seen = set()
+        for item in parsed:
+            version = item['version']
+            if version in seen:
+                logger.info(f"Версия {version} повторяется ({item['path']}), файл пропущен")
+                continue
+            seen.add(version)
+            manifest = item['manifest']
+            blobs = item['blobs']
+            if version not in existing:
+                base_manifest, base_blobs = prev_manifest, prev_blobs
+
+                def load_prev(keys):
+                    snapshots = self._load_snapshots([base_manifest[k] for k in keys], base_blobs)
+                    return {k: snapshots[base_manifest[k]] for k in keys}
+
+                changed_hashes = [h for k, h in manifest.items() if base_manifest.get(k) != h]
+                current = self._load_snapshots(changed_hashes, blobs)
+                with_rows = bool(prev_version)
+                diff = diff_cas(
+                    base_manifest, manifest, load_prev,
+                    {k: current[h] for k, h in manifest.items() if h in current},
+                    prev_version if with_rows else None, version if with_rows else None,
+                )
+                if with_rows:
+                    batch['diffs'].extend(root_diff_rows(prev_version, prev_meta, version, item))
+                    batch['diffs'].extend(diff.rows)
+                batch['versions'].append((version, item['date'], item['root_schema_location'], item['xml_sha256'], created_at_for(item)))
+                for blob_hash, canonical in blobs.items():
+                    if blob_hash not in self._written_blobs:
+                        batch['blobs'][blob_hash] = canonical
+                        self._written_blobs.add(blob_hash)
+                batch['manifest'].extend((version, key, blob_hash) for key, blob_hash in manifest.items())
+                batch_count += 1
+                loaded += 1
+            else:
+                # Уже сохраненная версия остается звеном цепочки, но не перезаписывается
+                skipped += 1
+            prev_version, prev_meta, prev_manifest, prev_blobs = version, item, manifest, blobs
+            if batch_count >= self.batch_versions:
+                diff_count += self._flush(batch)
+                batch = {'versions': [], 'blobs': {}, 'manifest': [], 'diffs': []}
+                batch_count = 0
+        if batch_count:
+            diff_count += self._flush(batch)
+
+        logger.info(
+            f"Загрузка архива TSL завершена за {time.monotonic() - started:.1f} с: версий загружено {loaded}, "
+            f"уже были в БД {skipped}, строк tsl_diffs {diff_count}"
+        )
+        return loaded
+
+    def _flush(self, batch):
+        tsl_backfill_write(batch['versions'], batch['blobs'], batch['manifest'], batch['diffs'])
+        logger.info(
+            f"Записана пачка: версий {len(batch['versions'])} ({batch['versions'][0][0]}…{batch['versions'][-1][0]}), "
+            f"новых снимков {len(batch['blobs'])}, строк tsl_diffs {len(batch['diffs'])}"
+        )
+        return len(batch['diffs'])
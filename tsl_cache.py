@@ -0,0 +1,53 @@
+# ./tsl_cache.py
+"""
+Общий кэш разобранного TSL для мониторов одного процесса.
+
+TSL скачивает и разбирает только TSL Monitor (один раз на версию) и публикует
+результат сюда; изменения набора URL CRL передаются подписчикам через канал
+url_events. CRL Monitor к сети за TSL не обращается.
+"""
+import logging
+import threading
+import time
+
+from url_events import crl_url_channel
+
+logger = logging.getLogger(__name__)
+
+
+class ParsedTSL:
+    """Неизменяемый результат разбора одной версии TSL."""
+
+    def __init__(self, version, xml_sha256, active_cas, crl_urls, url_to_ca_map):
+        self.version = version
+        self.xml_sha256 = xml_sha256
+        self.active_cas = active_cas
+        self.crl_urls = frozenset(crl_urls or ())
+        self.url_to_ca_map = url_to_ca_map or {}
+        self.loaded_at = time.time()
+
+
+class TSLCache:
+    def __init__(self):
+        self._current = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Текущая версия разобранного TSL или None, если TSL еще не загружен."""
+        return self._current
+
+    def is_current(self, version, xml_sha256):
+        current = self._current
+        return current is not None and current.version == version and current.xml_sha256 == xml_sha256
+
+    def publish(self, parsed):
+        """Публикация новой версии TSL; изменения набора URL уходят в канал url_events."""
+        with self._lock:
+            self._current = parsed
+        logger.info(f"Кэш TSL обновлен: версия={parsed.version}, УЦ={len(parsed.active_cas)}, URL CRL={len(parsed.crl_urls)}")
+        # Дельта набора URL CRL для подписчиков канала (CRL Monitor)
+        crl_url_channel.publish(parsed.version, parsed.crl_urls, parsed.url_to_ca_map)
+
+
+# Общий экземпляр кэша для мониторов в одном процессе
+tsl_cache = TSLCache()
@@ -0,0 +1,184 @@
+# ./tsl_diff.py
+"""
+Инкрементальный расчет изменений TSL.
+
+Каждый УЦ представлен компактным снимком и хешем его содержимого (тот же хеш,
+что хранится в манифесте версии tsl_ca_manifest). Подробное сравнение полей
+выполняется только для УЦ, у которых хеш изменился; по его результату
+формируются и уведомления, и строки tsl_diffs.
+"""
+import json
+
+from db import tsl_snapshot_digest
+
+# Поля снимка УЦ и пути для tsl_diffs
+CA_FIELD_PATHS = [
+    ('name', '/УдостоверяющийЦентр/Название'),
+    ('effective_date', '/УдостоверяющийЦентр/СтатусАккредитации/ДействуетС'),
+    ('ca_tool', '/УдостоверяющийЦентр/СредстваУЦ'),
+    ('ca_tool_class', '/УдостоверяющийЦентр/КлассСредствЭП'),
+    ('cert_subject', '/УдостоверяющийЦентр/Сертификат/КомуВыдан'),
+    ('cert_issuer', '/УдостоверяющийЦентр/Сертификат/КемВыдан'),
+    ('cert_serial', '/УдостоверяющийЦентр/Сертификат/СерийныйНомер'),
+    ('cert_validity', '/УдостоверяющийЦентр/Сертификат/ПериодДействия'),
+    ('cert_fingerprint', '/УдостоверяющийЦентр/Сертификат/Отпечаток'),
+    ('crl_number', '/УдостоверяющийЦентр/СерийныйНомерCRL'),
+    ('issuer_key_id', '/УдостоверяющийЦентр/ИдентификаторКлючаИздателя'),
+]
+CRL_URLS_PATH = '/УдостоверяющийЦентр/АдресаСписковОтзыва/Адрес/#agg'
+EXISTS_PATH = '/#exists'
+
+# Доп. поля TSL, которые передаются в уведомление о добавленных CRL
+CRL_NOTIFY_EXTRA_FIELDS = (
+    'crl_number', 'issuer_key_id', 'ca_tool', 'ca_tool_class', 'cert_subject',
+    'cert_issuer', 'cert_serial', 'cert_validity', 'cert_fingerprint',
+)
+
+CHANGE_TYPES = (
+    'new_cas', 'removed_cas', 'date_changes', 'crl_changes', 'crl_url_changes',
+    'status_changes', 'name_changes', 'short_name_changes', 'ogrn_changes',
+    'inn_changes', 'email_changes', 'website_changes', 'registry_url_changes',
+    'address_changes', 'pak_changes', 'certificate_changes', 'other_changes',
+)
+
+
+def ca_snapshot(ca):
+    """Компактный снимок УЦ для хранения и сравнения (без служебных полей вроде tsl_version)."""
+    snapshot = {'crl_urls': sorted(ca.get('crl_urls') or [])}
+    for field, _ in CA_FIELD_PATHS:
+        snapshot[field] = ca.get(field)
+    return snapshot
+
+
+def ca_hashes(snapshots):
+    """Хеши содержимого снимков: {key: hash}."""
+    return {key: tsl_snapshot_digest(snapshot)[0] for key, snapshot in snapshots.items()}
+
+
+def changed_keys(prev_hashes, current_hashes):
+    """Ключи УЦ, которые добавлены, удалены или у которых изменился хеш содержимого."""
+    return {
+        key for key in set(prev_hashes) | set(current_hashes)
+        if prev_hashes.get(key) != current_hashes.get(key)
+    }
+
+
+class TSLDiff:
+    """Результат сравнения: уведомления (changes), строки tsl_diffs (rows) и измененные УЦ."""
+
+    def __init__(self, changed):
+        self.changed_keys = changed
+        self.changes = {change_type: [] for change_type in CHANGE_TYPES}
+        self.rows = []
+
+    def has_changes(self):
+        return any(self.changes.values())
+
+
+def diff_cas(prev_hashes, current_hashes, load_prev, current_snapshots, from_version=None, to_version=None):
+    """
+    Сравнение двух наборов УЦ по хешам содержимого.
+
+    load_prev(keys) возвращает {key: снимок} предыдущей версии и вызывается только
+    для измененных и удаленных УЦ. Строки tsl_diffs формируются, если заданы обе версии.
+    """
+    diff = TSLDiff(changed_keys(prev_hashes, current_hashes))
+    if not diff.changed_keys:
+        return diff
+    prev_snapshots = load_prev(sorted(k for k in diff.changed_keys if k in prev_hashes))
+    with_rows = bool(from_version and to_version)
+
+    def _row(key, path, old_val, new_val):
+        if with_rows:
+            diff.rows.append((from_version, to_version, 'ca', key, path, old_val, new_val))
+
+    for key in sorted(diff.changed_keys):
+        before = prev_snapshots.get(key) if key in prev_hashes else None
+        after = current_snapshots.get(key)
+        if before is None and after is not None:
+            diff.changes['new_cas'].append({
+                'reg_number': key,
+                'name': after.get('name'),
+                'effective_date': after.get('effective_date'),
+                'ogrn': after.get('ogrn'),
+                'crl_urls': after.get('crl_urls', []),
+            })
+            _row(key, EXISTS_PATH, None, '1')
+            continue
+        if after is None:
+            before = before or {}
+            diff.changes['removed_cas'].append({
+                'reg_number': key,
+                'name': before.get('name'),
+                'ogrn': before.get('ogrn'),
+                'reason': 'Удален из списка или стал недействующим',
+            })
+            _row(key, EXISTS_PATH, '1', None)
+            continue
+
+        for field, path in CA_FIELD_PATHS:
+            if before.get(field) != after.get(field):
+                _row(key, path, before.get(field), after.get(field))
+        if before.get('name') != after.get('name'):
+            diff.changes['name_changes'].append({
+                'reg_number': key,
+                'old_name': before.get('name'),
+                'new_name': after.get('name'),
+            })
+        if before.get('effective_date') != after.get('effective_date'):
+            diff.changes['date_changes'].append({
+                'reg_number': key,
+                'name': after.get('name'),
+                'old_date': before.get('effective_date'),
+                'new_date': after.get('effective_date'),
+            })
+
+        old_urls = before.get('crl_urls') or []
+        new_urls = after.get('crl_urls') or []
+        if sorted(old_urls) != sorted(new_urls):
+            _row(key, CRL_URLS_PATH, json.dumps(old_urls, ensure_ascii=False), json.dumps(new_urls, ensure_ascii=False))
+            added_crls = sorted(set(new_urls) - set(old_urls))
+            removed_crls = sorted(set(old_urls) - set(new_urls))
+            if added_crls:
+                entry = {
+                    'reg_number': key,
+                    'name': after.get('name'),
+                    'action': 'added',
+                    'crls': added_crls,
+                }
+                # Прокидываем доп. поля из TSL, если есть
+                for field in CRL_NOTIFY_EXTRA_FIELDS:
+                    entry[field] = after.get(field)
+                diff.changes['crl_changes'].append(entry)
+            if removed_crls:
+                diff.changes['crl_changes'].append({
+                    'reg_number': key,
+                    'name': after.get('name'),
+                    'action': 'removed',
+                    'crls': removed_crls,
+                })
+    return diff
+
+
+def root_diff_rows(prev_version, prev_meta, current_version, current_meta):
+    """Строки tsl_diffs корневого уровня: /Версия, /Дата, /@xsi:noNamespaceSchemaLocation."""
+    rows = []
+    for path, old_val, new_val in (
+        ('/Версия', prev_version, current_version),
+        ('/Дата', prev_meta.get('date'), current_meta.get('date')),
+        ('/@xsi:noNamespaceSchemaLocation', prev_meta.get('root_schema_location'), current_meta.get('root_schema_location')),
+    ):
+        if (old_val or new_val) and (old_val != new_val):
+            rows.append((prev_version, current_version, 'root', 'root', path, old_val, new_val))
+    return rows
+
+
+def diff_states(old_state, new_state):
+    """Сравнение двух словарей УЦ (reg_number -> данные) без сохраненных хешей."""
+    old_snapshots = {key: ca_snapshot(ca) for key, ca in (old_state or {}).items()}
+    new_snapshots = {key: ca_snapshot(ca) for key, ca in (new_state or {}).items()}
+    return diff_cas(
+        ca_hashes(old_snapshots), ca_hashes(new_snapshots),
+        lambda keys: {key: old_snapshots[key] for key in keys},
+        new_snapshots,
+    )
@@ -7,17 +7,25 @@ import os
 import logging
 from datetime import datetime, timezone
 import schedule
-import re
 import time
+import hashlib
 from collections import defaultdict
 import html # Для экранирования HTML
 import urllib3
 from config import *
-from db import init_db, bulk_upsert_ca_mapping
-from db import tsl_versions_get_last, tsl_versions_upsert, tsl_ca_snapshots_get, tsl_ca_snapshots_write, tsl_diffs_write
-from metrics import tsl_checks_total, tsl_fetch_status, tsl_active_cas, tsl_crl_urls
-from utils import parse_tsl_datetime, format_datetime_for_message, get_current_time_msk, setup_logging
+from db import init_db, bulk_upsert_ca_mapping, ca_keys_replace
+from db import tsl_versions_get_last, tsl_versions_upsert, tsl_versions_mark_checked, tsl_ca_manifest_get, tsl_ca_blobs_get, tsl_ca_snapshots_write, tsl_diffs_write
+from metrics_server import start_metrics_server
+from retention import start_retention_thread
+from metrics import tsl_checks_total, tsl_fetch_status, tsl_active_cas, tsl_crl_urls, tsl_check_outcome
+from utils import format_datetime_for_message, get_current_time_msk, setup_logging, install_sigterm_handler
 from telegram_notifier import TelegramNotifier
+from notification_sinks import shutdown_notifications
+from ca_registry import ca_registry
+from tsl_parser import stream_tsl, extract_ca_with_keys, build_tsl_filters, ca_passes_filters, build_url_to_ca_map, build_ca_key_rows
+from tsl_cache import tsl_cache, ParsedTSL
+from http_download import fetch_resumable
+from tsl_diff import ca_snapshot, ca_hashes, diff_cas, diff_states, root_diff_rows
 
 # Отключаем предупреждения urllib3 при отключенной проверке TLS
 if not VERIFY_TLS:
@@ -40,6 +48,8 @@ logger = logging.getLogger(__name__)
 TSL_URL = "https://e-trust.gosuslugi.ru/app/scc/portal/api/v1/portal/ca/getxml"
 TSL_STATE_FILE = os.path.join(DATA_DIR, 'tsl_state.json')
 TSL_CRL_URLS_FILE = os.path.join(DATA_DIR, 'crl_urls_from_tsl.txt') # Новый файл
+# Результат условной загрузки: сервер ответил 304 Not Modified
+TSL_NOT_MODIFIED = object()
 # Используем значение из config.py: TSL_CHECK_INTERVAL_HOURS
 
 class TSLMonitor:
@@ -60,6 +70,11 @@ class TSLMonitor:
         self.metric_tsl_fetch_status = tsl_fetch_status
         self.metric_active_cas = tsl_active_cas
         self.metric_crl_urls = tsl_crl_urls
+        self.metric_tsl_check_outcome = tsl_check_outcome
+        # HTTP-валидаторы (ETag, Last-Modified) последнего успешного ответа
+        self.response_validators = (None, None)
+        # Результат последнего сравнения версий TSL (tsl_diff.TSLDiff)
+        self.last_diff = None
 
     def load_state(self):
         """Загрузка состояния из файла"""
@@ -99,28 +114,40 @@ class TSLMonitor:
         except Exception as e:
             logger.error(f"Ошибка сохранения URL CRL: {e}")
 
-    def download_tsl(self):
-        """Скачивание TSL.xml с ретраями и бэкоффом"""
+    def download_tsl(self, last_info=None):
+        """Скачивание TSL.xml с ретраями и бэкоффом.
+
+        Если переданы сведения о последней версии (last_info), запрос условный:
+        при ответе 304 возвращается TSL_NOT_MODIFIED.
+        """
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
-        backoff = 2
+        if last_info:
+            if last_info.get('etag'):
+                headers['If-None-Match'] = last_info['etag']
+            if last_info.get('last_modified'):
+                headers['If-Modified-Since'] = last_info['last_modified']
         tries = 3
-        for attempt in range(1, tries + 1):
-            try:
-                logger.info("Начало загрузки TSL.xml...")
-                response = requests.get(TSL_URL, timeout=60, headers=headers, verify=VERIFY_TLS)
-                response.raise_for_status()
-                logger.info("TSL.xml успешно загружен")
-                self.metric_tsl_fetch_status.labels(result='success').inc()
-                return response.content
-            except Exception as e:
-                logger.error(f"Ошибка загрузки TSL.xml (попытка {attempt}/{tries}): {e}")
-                self.metric_tsl_fetch_status.labels(result='error').inc()
-                if attempt < tries:
-                    time.sleep(backoff)
-                    backoff *= 2
-        return None
+
+        def _on_error(e, attempt):
+            logger.error(f"Ошибка загрузки TSL.xml (попытка {attempt}/{tries}): {e}")
+            self.metric_tsl_fetch_status.labels(result='error').inc()
+
+        logger.info("Начало загрузки TSL.xml...")
+        try:
+            # Оборванная загрузка продолжается со смещения (HTTP Range + If-Range), а не с нулевого байта
+            result = fetch_resumable(TSL_URL, 'tsl', headers=headers, timeout=60, tries=tries, backoff=2, on_error=_on_error)
+        except requests.exceptions.RequestException:
+            return None
+        if result.status_code == 304:
+            logger.info("TSL.xml не изменился (304 Not Modified)")
+            self.metric_tsl_fetch_status.labels(result='not_modified').inc()
+            return TSL_NOT_MODIFIED
+        logger.info("TSL.xml успешно загружен" + (f" (докачан с {result.resumed_from} байт)" if result.resumed_from else ""))
+        self.metric_tsl_fetch_status.labels(result='success').inc()
+        self.response_validators = (result.headers.get('ETag'), result.headers.get('Last-Modified'))
+        return result.content
 
     def load_tsl_from_file(self, path):
         """Загрузка TSL.xml из локального файла (возвращает bytes или None)."""
@@ -147,155 +174,40 @@ class TSLMonitor:
         active_cas = {}
         try:
             raw_bytes = xml_content if isinstance(xml_content, (bytes, bytearray)) else xml_content.encode('utf-8')
-            xml_text = raw_bytes.decode('utf-8', errors='ignore')
-            root = ET.fromstring(xml_text)
-            # Извлекаем версию TSL: сначала как текст в элементах, затем fallback на атрибуты у корня
-            tsl_version = None
-            try:
-                # Поиск текстового значения версии в узлах
-                version_nodes = [
-                    root.find('.//версия'),
-                    root.find('.//Версия'),
-                    root.find('.//ВЕРСИЯ'),
-                ]
-                for node in version_nodes:
-                    if node is not None and node.text and node.text.strip():
-                        tsl_version = node.text.strip()
-                        break
-                # Fallback: берем атрибуты корневого элемента, если текст не найден
-                if not tsl_version:
-                    tsl_version = (
-                        root.attrib.get('Версия') or
-                        root.attrib.get('версия') or
-                        root.attrib.get('Version') or
-                        root.attrib.get('version')
-                    )
-            except Exception:
-                tsl_version = None
+            # Потоковый разбор: в памяти одновременно не более одного элемента УЦ
+            tsl_meta, parsed_cas = stream_tsl(raw_bytes, ca_handler=extract_ca_with_keys)
+            tsl_version = tsl_meta['version']
             self.current_tsl_version = tsl_version
             # Подготовим фильтры: приоритет — по ОГРН, иначе — по префиксам реестровых номеров
-            ogrn_filters = None
-            numeric_filters = None
-            if TSL_OGRN_LIST:
-                ogrn_filters = [re.sub(r'\D', '', n) for n in TSL_OGRN_LIST if n]
-                ogrn_filters = [n for n in ogrn_filters if n]
-            elif TSL_REGISTRY_NUMBERS:
-                numeric_filters = [re.sub(r'\D', '', n) for n in TSL_REGISTRY_NUMBERS if n]
-                numeric_filters = [n for n in numeric_filters if n]
+            ogrn_filters, numeric_filters = build_tsl_filters()
 
+            total_active_seen = len(parsed_cas)
             matched_count = 0
-            total_active_seen = 0
-            for ca_element in root.findall('.//УдостоверяющийЦентр'):
-                status_element = ca_element.find('.//Статус')
-                if status_element is not None and status_element.text == 'Действует':
-                    total_active_seen += 1
-                    reg_number_element = ca_element.find('.//РеестровыйНомер')
-                    name_element = ca_element.find('.//Название')
-                    # Фильтр по ОГРН (строгое совпадение цифр) имеет приоритет
-                    if ogrn_filters is not None:
-                        ogrn_element = ca_element.find('.//ОГРН')
-                        ogrn_val = ogrn_element.text.strip() if (ogrn_element is not None and ogrn_element.text) else None
-                        if not ogrn_val:
-                            continue
-                        ogrn_digits = re.sub(r'\D', '', ogrn_val)
-                        if ogrn_digits not in ogrn_filters:
-                            continue
-                        else:
-                            matched_count += 1
-                    # Иначе — фильтр по реестровым номерам (по префиксу цифр)
-                    elif numeric_filters is not None:
-                        reg_val = reg_number_element.text.strip() if (reg_number_element is not None and reg_number_element.text) else None
-                        if not reg_val:
-                            continue
-                        reg_digits = re.sub(r'\D', '', reg_val)
-                        if not any(reg_digits.startswith(flt) for flt in numeric_filters):
-                            continue
-                        else:
-                            matched_count += 1
-                    effective_date_iso = None
-                    history_statuses = ca_element.findall('.//ИсторияСтатусовАккредитации/СтатусАккредитации')
-                    for status in reversed(history_statuses):
-                        status_type_elem = status.find('Статус')
-                        if status_type_elem is not None and status_type_elem.text == 'Действует':
-                            date_elem = status.find('ДействуетС')
-                            if date_elem is not None and date_elem.text:
-                                dt_obj = parse_tsl_datetime(date_elem.text)
-                                if dt_obj:
-                                    effective_date_iso = dt_obj.isoformat()
-                                    break
-                    if not effective_date_iso:
-                        main_status = ca_element.find('.//СтатусАккредитации')
-                        if main_status is not None:
-                            status_type_elem = main_status.find('Статус')
-                            date_elem = main_status.find('ДействуетС')
-                            if status_type_elem is not None and status_type_elem.text == 'Действует' and date_elem is not None and date_elem.text:
-                                dt_obj = parse_tsl_datetime(date_elem.text)
-                                if dt_obj:
-                                    effective_date_iso = dt_obj.isoformat()
-                    # Извлечение CRL - основное изменение здесь
-                    ca_crl_urls = set()
-                    for crl_addr in ca_element.findall('.//АдресаСписковОтзыва/Адрес'):
-                        if crl_addr.text:
-                            url = crl_addr.text.strip()
-                            if url: # Проверяем, что URL не пустой
-                                ca_crl_urls.add(url)
-                                all_crl_urls.add(url) # Добавляем в общий набор
-                    if reg_number_element is not None and reg_number_element.text:
-                        reg_number = reg_number_element.text.strip()
-                        # Попытка извлечь дополнительные поля из TSL (если присутствуют)
-                        def _txt(elem, default=None):
-                            return elem.text.strip() if (elem is not None and elem.text) else default
-
-                        # Поля о средстве УЦ (возможные варианты имен тегов в TSL)
-                        ca_tool = (
-                            _txt(ca_element.find('.//СредстваУЦ')) or
-                            _txt(ca_element.find('.//СредствоУЦ')) or
-                            _txt(ca_element.find('.//Средство'))
-                        )
-                        ca_tool_class = (
-                            _txt(ca_element.find('.//КлассСредствЭП')) or
-                            _txt(ca_element.find('.//КлассСредстваУЦ')) or
-                            _txt(ca_element.find('.//КлассСредства')) 
-                        )
-
-                        # Поля сертификата УЦ (наименования тегов в TSL могут отличаться в зависимости от версии)
-                        cert_subject = _txt(ca_element.find('.//Субъект')) or _txt(ca_element.find('.//КомуВыдан'))
-                        cert_issuer = _txt(ca_element.find('.//Издатель')) or _txt(ca_element.find('.//КемВыдан'))
-                        cert_serial = _txt(ca_element.find('.//СерийныйНомер'))
-
-                        # Период действия сертификата: пытаемся собрать строку
-                        valid_from = _txt(ca_element.find('.//ДействителенС')) or _txt(ca_element.find('.//ДействуетС'))
-                        valid_to = _txt(ca_element.find('.//ДействителенПо')) or _txt(ca_element.find('.//ДействуетПо'))
-                        cert_validity = None
-                        if valid_from or valid_to:
-                            if valid_from and valid_to:
-                                cert_validity = f"{valid_from} — {valid_to}"
-                            else:
-                                cert_validity = valid_from or valid_to
-
-                        # Отпечаток сертификата (если публикуется в TSL)
-                        cert_fingerprint = _txt(ca_element.find('.//Отпечаток')) or _txt(ca_element.find('.//ОтпечатокСертификата'))
-
-                        # Номер CRL и идентификатор ключа издателя (если TSL их указывает на уровне УЦ)
-                        crl_number = _txt(ca_element.find('.//СерийныйНомерCRL')) or _txt(ca_element.find('.//НомерCRL'))
-                        issuer_key_id = _txt(ca_element.find('.//ИдентификаторКлючаИздателя')) or _txt(ca_element.find('.//ИдентификаторКлюча'))
-
-                        active_cas[reg_number] = {
-                            'name': name_element.text.strip() if name_element is not None and name_element.text else 'Не указано',
-                            'effective_date': effective_date_iso,
-                            'crl_urls': list(ca_crl_urls), # Сохраняем CRL для этого УЦ
-                            # Доп. поля из TSL (best-effort)
-                            'tsl_version': tsl_version,
-                            'ca_tool': ca_tool,
-                            'ca_tool_class': ca_tool_class,
-                            'cert_subject': cert_subject,
-                            'cert_issuer': cert_issuer,
-                            'cert_serial': cert_serial,
-                            'cert_validity': cert_validity,
-                            'cert_fingerprint': cert_fingerprint,
-                            'crl_number': crl_number,
-                            'issuer_key_id': issuer_key_id,
-                        }
+            for ca in parsed_cas:
+                if not ca_passes_filters(ca, ogrn_filters, numeric_filters):
+                    continue
+                matched_count += 1
+                all_crl_urls.update(ca['crl_urls'])
+                reg_number = ca['reg_number']
+                if reg_number:
+                    active_cas[reg_number] = {
+                        'name': ca['name'] or 'Не указано',
+                        'effective_date': ca['effective_date'],
+                        'crl_urls': list(ca['crl_urls']), # Сохраняем CRL для этого УЦ
+                        # Доп. поля из TSL (best-effort)
+                        'tsl_version': tsl_version,
+                        'ca_tool': ca['ca_tool'],
+                        'ca_tool_class': ca['ca_tool_class'],
+                        'cert_subject': ca['cert_subject'],
+                        'cert_issuer': ca['cert_issuer'],
+                        'cert_serial': ca['cert_serial'],
+                        'cert_validity': ca['cert_validity'],
+                        'cert_fingerprint': ca['cert_fingerprint'],
+                        'crl_number': ca['crl_number'],
+                        'issuer_key_id': ca['issuer_key_id'],
+                        # Ключи УЦ из вложенных сертификатов (SKI, subject DN)
+                        'ca_keys': ca['ca_keys'],
+                    }
             if ogrn_filters is not None:
                 logger.info(f"Фильтр TSL по ОГРН: {ogrn_filters}")
                 logger.info(f"Всего действующих УЦ в TSL: {total_active_seen}, прошло фильтр: {matched_count}")
@@ -303,108 +215,62 @@ class TSLMonitor:
                 logger.info(f"Фильтр TSL по префиксам реестровых номеров: {numeric_filters}")
                 logger.info(f"Всего действующих УЦ в TSL: {total_active_seen}, прошло фильтр: {matched_count}")
             # Создаем карту URL -> УЦ для передачи в CRL Monitor
-            url_to_ca_map = {}
-            for reg_number, ca_info in active_cas.items():
-                for crl_url in ca_info.get('crl_urls', []):
-                    url_to_ca_map[crl_url] = {
-                        'name': ca_info['name'],
-                        'reg_number': reg_number,
-                        # Дополнительные поля для уведомлений об ошибках скачивания
-                        'crl_number': ca_info.get('crl_number'),
-                        'issuer_key_id': ca_info.get('issuer_key_id'),
-                    }
-            
+            url_to_ca_map = build_url_to_ca_map(active_cas)
+
             logger.info(f"Найдено {len(active_cas)} действующих УЦ")
             logger.info(f"Извлечено {len(all_crl_urls)} уникальных URL CRL из TSL")
 
             # --- Persist TSL version root/meta and CA snapshots + compute diffs ---
+            self.last_diff = None
             try:
-                import hashlib
-                schema_loc = root.attrib.get('{http://www.w3.org/2001/XMLSchema-instance}noNamespaceSchemaLocation')
+                schema_loc = tsl_meta['schema_location']
                 xml_sha256 = hashlib.sha256(raw_bytes).hexdigest()
                 current_version = tsl_version or 'unknown'
-                current_date_node = root.find('.//Дата')
-                current_date = current_date_node.text.strip() if (current_date_node is not None and current_date_node.text) else None
+                current_date = tsl_meta['date']
+                # Previous version must be read before the current one is persisted
+                prev = tsl_versions_get_last()
                 tsl_versions_upsert(current_version, current_date, schema_loc, xml_sha256)
                 logger.info(f"TSL version persisted: version={current_version}, date={current_date}, schema={schema_loc}")
 
-                # Build CA snapshots as compact JSON per CA keyed by reg_number
-                snapshots = {}
-                for reg_number, ca in active_cas.items():
-                    snapshots[reg_number] = {
-                        'name': ca.get('name'),
-                        'effective_date': ca.get('effective_date'),
-                        'crl_urls': sorted(ca.get('crl_urls') or []),
-                        'ca_tool': ca.get('ca_tool'),
-                        'ca_tool_class': ca.get('ca_tool_class'),
-                        'cert_subject': ca.get('cert_subject'),
-                        'cert_issuer': ca.get('cert_issuer'),
-                        'cert_serial': ca.get('cert_serial'),
-                        'cert_validity': ca.get('cert_validity'),
-                        'cert_fingerprint': ca.get('cert_fingerprint'),
-                        'crl_number': ca.get('crl_number'),
-                        'issuer_key_id': ca.get('issuer_key_id'),
-                    }
+                # Baseline: manifest of the last stored version (per-CA content hashes).
+                # Without it (first run, no snapshots yet) fall back to the JSON state file.
+                prev_version = prev[0] if prev else None
+                prev_manifest = tsl_ca_manifest_get(prev_version) if prev else {}
+                if prev_manifest:
 
-                # Load previous version (if any) and compute diffs
-                prev = tsl_versions_get_last()
-                prev_version = None
-                prev_snaps = {}
-                logger.info(f"Previous version from DB: {prev}")
-                if prev and prev[0] != current_version:
-                    prev_version = prev[0]
-                    prev_snaps = tsl_ca_snapshots_get(prev_version)
-                    logger.info(f"Will compute diffs from {prev_version} to {current_version}")
+                    def load_prev(keys):
+                        blobs = tsl_ca_blobs_get(prev_manifest[k] for k in keys)
+                        return {k: blobs.get(prev_manifest[k], {}) for k in keys}
                 else:
-                    logger.info(f"No diffs needed: prev={prev[0] if prev else None}, current={current_version}")
+                    prev_snaps = {k: ca_snapshot(ca) for k, ca in (self.state or {}).items()}
+                    prev_manifest = ca_hashes(prev_snaps)
 
-                # write current snapshots
-                tsl_ca_snapshots_write(current_version, snapshots)
+                    def load_prev(keys):
+                        return {k: prev_snaps[k] for k in keys}
+                logger.info(f"Previous version from DB: {prev_version}")
+
+                # write current snapshots (unchanged CA blobs are stored only once)
+                snapshots = {reg_number: ca_snapshot(ca) for reg_number, ca in active_cas.items()}
+                current_manifest = tsl_ca_snapshots_write(current_version, snapshots)
                 logger.info(f"TSL CA snapshots persisted: version={current_version}, count={len(snapshots)}")
 
+                # Field-level comparison only for CAs whose content hash changed
+                with_rows = bool(prev_version and prev_version != current_version)
+                diff = diff_cas(
+                    prev_manifest, current_manifest, load_prev, snapshots,
+                    prev_version if with_rows else None, current_version if with_rows else None,
+                )
+                self.last_diff = diff
+                logger.info(f"TSL CA changed: {len(diff.changed_keys)} of {len(current_manifest)}")
+
                 diffs = []
-                if prev_version:
+                if with_rows:
                     # Root-level diffs: /Версия, /Дата, /@xsi:noNamespaceSchemaLocation
-                    def _add_root(path, old_val, new_val):
-                        if (old_val or new_val) and (old_val != new_val):
-                            diffs.append((prev_version, current_version, 'root', 'root', path, old_val, new_val))
-                    _add_root('/Версия', prev[0], current_version)
-                    _add_root('/Дата', prev[1].get('date') if isinstance(prev, tuple) else None, current_date)
-                    _add_root('/@xsi:noNamespaceSchemaLocation', prev[1].get('root_schema_location') if isinstance(prev, tuple) else None, schema_loc)
-
-                    # CA-level diffs by reg_number key
-                    all_keys = set(prev_snaps.keys()) | set(snapshots.keys())
-                    for key in sorted(all_keys):
-                        before = prev_snaps.get(key)
-                        after = snapshots.get(key)
-                        if before is None and after is not None:
-                            diffs.append((prev_version, current_version, 'ca', key, '/#exists', None, '1'))
-                        elif before is not None and after is None:
-                            diffs.append((prev_version, current_version, 'ca', key, '/#exists', '1', None))
-                        else:
-                            # field-level diffs
-                            for field, path in [
-                                ('name', '/УдостоверяющийЦентр/Название'),
-                                ('effective_date', '/УдостоверяющийЦентр/СтатусАккредитации/ДействуетС'),
-                                ('ca_tool', '/УдостоверяющийЦентр/СредстваУЦ'),
-                                ('ca_tool_class', '/УдостоверяющийЦентр/КлассСредствЭП'),
-                                ('cert_subject', '/УдостоверяющийЦентр/Сертификат/КомуВыдан'),
-                                ('cert_issuer', '/УдостоверяющийЦентр/Сертификат/КемВыдан'),
-                                ('cert_serial', '/УдостоверяющийЦентр/Сертификат/СерийныйНомер'),
-                                ('cert_validity', '/УдостоверяющийЦентр/Сертификат/ПериодДействия'),
-                                ('cert_fingerprint', '/УдостоверяющийЦентр/Сертификат/Отпечаток'),
-                                ('crl_number', '/УдостоверяющийЦентр/СерийныйНомерCRL'),
-                                ('issuer_key_id', '/УдостоверяющийЦентр/ИдентификаторКлючаИздателя'),
-                            ]:
-                                old_val = before.get(field) if before else None
-                                new_val = after.get(field) if after else None
-                                if old_val != new_val:
-                                    diffs.append((prev_version, current_version, 'ca', key, path, old_val, new_val))
-                            # aggregate CRL URLs
-                            old_urls = before.get('crl_urls') if before else []
-                            new_urls = after.get('crl_urls') if after else []
-                            if sorted(old_urls) != sorted(new_urls):
-                                diffs.append((prev_version, current_version, 'ca', key, '/УдостоверяющийЦентр/АдресаСписковОтзыва/Адрес/#agg', json.dumps(old_urls, ensure_ascii=False), json.dumps(new_urls, ensure_ascii=False)))
+                    diffs.extend(root_diff_rows(
+                        prev_version, prev[1], current_version,
+                        {'date': current_date, 'root_schema_location': schema_loc},
+                    ))
+                    diffs.extend(diff.rows)
 
                 if diffs:
                     tsl_diffs_write(prev_version, current_version, diffs)
@@ -424,187 +290,21 @@ class TSLMonitor:
             return {}, set(), {}
 
     def compare_states(self, old_state, new_state):
-        """Сравнение состояний и формирование отчета об изменениях"""
-        changes = {
-            'new_cas': [],
-            'removed_cas': [],
-            'date_changes': [],
-            'crl_changes': [],
-            'crl_url_changes': [],
-            'status_changes': [],
-            'name_changes': [],
-            'short_name_changes': [],
-            'ogrn_changes': [],
-            'inn_changes': [],
-            'email_changes': [],
-            'website_changes': [],
-            'registry_url_changes': [],
-            'address_changes': [],
-            'pak_changes': [],
-            'certificate_changes': [],
-            'other_changes': []
-        }
-        # Проверяем новые УЦ
-        for reg_num, ca_data in new_state.items():
-            if reg_num not in old_state:
-                changes['new_cas'].append({
-                    'reg_number': reg_num,
-                    'name': ca_data['name'],
-                    'effective_date': ca_data['effective_date'],
-                    'ogrn': ca_data.get('ogrn'),
-                    'crl_urls': ca_data.get('crl_urls', [])
-                })
-            else:
-                old_ca = old_state[reg_num]
-                
-                # Проверяем изменения названия
-                if old_ca.get('name') != ca_data.get('name'):
-                    changes['name_changes'].append({
-                        'reg_number': reg_num,
-                        'old_name': old_ca.get('name'),
-                        'new_name': ca_data.get('name')
-                    })
-                
-                # Проверяем изменения краткого названия
-                if old_ca.get('short_name') != ca_data.get('short_name'):
-                    changes['short_name_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'old_short_name': old_ca.get('short_name'),
-                        'new_short_name': ca_data.get('short_name')
-                    })
-                
-                # Проверяем изменения ОГРН
-                if old_ca.get('ogrn') != ca_data.get('ogrn'):
-                    changes['ogrn_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'old_ogrn': old_ca.get('ogrn'),
-                        'new_ogrn': ca_data.get('ogrn')
-                    })
-                
-                # Проверяем изменения ИНН
-                if old_ca.get('inn') != ca_data.get('inn'):
-                    changes['inn_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'old_inn': old_ca.get('inn'),
-                        'new_inn': ca_data.get('inn')
-                    })
-                
-                # Проверяем изменения email
-                if old_ca.get('email') != ca_data.get('email'):
-                    changes['email_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'old_email': old_ca.get('email'),
-                        'new_email': ca_data.get('email')
-                    })
-                
-                # Проверяем изменения веб-сайта
-                if old_ca.get('website') != ca_data.get('website'):
-                    changes['website_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'old_website': old_ca.get('website'),
-                        'new_website': ca_data.get('website')
-                    })
-                
-                # Проверяем изменения URL реестра
-                if old_ca.get('registry_url') != ca_data.get('registry_url'):
-                    changes['registry_url_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'old_registry_url': old_ca.get('registry_url'),
-                        'new_registry_url': ca_data.get('registry_url')
-                    })
-                
-                # Проверяем изменения адреса
-                if old_ca.get('address') != ca_data.get('address'):
-                    changes['address_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'old_address': old_ca.get('address'),
-                        'new_address': ca_data.get('address')
-                    })
-                
-                # Проверяем изменения даты
-                if old_ca.get('effective_date') != ca_data.get('effective_date'):
-                    changes['date_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'old_date': old_ca.get('effective_date'),
-                        'new_date': ca_data.get('effective_date')
-                    })
-                
-                # Проверяем изменения CRL URL
-                old_crls = set(old_ca.get('crl_urls', []))
-                new_crls = set(ca_data.get('crl_urls', []))
-                
-                added_crls = new_crls - old_crls
-                removed_crls = old_crls - new_crls
-                
-                if added_crls:
-                    changes['crl_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'action': 'added',
-                        'crls': list(added_crls),
-                        # Прокидываем доп. поля из TSL, если есть
-                        'crl_number': ca_data.get('crl_number'),
-                        'issuer_key_id': ca_data.get('issuer_key_id'),
-                        'ca_tool': ca_data.get('ca_tool'),
-                        'ca_tool_class': ca_data.get('ca_tool_class'),
-                        'cert_subject': ca_data.get('cert_subject'),
-                        'cert_issuer': ca_data.get('cert_issuer'),
-                        'cert_serial': ca_data.get('cert_serial'),
-                        'cert_validity': ca_data.get('cert_validity'),
-                        'cert_fingerprint': ca_data.get('cert_fingerprint'),
-                    })
-                
-                if removed_crls:
-                    changes['crl_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'action': 'removed',
-                        'crls': list(removed_crls)
-                    })
-                
-                # Проверяем изменения адресов CRL (если URL изменились)
-                if old_crls != new_crls and not (added_crls or removed_crls):
-                    # Это означает, что URL изменились, но количество осталось тем же
-                    changes['crl_url_changes'].append({
-                        'reg_number': reg_num,
-                        'name': ca_data.get('name'),
-                        'old_urls': list(old_crls),
-                        'new_urls': list(new_crls)
-                    })
-                
-                # Проверяем другие изменения (статус, прочие поля)
-                for field in ['status', 'revocation_date', 'certificate_chain']:
-                    if old_ca.get(field) != ca_data.get(field):
-                        changes['other_changes'].append({
-                            'reg_number': reg_num,
-                            'name': ca_data.get('name'),
-                            'field': field,
-                            'old_value': old_ca.get(field),
-                            'new_value': ca_data.get(field)
-                        })
-        
-        # Проверяем удаленные УЦ
-        for reg_num, ca_data in old_state.items():
-            if reg_num not in new_state:
-                changes['removed_cas'].append({
-                    'reg_number': reg_num,
-                    'name': ca_data.get('name'),
-                    'ogrn': ca_data.get('ogrn'),
-                    'reason': 'Удален из списка или стал недействующим'
-                })
-        
-        return changes
+        """Сравнение состояний и формирование отчета об изменениях (по хешам содержимого УЦ)"""
+        return diff_states(old_state, new_state).changes
 
 
     def send_notifications(self, changes, no_changes=False):
+        """Отправка уведомлений о изменениях: изменения одной версии TSL собираются в сводку"""
+        version = getattr(self, 'current_tsl_version', None)
+        # Версия TSL — в тексте уведомлений и в ключе дедупликации каждого изменения
+        for entries in changes.values():
+            for entry in entries:
+                entry['tsl_version'] = version
+        with self.notifier.digest(f"Изменения TSL, версия {version or 'не указана'}"):
+            self._send_change_notifications(changes, no_changes)
+
+    def _send_change_notifications(self, changes, no_changes=False):
         """Отправка уведомлений о изменениях с экранированием HTML"""
         now_msk = get_current_time_msk()
         if no_changes:
@@ -614,83 +314,91 @@ class TSLMonitor:
         # --- Отправка уведомлений для TSL ---
         if changes['new_cas'] and NOTIFY_NEW_CAS:
             for ca in changes['new_cas']:
-                ca['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_new_ca(ca)
         
         if changes['removed_cas'] and NOTIFY_REMOVED_CAS:
             for ca in changes['removed_cas']:
-                ca['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_removed_ca(ca)
         
         if changes['name_changes'] and NOTIFY_NAME_CHANGES:
             for change in changes['name_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_name_change(change)
         
         if changes['short_name_changes'] and NOTIFY_SHORT_NAME_CHANGES:
             for change in changes['short_name_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_short_name_change(change)
         
         if changes['ogrn_changes'] and NOTIFY_OGRN_CHANGES:
             for change in changes['ogrn_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_ogrn_change(change)
         
         if changes['inn_changes'] and NOTIFY_INN_CHANGES:
             for change in changes['inn_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_inn_change(change)
         
         if changes['email_changes'] and NOTIFY_EMAIL_CHANGES:
             for change in changes['email_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_email_change(change)
         
         if changes['website_changes'] and NOTIFY_WEBSITE_CHANGES:
             for change in changes['website_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_website_change(change)
         
         if changes['registry_url_changes'] and NOTIFY_REGISTRY_URL_CHANGES:
             for change in changes['registry_url_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_registry_url_change(change)
         
         if changes['address_changes'] and NOTIFY_ADDRESS_CHANGES:
             for change in changes['address_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_address_change(change)
         
         if changes['date_changes'] and NOTIFY_DATE_CHANGES:
             for change in changes['date_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_date_change(change, change['old_date'], change['new_date'])
         
         if changes['crl_changes'] and NOTIFY_CRL_CHANGES:
             for change in changes['crl_changes']:
                 if change['action'] == 'added':
-                    change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                     self.notifier.send_tsl_crl_added(change)
                 elif change['action'] == 'removed':
-                    change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                     self.notifier.send_tsl_crl_removed(change)
         
         if changes['crl_url_changes'] and NOTIFY_CRL_CHANGES:
             for change in changes['crl_url_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_crl_url_change(change)
         
         if changes['status_changes'] and NOTIFY_STATUS_CHANGES:
             for change in changes['status_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_status_change(change, change['reason'])
         
         if changes['other_changes'] and NOTIFY_OTHER_CHANGES:
             for change in changes['other_changes']:
-                change['tsl_version'] = getattr(self, 'current_tsl_version', None)
                 self.notifier.send_tsl_other_change(change)
 
+    def mark_unchanged(self, last, reason):
+        """TSL не изменился с последней версии: пропускаем разбор, запись файлов, БД и диффы."""
+        try:
+            etag, last_modified = self.response_validators
+            tsl_versions_mark_checked(last[0], etag, last_modified)
+        except Exception as e:
+            logger.error(f"Ошибка отметки проверки версии TSL: {e}")
+        self.current_tsl_version = last[0]
+        xml_sha256 = last[1].get('xml_sha256')
+        if not tsl_cache.is_current(last[0], xml_sha256):
+            # После рестарта кэш пуст: восстанавливаем его из сохраненного состояния без повторного разбора
+            crl_urls = set()
+            try:
+                with open(TSL_CRL_URLS_FILE, 'r', encoding='utf-8') as f:
+                    crl_urls = {line.strip() for line in f if line.strip()}
+            except Exception as e:
+                logger.error(f"Ошибка чтения {TSL_CRL_URLS_FILE}: {e}")
+            tsl_cache.publish(ParsedTSL(last[0], xml_sha256, self.state, crl_urls, build_url_to_ca_map(self.state)))
+        parsed = tsl_cache.get()
+        self.metric_active_cas.set(len(parsed.active_cas))
+        self.metric_crl_urls.set(len(parsed.crl_urls))
+        self.metric_tsl_check_outcome.labels(outcome='unchanged').inc()
+        logger.info(f"TSL не изменился ({reason}), версия {last[0]}: обработка пропущена")
+
     def run_check(self):
         """Основная проверка TSL"""
         try:
@@ -700,6 +408,14 @@ class TSLMonitor:
             except Exception as e:
                 logger.error(f"Не удалось инициализировать БД: {e}")
             self.metric_tsl_checks_total.inc()
+            self.response_validators = (None, None)
+            # Последняя сохраненная версия: пропуск обработки возможен, только если производные файлы уже есть
+            try:
+                last = tsl_versions_get_last()
+            except Exception as e:
+                logger.error(f"Не удалось получить последнюю версию TSL: {e}")
+                last = None
+            can_skip = bool(last and self.state and os.path.exists(TSL_CRL_URLS_FILE))
             # Если передан локальный файл TSL, используем его, иначе скачиваем
             xml_content = None
             if self.tsl_file:
@@ -709,38 +425,62 @@ class TSLMonitor:
                     candidate = os.path.join(DATA_DIR, candidate)
                 xml_content = self.load_tsl_from_file(candidate)
             if not xml_content:
-                xml_content = self.download_tsl()
+                xml_content = self.download_tsl(last[1] if can_skip else None)
+            if xml_content is TSL_NOT_MODIFIED:
+                self.mark_unchanged(last, "304 Not Modified")
+                return
             if not xml_content:
+                self.metric_tsl_check_outcome.labels(outcome='error').inc()
+                return
+            xml_sha256 = hashlib.sha256(xml_content).hexdigest()
+            if can_skip and xml_sha256 == last[1].get('xml_sha256'):
+                self.mark_unchanged(last, "совпадает SHA-256")
                 return
             current_state, all_crl_urls, url_to_ca_map = self.parse_tsl(xml_content)
             if not current_state:
                 logger.warning("Не удалось извлечь данные об УЦ из TSL")
+                self.metric_tsl_check_outcome.labels(outcome='error').inc()
                 return
+            try:
+                etag, last_modified = self.response_validators
+                tsl_versions_mark_checked(self.current_tsl_version or 'unknown', etag, last_modified)
+            except Exception as e:
+                logger.error(f"Ошибка отметки проверки версии TSL: {e}")
             self.metric_active_cas.set(len(current_state))
             self.metric_crl_urls.set(len(all_crl_urls))
             # Сохраняем все найденные URL CRL и карту URL -> УЦ
             self.save_crl_urls(all_crl_urls, url_to_ca_map)
-            # Также сохраняем в БД (идемпотентно)
+            # Пишем соответствие URL->УЦ в БД (идемпотентно)
             try:
-                init_db()
                 bulk_upsert_ca_mapping(url_to_ca_map)
                 logger.info(f"В БД сохранено соответствий URL->УЦ: {len(url_to_ca_map)}")
             except Exception as e:
                 logger.error(f"Ошибка записи карты URL->УЦ в БД: {e}")
-            # Пишем соответствие URL->УЦ в БД
+            # Индекс ключей УЦ (SKI / subject DN) для привязки CRL к УЦ по AKI
             try:
-                bulk_upsert_ca_mapping(url_to_ca_map)
-                logger.info(f"В БД сохранено соответствий URL->УЦ: {len(url_to_ca_map)}")
+                key_rows = build_ca_key_rows(current_state)
+                ca_keys_replace(self.current_tsl_version or 'unknown', key_rows)
+                logger.info(f"В БД сохранено ключей УЦ: {len(key_rows)}")
             except Exception as e:
-                logger.error(f"Ошибка записи карты URL->УЦ в БД: {e}")
-            changes = self.compare_states(self.state, current_state)
+                logger.error(f"Ошибка записи ключей УЦ в БД: {e}")
+            # Реестр УЦ CRL Monitor (тот же процесс) перечитает карту при следующем цикле
+            ca_registry.invalidate()
+            # Публикуем разобранный TSL для CRL Monitor (без повторной загрузки и разбора)
+            tsl_cache.publish(ParsedTSL(self.current_tsl_version or 'unknown', xml_sha256, current_state, all_crl_urls, url_to_ca_map))
+            # Изменения уже посчитаны при сохранении версии; сравнение с файлом состояния — запасной путь
+            if self.last_diff is not None:
+                changes = self.last_diff.changes
+            else:
+                changes = self.compare_states(self.state, current_state)
             if any(changes.values()):
                 self.send_notifications(changes, no_changes=False)
             else:
                 self.send_notifications(changes, no_changes=True)
             self.save_state(current_state)
+            self.metric_tsl_check_outcome.labels(outcome='changed').inc()
             logger.info("Проверка TSL завершена")
         except Exception as e:
+            self.metric_tsl_check_outcome.labels(outcome='error').inc()
             logger.error(f"Ошибка во время проверки TSL: {e}")
 
     def setup_schedule(self):
@@ -750,18 +490,20 @@ class TSLMonitor:
     def run(self):
         """Запуск монитора TSL"""
         logger.info("Запуск TSL Monitor")
-        self.run_check() # Первая проверка при запуске
-        self.setup_schedule()
-        while True:
-            try:
-                schedule.run_pending()
-                time.sleep(60)
-            except KeyboardInterrupt:
-                logger.info("Получен сигнал завершения для TSL Monitor")
-                break
-            except Exception as e:
-                logger.error(f"Ошибка в основном цикле TSL Monitor: {e}")
-                time.sleep(60)
+        # Сигнал завершения может прийти и во время первой проверки — досылка очередей в одном месте
+        try:
+            self.run_check() # Первая проверка при запуске
+            self.setup_schedule()
+            while True:
+                try:
+                    schedule.run_pending()
+                    time.sleep(60)
+                except Exception as e:
+                    logger.error(f"Ошибка в основном цикле TSL Monitor: {e}")
+                    time.sleep(60)
+        except KeyboardInterrupt:
+            logger.info("Получен сигнал завершения для TSL Monitor")
+            shutdown_notifications()
 
 if __name__ == "__main__":
     # Поддержка аргумента --tsl-file=<path>
@@ -770,6 +512,13 @@ if __name__ == "__main__":
         if arg.startswith('--tsl-file='):
             tsl_file_arg = arg.split('=', 1)[1].strip() or None
             break
+    # Пакетная загрузка архива TSL: --backfill-dir=<каталог> [--workers=N]
+    backfill_dir = next((a.split('=', 1)[1].strip() for a in sys.argv if a.startswith('--backfill-dir=')), None)
+    if backfill_dir:
+        from tsl_backfill import TSLBackfill
+        workers_arg = next((a.split('=', 1)[1].strip() for a in sys.argv if a.startswith('--workers=')), None)
+        TSLBackfill(backfill_dir, workers=int(workers_arg) if workers_arg else None).run()
+        sys.exit(0)
     monitor = TSLMonitor(tsl_file=tsl_file_arg)
     # Проверяем наличие флага --once в аргументах командной строки
     if '--once' in sys.argv:
@@ -780,4 +529,9 @@ if __name__ == "__main__":
         logger.info("Single check finished.")
     else:
         # В противном случае запускаем монитор в стандартном режиме (бесконечный цикл)
+        install_sigterm_handler()
+        start_metrics_server(port=METRICS_PORT)
+        # Без run_all_monitors ретеншн БД запускается здесь
+        if RETENTION_ENABLED:
+            start_retention_thread()
         monitor.run()
\ No newline at end of file
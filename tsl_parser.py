@@ -0,0 +1,293 @@
+# ./tsl_parser.py
+"""
+Потоковый разбор TSL.xml (ET.iterparse).
+
+Каждый элемент УдостоверяющийЦентр обрабатывается по событию end и сразу
+очищается и удаляется из родителя, поэтому в памяти одновременно находится
+не более одного УЦ, а не весь DOM документа. Используется TSL Monitor и
+CRL Monitor.
+"""
+import base64
+import io
+import logging
+import re
+import warnings
+import xml.etree.ElementTree as ET
+
+from cryptography import x509
+
+from config import TSL_OGRN_LIST, TSL_REGISTRY_NUMBERS
+from utils import parse_tsl_datetime
+
+logger = logging.getLogger(__name__)
+
+CA_TAG = 'УдостоверяющийЦентр'
+KEY_TAG = 'Ключ'
+VERSION_TAGS = ('версия', 'Версия', 'ВЕРСИЯ')
+VERSION_ATTRS = ('Версия', 'версия', 'Version', 'version')
+XSI_SCHEMA_LOCATION = '{http://www.w3.org/2001/XMLSchema-instance}noNamespaceSchemaLocation'
+
+
+def _txt(elem, default=None):
+    return elem.text.strip() if (elem is not None and elem.text) else default
+
+
+def build_tsl_filters():
+    """Фильтры TSL: приоритет — по ОГРН, иначе — по префиксам реестровых номеров. Возвращает (ogrn_filters, numeric_filters)."""
+    ogrn_filters = None
+    numeric_filters = None
+    if TSL_OGRN_LIST:
+        ogrn_filters = [re.sub(r'\D', '', n) for n in TSL_OGRN_LIST if n]
+        ogrn_filters = [n for n in ogrn_filters if n]
+    elif TSL_REGISTRY_NUMBERS:
+        numeric_filters = [re.sub(r'\D', '', n) for n in TSL_REGISTRY_NUMBERS if n]
+        numeric_filters = [n for n in numeric_filters if n]
+    return ogrn_filters, numeric_filters
+
+
+def ca_passes_filters(ca, ogrn_filters, numeric_filters):
+    """Проверка УЦ по фильтрам (ОГРН — строгое совпадение цифр, реестровый номер — по префиксу)."""
+    if ogrn_filters is not None:
+        ogrn_digits = re.sub(r'\D', '', ca.get('ogrn') or '')
+        return bool(ogrn_digits) and ogrn_digits in ogrn_filters
+    if numeric_filters is not None:
+        reg_digits = re.sub(r'\D', '', ca.get('reg_number') or '')
+        return bool(reg_digits) and any(reg_digits.startswith(flt) for flt in numeric_filters)
+    return True
+
+
+def build_url_to_ca_map(active_cas):
+    """Карта URL CRL -> УЦ по действующим УЦ (reg_number -> данные)."""
+    url_to_ca_map = {}
+    for reg_number, ca_info in active_cas.items():
+        for crl_url in ca_info.get('crl_urls', []):
+            url_to_ca_map[crl_url] = {
+                'name': ca_info['name'],
+                'reg_number': reg_number,
+                # Дополнительные поля для уведомлений об ошибках скачивания
+                'crl_number': ca_info.get('crl_number'),
+                'issuer_key_id': ca_info.get('issuer_key_id'),
+            }
+    return url_to_ca_map
+
+
+# Теги, которые извлекаются из поддерева УЦ, и родители, для которых нужны прямые потомки
+INDEXED_TAGS = frozenset((
+    'Статус', 'СтатусАккредитации', 'Название', 'РеестровыйНомер', 'ОГРН',
+    'ДействителенС', 'ДействуетС', 'ДействителенПо', 'ДействуетПо',
+    'СредстваУЦ', 'СредствоУЦ', 'Средство', 'КлассСредствЭП', 'КлассСредстваУЦ', 'КлассСредства',
+    'Субъект', 'КомуВыдан', 'Издатель', 'КемВыдан', 'СерийныйНомер',
+    'Отпечаток', 'ОтпечатокСертификата', 'СерийныйНомерCRL', 'НомерCRL',
+    'ИдентификаторКлючаИздателя', 'ИдентификаторКлюча',
+))
+INDEXED_PARENTS = frozenset(('ИсторияСтатусовАккредитации', 'АдресаСписковОтзыва'))
+
+
+class _ElementIndex:
+    """
+    Индекс поддерева УЦ, построенный за один обход в прямом порядке.
+
+    first(tag) эквивалентен element.find('.//tag'), children(parent, tag) —
+    element.findall('.//parent/tag'), но без повторного обхода поддерева
+    (включая крупные base64-блоки сертификатов) на каждый запрос.
+    """
+
+    def __init__(self, root, tags=INDEXED_TAGS, parents=INDEXED_PARENTS):
+        self.first_by_tag = {}
+        self.by_pair = {}
+        elements = root.iter()
+        next(elements)  # сам корень не входит в './/'
+        for elem in elements:
+            tag = elem.tag
+            if tag in tags and tag not in self.first_by_tag:
+                self.first_by_tag[tag] = elem
+            if tag in parents:
+                for child in elem:
+                    self.by_pair.setdefault((tag, child.tag), []).append(child)
+
+    def first(self, tag):
+        return self.first_by_tag.get(tag)
+
+    def text(self, *tags):
+        """Текст первого найденного элемента: по каждому тегу берется первый узел, как в цепочке find(...) or find(...)."""
+        for tag in tags:
+            value = _txt(self.first(tag))
+            if value:
+                return value
+        return None
+
+    def children(self, parent_tag, tag):
+        return self.by_pair.get((parent_tag, tag), [])
+
+
+def extract_ca(ca_element):
+    """Извлечение полей действующего УЦ из элемента УдостоверяющийЦентр. Для недействующих УЦ возвращает None."""
+    index = _ElementIndex(ca_element)
+    status_element = index.first('Статус')
+    if status_element is None or status_element.text != 'Действует':
+        return None
+
+    effective_date_iso = None
+    for status in reversed(index.children('ИсторияСтатусовАккредитации', 'СтатусАккредитации')):
+        status_type_elem = status.find('Статус')
+        if status_type_elem is not None and status_type_elem.text == 'Действует':
+            date_elem = status.find('ДействуетС')
+            if date_elem is not None and date_elem.text:
+                dt_obj = parse_tsl_datetime(date_elem.text)
+                if dt_obj:
+                    effective_date_iso = dt_obj.isoformat()
+                    break
+    if not effective_date_iso:
+        main_status = index.first('СтатусАккредитации')
+        if main_status is not None:
+            status_type_elem = main_status.find('Статус')
+            date_elem = main_status.find('ДействуетС')
+            if status_type_elem is not None and status_type_elem.text == 'Действует' and date_elem is not None and date_elem.text:
+                dt_obj = parse_tsl_datetime(date_elem.text)
+                if dt_obj:
+                    effective_date_iso = dt_obj.isoformat()
+
+    crl_urls = []
+    for crl_addr in index.children('АдресаСписковОтзыва', 'Адрес'):
+        url = _txt(crl_addr)
+        if url and url not in crl_urls:
+            crl_urls.append(url)
+
+    # Период действия сертификата: пытаемся собрать строку
+    valid_from = index.text('ДействителенС', 'ДействуетС')
+    valid_to = index.text('ДействителенПо', 'ДействуетПо')
+    cert_validity = None
+    if valid_from and valid_to:
+        cert_validity = f"{valid_from} — {valid_to}"
+    elif valid_from or valid_to:
+        cert_validity = valid_from or valid_to
+
+    name_element = index.first('Название')
+    return {
+        'reg_number': index.text('РеестровыйНомер'),
+        'name': name_element.text.strip() if name_element is not None and name_element.text else None,
+        'ogrn': index.text('ОГРН'),
+        'effective_date': effective_date_iso,
+        'crl_urls': crl_urls,
+        # Доп. поля из TSL (best-effort, наименования тегов зависят от версии схемы)
+        'ca_tool': index.text('СредстваУЦ', 'СредствоУЦ', 'Средство'),
+        'ca_tool_class': index.text('КлассСредствЭП', 'КлассСредстваУЦ', 'КлассСредства'),
+        'cert_subject': index.text('Субъект', 'КомуВыдан'),
+        'cert_issuer': index.text('Издатель', 'КемВыдан'),
+        'cert_serial': index.text('СерийныйНомер'),
+        'cert_validity': cert_validity,
+        'cert_fingerprint': index.text('Отпечаток', 'ОтпечатокСертификата'),
+        'crl_number': index.text('СерийныйНомерCRL', 'НомерCRL'),
+        'issuer_key_id': index.text('ИдентификаторКлючаИздателя', 'ИдентификаторКлюча'),
+    }
+
+
+def decode_certificate(cert_b64):
+    """Subject Key Identifier (hex) и subject DN (RFC 4514) сертификата в base64 DER. При ошибке — (None, None)."""
+    try:
+        der = base64.b64decode(re.sub(r'\s+', '', cert_b64), validate=True)
+        with warnings.catch_warnings():
+            # Длинные атрибуты в DN российских сертификатов: cryptography предупреждает, но разбирает
+            warnings.simplefilter("ignore", UserWarning)
+            cert = x509.load_der_x509_certificate(der)
+            subject_dn = cert.subject.rfc4514_string()
+    except Exception:
+        return None, None
+    try:
+        ski = cert.extensions.get_extension_for_class(x509.SubjectKeyIdentifier).value.digest.hex().upper()
+    except Exception:
+        ski = None
+    return ski, subject_dn
+
+
+def extract_ca_keys(ca_element):
+    """Ключи УЦ из КлючиУполномоченныхЛиц: SKI и subject DN из вложенных сертификатов (или из текстовых полей)."""
+    keys = []
+    for key_element in ca_element.iter(KEY_TAG):
+        key_id = _txt(key_element.find('ИдентификаторКлюча'))
+        for cert_element in key_element.iter('ДанныеСертификата'):
+            cert_b64 = _txt(cert_element.find('Данные'))
+            ski, subject_dn = decode_certificate(cert_b64) if cert_b64 else (None, None)
+            keys.append({
+                'key_id': ski or key_id,
+                'subject_dn': subject_dn or _txt(cert_element.find('КомуВыдан')),
+                'cert_fingerprint': _txt(cert_element.find('Отпечаток')),
+            })
+        if key_id and not any(k['key_id'] == key_id for k in keys):
+            keys.append({'key_id': key_id, 'subject_dn': None, 'cert_fingerprint': None})
+    return [k for k in keys if k['key_id'] or k['subject_dn']]
+
+
+def extract_ca_with_keys(ca_element):
+    """extract_ca плюс ключи УЦ (ca_keys) для индекса издателей CRL."""
+    ca = extract_ca(ca_element)
+    if ca is not None:
+        ca['ca_keys'] = extract_ca_keys(ca_element)
+    return ca
+
+
+def build_ca_key_rows(active_cas):
+    """Строки индекса ключей: (key_id, reg_number, ca_name, subject_dn, cert_fingerprint)."""
+    rows = []
+    for reg_number, ca_info in active_cas.items():
+        for key in ca_info.get('ca_keys') or []:
+            rows.append((key['key_id'], reg_number, ca_info.get('name'), key['subject_dn'], key['cert_fingerprint']))
+    return rows
+
+
+def _scan(data, ca_handler):
+    """Один потоковый проход по документу. Возвращает (meta, results)."""
+    meta = {'version': None, 'date': None, 'schema_location': None, 'root_attrib': {}}
+    # Первые по порядку документа узлы версии/даты (аналог root.find('.//Тег'))
+    first_nodes = {}
+    results = []
+    stack = []
+    for event, elem in ET.iterparse(io.BytesIO(data), events=('start', 'end')):
+        if event == 'start':
+            if not stack:
+                meta['root_attrib'] = dict(elem.attrib)
+            if (elem.tag in VERSION_TAGS or elem.tag == 'Дата') and elem.tag not in first_nodes:
+                first_nodes[elem.tag] = elem
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag in first_nodes and first_nodes[elem.tag] is elem:
+            first_nodes[elem.tag] = _txt(elem)
+        if elem.tag == CA_TAG:
+            result = ca_handler(elem)
+            if result is not None:
+                results.append(result)
+            # Освобождаем обработанный УЦ: очищаем поддерево и отцепляем от родителя
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+
+    for tag in VERSION_TAGS:
+        value = first_nodes.get(tag)
+        if isinstance(value, str) and value:
+            meta['version'] = value
+            break
+    if not meta['version']:
+        meta['version'] = next((meta['root_attrib'].get(a) for a in VERSION_ATTRS if meta['root_attrib'].get(a)), None)
+    date = first_nodes.get('Дата')
+    meta['date'] = date if isinstance(date, str) else None
+    meta['schema_location'] = meta['root_attrib'].get(XSI_SCHEMA_LOCATION)
+    return meta, results
+
+
+def stream_tsl(xml_content, ca_handler=extract_ca):
+    """
+    Потоковый разбор TSL. ca_handler вызывается для каждого УдостоверяющийЦентр
+    и должен быть без побочных эффектов: при ошибке кодировки разбор повторяется
+    с начала по очищенному от невалидных UTF-8 последовательностей документу.
+    Возвращает (meta, results), где results — непустые результаты ca_handler.
+    """
+    data = xml_content if isinstance(xml_content, (bytes, bytearray)) else xml_content.encode('utf-8')
+    try:
+        return _scan(data, ca_handler)
+    except ET.ParseError as e:
+        cleaned = bytes(data).decode('utf-8', errors='ignore').encode('utf-8')
+        if cleaned == data:
+            raise
+        logger.warning(f"TSL содержит невалидные UTF-8 последовательности ({e}), повторный разбор без них")
+        return _scan(cleaned, ca_handler)
@@ -0,0 +1,162 @@
+# ./url_canon.py
+"""
+Каноническая форма URL CRL и группировка URL по CRL.
+
+Варианты одного URL (регистр схемы и хоста, порт по умолчанию, пробелы,
+повторные '/', регистр и избыточность percent-encoding) приводятся к одной
+строке. Группа — одна CRL, опубликованная на нескольких зеркалах: URL с одним
+именем файла объединяются, только если у них общий УЦ-издатель (по карте
+URL -> УЦ) или их хосты входят в один набор зеркал (CDP_SOURCES,
+CRL_MIRROR_HOSTS). Одноименные CRL разных УЦ не смешиваются.
+"""
+import posixpath
+import re
+from collections import defaultdict
+from urllib.parse import urlsplit, urlunsplit
+
+from config import CDP_SOURCES, CRL_MIRROR_HOSTS
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+_PERCENT_RE = re.compile(r'%([0-9A-Fa-f]{2})')
+_UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+_SLASHES_RE = re.compile(r'/{2,}')
+
+
+def _normalize_percent(match):
+    char = chr(int(match.group(1), 16))
+    # Незарезервированные символы декодируются, остальные escape-последовательности — в верхнем регистре
+    return char if char in _UNRESERVED else '%' + match.group(1).upper()
+
+
+def _split(url):
+    """(scheme, host, port, path, query) в канонической форме или None для нераспознанного URL."""
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except (ValueError, AttributeError):
+        return None
+    host = (parts.hostname or '').rstrip('.')
+    if not parts.scheme or not host:
+        return None
+    scheme = parts.scheme.lower()
+    if port == DEFAULT_PORTS.get(scheme):
+        port = None
+    path = _SLASHES_RE.sub('/', _PERCENT_RE.sub(_normalize_percent, parts.path)) or '/'
+    query = _PERCENT_RE.sub(_normalize_percent, parts.query)
+    return scheme, host, port, path, query
+
+
+def normalize_url(url):
+    """Каноническая строка URL; нераспознанный URL возвращается без пробелов по краям."""
+    parts = _split(url)
+    if parts is None:
+        return url.strip()
+    scheme, host, port, path, query = parts
+    netloc = f"{host}:{port}" if port else host
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def url_location(url):
+    """Расположение CRL без схемы: (host, port, path, query). http и https варианты — одна CRL."""
+    parts = _split(url)
+    if parts is None:
+        return None, None, url.strip(), ''
+    return parts[1:]
+
+
+def _mirror_sets():
+    """Хост -> номер набора зеркал. Хосты CDP_SOURCES — один набор, плюс наборы из CRL_MIRROR_HOSTS."""
+    host_sets = [[url_location(url)[0] for url in CDP_SOURCES]]
+    host_sets.extend(CRL_MIRROR_HOSTS)
+    mirror_of = {}
+    for index, hosts in enumerate(host_sets):
+        for host in hosts:
+            if host:
+                mirror_of.setdefault(host.lower(), index)
+    return mirror_of
+
+
+class CrlGroup:
+    """Одна CRL: имя (ключ состояния), издатель (reg_number или None) и URL зеркал."""
+
+    def __init__(self, name, issuer, urls):
+        self.name = name
+        self.issuer = issuer
+        self.urls = urls
+
+
+def group_crl_urls(urls, issuer_of=None):
+    """
+    Группировка URL по CRL. issuer_of(url) возвращает reg_number УЦ или None.
+    Имя группы — имя файла CRL, а при совпадении имен файлов у разных CRL — хост и путь.
+    Возвращает {name: CrlGroup}.
+    """
+    mirror_of = _mirror_sets()
+    # 1. Варианты одного расположения (http/https) — одна CRL
+    by_location = defaultdict(list)
+    for url in urls:
+        by_location[url_location(url)].append(url)
+
+    # 2. Объединение зеркал (union-find): по общему издателю или общему набору зеркал при одинаковом имени файла
+    parent = {location: location for location in by_location}
+    issuer = {}
+    for location, location_urls in by_location.items():
+        if issuer_of is not None:
+            issuer[location] = next((i for i in map(issuer_of, location_urls) if i), None)
+        else:
+            issuer[location] = None
+
+    def find(location):
+        while parent[location] != location:
+            parent[location] = parent[parent[location]]
+            location = parent[location]
+        return location
+
+    def union(a, b):
+        ra, rb = find(a), find(b)
+        if ra == rb:
+            return
+        # Группы разных известных УЦ не объединяются
+        if issuer[ra] and issuer[rb] and issuer[ra] != issuer[rb]:
+            return
+        parent[rb] = ra
+        issuer[ra] = issuer[ra] or issuer[rb]
+
+    anchors = {}
+    for location in sorted(by_location, key=lambda loc: (loc[0] or '', loc[1] or 0, loc[2], loc[3])):
+        host, _, path, query = location
+        basename = posixpath.basename(path)
+        keys = []
+        if issuer[location]:
+            keys.append(('issuer', issuer[location], basename, query))
+        if host in mirror_of:
+            keys.append(('mirror', mirror_of[host], basename, query))
+        for key in keys:
+            if key in anchors:
+                union(anchors[key], location)
+            else:
+                anchors[key] = location
+
+    members = defaultdict(list)
+    for location in by_location:
+        members[find(location)].append(location)
+
+    # 3. Имена групп: имя файла, если оно уникально (совместимо с прежними ключами состояния), иначе хост и путь
+    by_basename = defaultdict(list)
+    for root, locations in members.items():
+        locations.sort(key=lambda loc: (loc[0] or '', loc[1] or 0, loc[2], loc[3]))
+        by_basename[posixpath.basename(locations[0][2])].append(root)
+    groups = {}
+    for basename, roots in by_basename.items():
+        for root in roots:
+            locations = members[root]
+            if len(roots) == 1:
+                name = basename
+            else:
+                host, port, path, query = locations[0]
+                name = f"{host}:{port}{path}" if port else f"{host}{path}"
+                if query:
+                    name = f"{name}?{query}"
+            group_urls = sorted(url for location in locations for url in by_location[location])
+            groups[name] = CrlGroup(name, issuer[root], group_urls)
+    return groups
@@ -0,0 +1,137 @@
+# ./url_events.py
+"""
+Канал событий об изменении набора URL CRL из TSL.
+
+В одном процессе TSL Monitor публикует новый набор URL, а подписчики (CRL Monitor)
+получают дельту (добавленные/удаленные URL) сразу, без перечитывания файлов.
+Для раздельного запуска мониторов в разных процессах UrlSetFileWatcher следит
+за mtime crl_urls_from_tsl.txt и crl_url_to_ca_mapping.json и публикует
+изменения в тот же канал.
+"""
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class UrlSetDelta:
+    """Изменение набора URL: полный новый набор и разница с предыдущей публикацией."""
+
+    def __init__(self, version, urls, added, removed, url_to_ca_map=None):
+        self.version = version
+        self.urls = frozenset(urls)
+        self.added = frozenset(added)
+        self.removed = frozenset(removed)
+        self.url_to_ca_map = url_to_ca_map
+
+    def relative_to(self, known_urls):
+        """Добавленные и удаленные URL относительно набора, известного подписчику."""
+        return self.urls - known_urls, known_urls - self.urls
+
+
+class UrlSetChannel:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._urls = frozenset()
+        self._version = None
+        self._url_to_ca_map = None
+        self._subscribers = []
+
+    def current(self):
+        return self._version, self._urls
+
+    def publish(self, version, urls, url_to_ca_map=None):
+        """Публикация нового набора URL; подписчики уведомляются, если набор или карта URL -> УЦ изменились."""
+        urls = frozenset(urls or ())
+        with self._lock:
+            added = urls - self._urls
+            removed = self._urls - urls
+            map_changed = url_to_ca_map is not None and url_to_ca_map != self._url_to_ca_map
+            if not added and not removed and not map_changed and self._version is not None:
+                self._version = version
+                return None
+            delta = UrlSetDelta(version, urls, added, removed, url_to_ca_map if map_changed else None)
+            self._urls = urls
+            self._version = version
+            if url_to_ca_map is not None:
+                self._url_to_ca_map = url_to_ca_map
+            subscribers = list(self._subscribers)
+        logger.info(f"Набор URL CRL из TSL обновлен (версия {version}): +{len(added)} / -{len(removed)}, всего {len(urls)}")
+        for callback in subscribers:
+            try:
+                callback(delta)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика изменения набора URL CRL: {e}")
+        return delta
+
+    def subscribe(self, callback):
+        """Подписка на дельты; если набор уже опубликован, callback сразу получает его целиком."""
+        with self._lock:
+            self._subscribers.append(callback)
+            replay = None
+            if self._version is not None:
+                replay = UrlSetDelta(self._version, self._urls, self._urls, (), self._url_to_ca_map)
+        if replay is not None:
+            callback(replay)
+
+
+class UrlSetFileWatcher:
+    """Fallback для раздельных процессов: публикует в канал содержимое файлов TSL Monitor при смене их mtime."""
+
+    def __init__(self, channel, urls_file, mapping_file=None, interval=30):
+        self.channel = channel
+        self.urls_file = urls_file
+        self.mapping_file = mapping_file
+        self.interval = interval
+        self._mtimes = None
+        self._stop = threading.Event()
+
+    def _current_mtimes(self):
+        mtimes = []
+        for path in (self.urls_file, self.mapping_file):
+            try:
+                mtimes.append(os.path.getmtime(path) if path else None)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def poll(self):
+        """Однократная проверка файлов. Возвращает опубликованную дельту или None."""
+        mtimes = self._current_mtimes()
+        if mtimes == self._mtimes or mtimes[0] is None:
+            return None
+        self._mtimes = mtimes
+        try:
+            with open(self.urls_file, 'r', encoding='utf-8') as f:
+                urls = {line.strip() for line in f if line.strip()}
+        except Exception as e:
+            logger.error(f"Ошибка чтения URL CRL из {self.urls_file}: {e}")
+            return None
+        url_to_ca_map = None
+        if self.mapping_file and mtimes[1] is not None:
+            try:
+                with open(self.mapping_file, 'r', encoding='utf-8') as f:
+                    url_to_ca_map = json.load(f)
+            except Exception as e:
+                logger.error(f"Ошибка чтения карты URL -> УЦ из {self.mapping_file}: {e}")
+        return self.channel.publish(f"file@{int(mtimes[0])}", urls, url_to_ca_map)
+
+    def start(self):
+        def _loop():
+            while not self._stop.is_set():
+                try:
+                    self.poll()
+                except Exception as e:
+                    logger.error(f"Ошибка отслеживания файлов URL CRL: {e}")
+                self._stop.wait(self.interval)
+
+        threading.Thread(target=_loop, name="UrlSetFileWatcher", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# Общий канал набора URL CRL из TSL для мониторов в одном процессе
+crl_url_channel = UrlSetChannel()
@@ -0,0 +1,166 @@
+# ./url_inventory.py
+"""
+Версионированный инвентарь URL CRL.
+
+Итоговый набор URL (CDP_SOURCES + KNOWN_CRL_PATHS + TSL, с фильтром ФНС, в
+канонической форме url_canon.normalize_url) пересчитывается только при
+изменении входных данных: листингов CDP, набора URL из TSL или настроек
+фильтра. Каждая новая версия сохраняется в БД вместе с дельтой
+(добавленные/удаленные URL). Внутри цикла проверки все потребители получают
+один и тот же неизменяемый снимок без повторного обхода CDP.
+"""
+import hashlib
+import logging
+import threading
+
+from config import CDP_SOURCES, KNOWN_CRL_PATHS, FNS_ONLY, FNS_DOMAINS, DB_ENABLED
+from metrics import crl_url_inventory_size, crl_url_inventory_rebuilds
+from url_canon import normalize_url
+
+logger = logging.getLogger(__name__)
+
+
+def is_fns_url(url):
+    return any(domain in url.lower() for domain in FNS_DOMAINS)
+
+
+def _set_digest(urls):
+    return hashlib.sha256('\n'.join(sorted(urls)).encode('utf-8')).hexdigest()
+
+
+class InventorySnapshot:
+    """Неизменяемая версия инвентаря: набор URL, источник каждого URL и дельта относительно предыдущей версии."""
+
+    def __init__(self, version, inputs_hash, sources, added=(), removed=()):
+        self.version = version
+        self.inputs_hash = inputs_hash
+        self.sources = dict(sources)
+        self.urls = frozenset(self.sources)
+        self.added = frozenset(added)
+        self.removed = frozenset(removed)
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __iter__(self):
+        return iter(self.urls)
+
+
+class UrlInventory:
+    def __init__(self, parser, persist=DB_ENABLED):
+        self.parser = parser
+        self.persist = persist
+        self._lock = threading.Lock()
+        # Входные данные: {url: источник} из CDP (None до первого обхода) и набор URL из TSL
+        self._cdp_sources = None
+        self._cdp_digest = None
+        self._tsl_urls = frozenset()
+        self._tsl_digest = _set_digest(())
+        self._snapshot = self._load()
+
+    def _load(self):
+        """Последняя сохраненная версия — база для дельты первой версии после рестарта."""
+        if self.persist:
+            try:
+                from db import url_inventory_load
+                loaded = url_inventory_load()
+                if loaded:
+                    version, inputs_hash, sources = loaded
+                    logger.info(f"Инвентарь URL CRL загружен из БД: версия {version}, URL={len(sources)}")
+                    return InventorySnapshot(version, inputs_hash, sources)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки инвентаря URL CRL из БД: {e}")
+        return InventorySnapshot(None, None, {})
+
+    def current(self):
+        """Текущая версия инвентаря (без обращения к сети)."""
+        return self._snapshot
+
+    def discover_cdp(self):
+        """Обход CDP_SOURCES и KNOWN_CRL_PATHS. Возвращает {url: источник}."""
+        sources = {}
+        for cdp_url in CDP_SOURCES:
+            # В режиме FNS_ONLY обрабатываем только CDP, принадлежащие ФНС
+            if FNS_ONLY and not is_fns_url(cdp_url):
+                logger.info(f"CDP источник {cdp_url} не принадлежит доменам ФНС. Пропускаем в режиме FNS_ONLY.")
+                continue
+            urls_from_cdp = self.parser.get_crl_urls_from_cdp(cdp_url)
+            logger.info(f"Найдено {len(urls_from_cdp)} CRL в CDP {cdp_url}{' (ФНС)' if FNS_ONLY else ''}")
+            for url in urls_from_cdp:
+                sources.setdefault(normalize_url(url), 'cdp')
+            # Известные пути добавляются вручную
+            for path in KNOWN_CRL_PATHS:
+                sources.setdefault(normalize_url(cdp_url.rstrip('/') + '/' + path), 'known')
+        return sources
+
+    def refresh(self):
+        """Новый цикл проверки: обход CDP и пересчет инвентаря, если входные данные изменились."""
+        sources = self.discover_cdp()
+        with self._lock:
+            self._cdp_sources = sources
+            self._cdp_digest = _set_digest(f"{source}:{url}" for url, source in sources.items())
+            return self._rebuild()
+
+    def set_tsl_urls(self, urls):
+        """Новый набор URL из TSL. Возвращает (added, removed) относительно предыдущего набора TSL."""
+        urls = frozenset(urls or ())
+        with self._lock:
+            added = urls - self._tsl_urls
+            removed = self._tsl_urls - urls
+            if added or removed:
+                self._tsl_urls = urls
+                self._tsl_digest = _set_digest(urls)
+                # До первого обхода CDP инвентарь не пересчитывается: иначе версия без URL из CDP дала бы ложную дельту
+                if self._cdp_sources is not None:
+                    self._rebuild()
+        return added, removed
+
+    def _inputs_hash(self):
+        fns = f"fns={FNS_ONLY}:{','.join(sorted(FNS_DOMAINS))}" if FNS_ONLY else "fns=False"
+        key = f"cdp={self._cdp_digest}|tsl={self._tsl_digest}|{fns}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _rebuild(self):
+        """Пересчет набора URL под блокировкой; при неизменных входных данных возвращает текущую версию."""
+        inputs_hash = self._inputs_hash()
+        previous = self._snapshot
+        if inputs_hash == previous.inputs_hash:
+            crl_url_inventory_rebuilds.labels(result='unchanged').inc()
+            return previous
+
+        sources = {}
+        for url, source in self._cdp_sources.items():
+            if not FNS_ONLY or is_fns_url(url):
+                sources[url] = source
+        for url in self._tsl_urls:
+            if not FNS_ONLY or is_fns_url(url):
+                sources.setdefault(normalize_url(url), 'tsl')
+
+        added = sources.keys() - previous.urls
+        removed = previous.urls - sources.keys()
+        version = previous.version
+        if added or removed or version is None:
+            version = self._persist(inputs_hash, sources, added, removed, previous.version)
+        snapshot = InventorySnapshot(version, inputs_hash, sources, added, removed)
+        self._snapshot = snapshot
+        crl_url_inventory_rebuilds.labels(result='changed').inc()
+        crl_url_inventory_size.set(len(snapshot))
+        mode_info = "ФНС" if FNS_ONLY else "Все УЦ"
+        logger.info(
+            f"Инвентарь URL CRL ({mode_info}): версия {version}, всего {len(snapshot)}, "
+            f"+{len(added)} / -{len(removed)} (TSL: {len(self._tsl_urls)})"
+        )
+        return snapshot
+
+    def _persist(self, inputs_hash, sources, added, removed, previous_version):
+        if not self.persist:
+            return (previous_version or 0) + 1
+        try:
+            from db import url_inventory_commit
+            return url_inventory_commit(inputs_hash, sources, added, removed)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения инвентаря URL CRL в БД: {e}")
+            return previous_version
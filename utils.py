@@ -4,6 +4,7 @@
 """
 import os
 import logging
+import signal
 from datetime import datetime, timezone
 from typing import Optional
 from config import MOSCOW_TZ
@@ -91,3 +92,9 @@ def setup_logging(log_file: str, logger_name: str = None):
         ]
     )
     return logger_obj
+
+
+def install_sigterm_handler():
+    """SIGTERM (docker stop, kill -TERM в entrypoint.sh) обрабатывается как Ctrl-C: мониторы досылают очереди уведомлений.
+    Вызывается из главного потока процесса."""
+    signal.signal(signal.SIGTERM, signal.default_int_handler)